@@ -1,91 +1,421 @@
 # SEM RAG Chatbot FastAPI Application
 
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import HTMLResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, Request, Response, HTTPException, Header
+from fastapi.responses import HTMLResponse, StreamingResponse, JSONResponse
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
+from typing import List, Optional
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-import traceback
-from rag_chatbot.chatbot import get_chatbot_response
+import asyncio
+import json
+import logging
+import os
+import secrets
+import time
 
 # Load environment variables from .env
 load_dotenv()
 
+logging.basicConfig(
+    level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+    format="%(asctime)s %(levelname)s %(name)s %(message)s"
+)
+logger = logging.getLogger("app")
+
+# Nothing heavy is loaded here: the model, index and LLM client are loaded by the warmup
+started_importing = time.perf_counter()
+from rag_chatbot.chatbot import get_chatbot_response, stream_chatbot_response, get_chatbot_responses_batch, semantic_cache, session_store, single_flight, snapshots, vector_stores, warmup, INDEX_BUILD_COMMAND
+from rag_chatbot.executors import StageOverloadedError, stage_stats
+from rag_chatbot.llm import llm_client
+from rag_chatbot.metrics import REQUEST_LATENCY, REQUESTS, render_latest
+from rag_chatbot.timing import start_request, server_timing_header, timings_ms, log_request
+from rag_chatbot.compression import JSONGZipMiddleware
+from rag_chatbot.static_assets import CachedPages, StaticAssets
+from rag_chatbot import profiling
+IMPORT_SECONDS = round(time.perf_counter() - started_importing, 3)
+
 # Check API key availability
-import os
-print(f"✅ GEMINI_API_KEY loaded: {'YES' if os.getenv('GEMINI_API_KEY') else 'NO'}")
+logger.info("GEMINI_API_KEY loaded: %s", 'YES' if os.getenv('GEMINI_API_KEY') else 'NO')
+
+# Opt-in profiling; the signal handlers are inherited by prefork workers
+PROFILING_TOKEN = os.getenv('PROFILING_TOKEN')
+PROFILE_MAX_SECONDS = float(os.getenv('PROFILE_MAX_SECONDS', '60'))
+profiling.install_signal_handlers()
+
+# Index snapshot admin endpoints; disabled unless a token is set
+ADMIN_API_TOKEN = os.getenv('ADMIN_API_TOKEN')
+index_build = None  # The running `indexer --snapshot` process started from this worker
+
+# Seconds between warmup attempts after a failure (e.g. the model download failed)
+WARMUP_RETRY_SECONDS = float(os.getenv('WARMUP_RETRY_SECONDS', '10'))
+
+async def run_warmup():
+    # In a thread, so /health and /ready are answered while the model and index load
+    while not await asyncio.to_thread(warmup.run):
+        await asyncio.sleep(WARMUP_RETRY_SECONDS)
+
+@asynccontextmanager
+async def lifespan(app):
+    warmup_task = asyncio.create_task(run_warmup())
+    yield
+    warmup_task.cancel()
 
 app = FastAPI(
     title="SEM Chatbot API",
     description="Smart Assistant for SEM",
-    version="2.0.0"
+    version="2.0.0",
+    lifespan=lifespan
 )
 
-# Mount static files
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# JSON responses above GZIP_MIN_BYTES are gzipped; streams are left alone
+app.add_middleware(JSONGZipMiddleware)
+
+# Static files: content-hashed, precompressed and held in memory (see rag_chatbot/static_assets.py)
+static_assets = StaticAssets().load()
 
-# Templates
+# Templates: the pages take no per-request data, so each is rendered once (CACHE_TEMPLATES=0 re-renders)
+CACHE_TEMPLATES = os.getenv('CACHE_TEMPLATES', '1') == '1'
 templates = Jinja2Templates(directory="templates")
+templates.env.globals['static_url'] = static_assets.url
+pages = CachedPages(templates.env, cache=CACHE_TEMPLATES)
+
+@app.exception_handler(StageOverloadedError)
+async def stage_overloaded_handler(request: Request, exc: StageOverloadedError):
+    """Shed load quickly instead of queueing without limit"""
+    logger.warning("Load shedding: %s", exc)
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "The server is busy, please try again shortly."},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
 
 # Pydantic models
 class ChatMessage(BaseModel):
     message: str
+    session_id: Optional[str] = None  # From an earlier response; omitted or expired starts a new session
 
 class ChatResponse(BaseModel):
     response: str
+    session_id: Optional[str] = None
+
+class BatchChatRequest(BaseModel):
+    messages: List[str]
+    retrieval_only: bool = False
+
+class BatchChatResult(BaseModel):
+    message: str
+    response: Optional[str] = None
+    context: Optional[str] = None
+    error: Optional[str] = None
+
+class BatchChatResponse(BaseModel):
+    results: List[BatchChatResult]
+
+# Offline batch endpoint settings; the endpoint is disabled unless a token is set
+BATCH_API_TOKEN = os.getenv('BATCH_API_TOKEN')
+BATCH_MAX_MESSAGES = int(os.getenv('BATCH_MAX_MESSAGES', '1000'))
+BATCH_LLM_CONCURRENCY = int(os.getenv('BATCH_LLM_CONCURRENCY', '8'))
 
 @app.get("/", response_class=HTMLResponse)
 async def index(request: Request):
     """Serve the main page"""
-    return templates.TemplateResponse("index.html", {"request": request})
+    return pages.response("index.html", request.headers)
 
 @app.get("/backpage", response_class=HTMLResponse)
 async def backpage(request: Request):
     """Serve the backpage"""
-    return templates.TemplateResponse("backpage.html", {"request": request})
+    return pages.response("backpage.html", request.headers)
+
+@app.api_route("/static/{path:path}", methods=["GET", "HEAD"])
+async def static_file(path: str, request: Request):
+    """
+    Static files, precompressed (br/gzip) with strong ETags. Hashed names
+    (as linked from the pages) are immutable; the plain names that embedding
+    sites may use are cached briefly and revalidated.
+    """
+    response = static_assets.response(path, request.headers)
+    if response is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return response
+
+def check_ready():
+    """Chat endpoints answer 503 until the warmup is done"""
+    if not warmup.ready:
+        raise HTTPException(status_code=503, detail="The server is starting up, please try again shortly.",
+                            headers={"Retry-After": str(int(WARMUP_RETRY_SECONDS))})
 
 @app.post("/chat", response_model=ChatResponse)
-async def chat(chat_message: ChatMessage):
+async def chat(chat_message: ChatMessage, response: Response):
     """
     Chat endpoint - processes user messages and returns AI responses
     """
+    check_ready()
+    timings = start_request()
+    started = time.perf_counter()
+    outcome = "ok"
     try:
         user_message = chat_message.message
-        print(f"\n--- NEW REQUEST RECEIVED ---")
-        print(f"User Message: {user_message}")
+        logger.debug("Chat request: %s", user_message)
+        session_id, turns = session_store.open(chat_message.session_id)
         
         # Call chatbot response function
-        response_text = await get_chatbot_response(user_message)
+        response_text = await get_chatbot_response(user_message, session_id, turns)
         
-        print("Step 7: Final response generated, sending to frontend.")
-        return ChatResponse(response=response_text)
+        response.headers["Server-Timing"] = server_timing_header(timings)
+        return ChatResponse(response=response_text, session_id=session_id)
         
-    except Exception as e:
-        print(f"\n!!!!!! FATAL ERROR IN CHAT ROUTE !!!!!!")
-        print(f"Error Type: {type(e).__name__}")
-        print(f"Error Details: {e}")
-        traceback.print_exc()
+    except StageOverloadedError:
+        outcome = "overloaded"
+        raise
+    except Exception:
+        outcome = "error"
+        logger.exception("Fatal error in chat route")
         
         raise HTTPException(
             status_code=500, 
             detail="A critical error occurred on the server. Please check the logs."
         )
+    finally:
+        finish_request("chat", timings, started, outcome)
+
+def finish_request(endpoint, timings, started, outcome):
+    """Record end-to-end latency and outcome of a request and log its stage timings"""
+    elapsed = time.perf_counter() - started
+    REQUEST_LATENCY.labels(endpoint).observe(elapsed)
+    REQUESTS.labels(endpoint, outcome).inc()
+    log_request(endpoint, timings, elapsed, outcome)
+
+def format_sse(event, data, **extra):
+    """Format one Server-Sent Event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps({'text': data, **extra})}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream(chat_message: ChatMessage):
+    """
+    Streaming chat endpoint - sends the AI response as Server-Sent Events.
+    Events: "token" (answer text as it is generated), "media" (media block
+    appended after the answer), "error" and a final "done" (with stage
+    timings and the session id to send with the next message).
+    """
+    check_ready()
+    timings = start_request()
+    started = time.perf_counter()
+    user_message = chat_message.message
+    logger.debug("Streaming chat request: %s", user_message)
+    session_id, turns = session_store.open(chat_message.session_id)
+
+    events = stream_chatbot_response(user_message, session_id, turns)
+
+    # Pull the first event before the response starts, so an overloaded
+    # stage can still be answered with a plain 503 + Retry-After
+    try:
+        first_event = await events.__anext__()
+    except StopAsyncIteration:
+        first_event = None
+    except StageOverloadedError:
+        finish_request("stream", timings, started, "overloaded")
+        raise
+    except Exception:
+        logger.exception("Fatal error in chat stream route")
+        first_event = ("error", "A critical error occurred on the server. Please check the logs.")
+
+    async def event_generator():
+        outcome = "error" if first_event and first_event[0] == "error" else "ok"
+        try:
+            if first_event is not None:
+                yield format_sse(*first_event)
+                async for event, data in events:
+                    yield format_sse(event, data)
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        except Exception:
+            outcome = "error"
+            logger.exception("Fatal error in chat stream route")
+            yield format_sse("error", "A critical error occurred on the server. Please check the logs.")
+        finally:
+            finish_request("stream", timings, started, outcome)
+        yield format_sse("done", "", timings=timings_ms(timings), session_id=session_id)
+
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # Disable proxy buffering so tokens arrive immediately
+        }
+    )
+
+@app.post("/chat/batch", response_model=BatchChatResponse)
+async def chat_batch(batch: BatchChatRequest, authorization: Optional[str] = Header(None)):
+    """
+    Batch chat endpoint for offline jobs (evaluation, FAQ generation).
+    Requires "Authorization: Bearer <BATCH_API_TOKEN>". Retrieval runs in bulk,
+    LLM calls run with bounded concurrency; retrieval_only skips the LLM.
+    """
+    if not BATCH_API_TOKEN:
+        raise HTTPException(status_code=403, detail="Batch endpoint is disabled.")
+    if not authorization or not secrets.compare_digest(authorization, f"Bearer {BATCH_API_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Invalid or missing batch API token.")
+    if len(batch.messages) > BATCH_MAX_MESSAGES:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_MESSAGES} messages per batch.")
+    check_ready()
+
+    logger.info("Batch request: %d messages", len(batch.messages))
+    results = await get_chatbot_responses_batch(
+        batch.messages,
+        concurrency=BATCH_LLM_CONCURRENCY,
+        retrieval_only=batch.retrieval_only
+    )
+    return BatchChatResponse(results=[BatchChatResult(**result) for result in results])
 
 @app.get("/health")
 async def health_check():
-    """Health check endpoint"""
+    """Liveness: the process is up (it may still be warming up, see /ready)"""
     return {"status": "healthy", "message": "SEM Chatbot API is running"}
 
+@app.get("/ready")
+async def ready_check():
+    """Readiness: 200 once the model and index are loaded and a warmup query went through, else 503"""
+    status = {**warmup.status(), "import_seconds": IMPORT_SECONDS}
+    return JSONResponse(status_code=200 if warmup.ready else 503, content=status)
+
+@app.get("/executors/stats")
+async def executors_stats():
+    """Per-stage pool sizes, queue depths and rejected requests"""
+    return stage_stats()
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Semantic answer cache hit/miss counters"""
+    return semantic_cache.stats()
+
+@app.get("/coalescing/stats")
+async def coalescing_stats():
+    """Identical /chat requests that shared an in-flight run"""
+    return single_flight.stats()
+
+@app.get("/sessions/stats")
+async def sessions_stats():
+    """Live conversation sessions, their estimated memory and evictions"""
+    return session_store.stats()
+
+@app.get("/llm/stats")
+async def llm_stats():
+    """LLM client retries, timeouts, hedges and remaining retry budget"""
+    return llm_client.stats()
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics of this worker process"""
+    body, content_type = render_latest()
+    return Response(content=body, media_type=content_type)
+
+def check_profiling_access(authorization):
+    """Profiling endpoints need PROFILING_ENABLED=1 and an "Authorization: Bearer <PROFILING_TOKEN>" header"""
+    if not profiling.PROFILING_ENABLED or not PROFILING_TOKEN:
+        raise HTTPException(status_code=403, detail="Profiling is disabled.")
+    if not authorization or not secrets.compare_digest(authorization, f"Bearer {PROFILING_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Invalid or missing profiling token.")
+
+@app.get("/debug/profile")
+async def debug_profile(seconds: float = 10, authorization: Optional[str] = Header(None)):
+    """Sample all threads of this worker for `seconds`; returns collapsed stacks (flame graph input)"""
+    check_profiling_access(authorization)
+    seconds = max(0.1, min(seconds, PROFILE_MAX_SECONDS))
+    try:
+        # The sampler runs in a thread so the event loop itself shows up in the profile
+        counts = await asyncio.to_thread(profiling.sample_stacks, seconds)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return Response(content=profiling.format_collapsed(counts), media_type="text/plain")
+
+@app.post("/debug/tracemalloc")
+async def debug_tracemalloc(action: str = "snapshot", limit: int = 25, authorization: Optional[str] = Header(None)):
+    """Start, snapshot (top allocation sites) or stop tracemalloc in this worker"""
+    check_profiling_access(authorization)
+    if action == "start":
+        profiling.start_tracemalloc()
+        return {"status": "started"}
+    if action == "stop":
+        profiling.stop_tracemalloc()
+        return {"status": "stopped"}
+    if action == "snapshot":
+        return {"top": profiling.tracemalloc_report(limit=limit)}
+    raise HTTPException(status_code=400, detail="action must be start, snapshot or stop")
+
+def check_admin_access(authorization):
+    """Admin endpoints need an "Authorization: Bearer <ADMIN_API_TOKEN>" header"""
+    if not ADMIN_API_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled.")
+    if not authorization or not secrets.compare_digest(authorization, f"Bearer {ADMIN_API_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Invalid or missing admin API token.")
+
+def index_status():
+    return {
+        **snapshots.stats(),
+        "serving": vector_stores.stats(),
+        "building": index_build is not None and index_build.returncode is None,
+    }
+
+async def wait_for_index_build(process):
+    global index_build
+    returncode = await process.wait()
+    index_build = None
+    if returncode == 0:
+        # Other workers notice the new CURRENT within INDEX_SNAPSHOT_CHECK_INTERVAL
+        await asyncio.to_thread(vector_stores.reload)
+    else:
+        logger.error("Index snapshot build failed with exit code %d", returncode)
+
+@app.get("/admin/index")
+async def admin_index(authorization: Optional[str] = Header(None)):
+    """Published index snapshots, the one this worker serves, and whether a build is running"""
+    check_admin_access(authorization)
+    return index_status()
+
+@app.post("/admin/index/rebuild", status_code=202)
+async def admin_index_rebuild(full: bool = False, unpin: bool = False, authorization: Optional[str] = Header(None)):
+    """
+    Build and publish a new snapshot in a separate process; serving continues
+    on the current one. After a rollback, unpin=true is required.
+    """
+    global index_build
+    check_admin_access(authorization)
+    if index_build is not None:
+        raise HTTPException(status_code=409, detail="An index snapshot is already being built.")
+    pinned = snapshots.pinned_version()
+    if pinned is not None and not unpin:
+        raise HTTPException(status_code=409,
+                            detail=f"Index snapshot {pinned} is pinned by a rollback; rebuild with ?unpin=true.")
+    command = INDEX_BUILD_COMMAND + (["--full"] if full else []) + (["--unpin"] if unpin else [])
+    index_build = await asyncio.create_subprocess_exec(*command)
+    asyncio.create_task(wait_for_index_build(index_build))
+    return {"status": "building", "pid": index_build.pid}
+
+@app.post("/admin/index/reload")
+async def admin_index_reload(authorization: Optional[str] = Header(None)):
+    """Swap this worker to the current snapshot now instead of at its next check"""
+    check_admin_access(authorization)
+    await asyncio.to_thread(vector_stores.reload)
+    return index_status()
+
+@app.post("/admin/index/rollback")
+async def admin_index_rollback(version: Optional[str] = None, authorization: Optional[str] = Header(None)):
+    """Make `version` (default: the previous one) current again and pin it; all workers follow"""
+    check_admin_access(authorization)
+    try:
+        await asyncio.to_thread(snapshots.rollback, version)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    await asyncio.to_thread(vector_stores.reload)
+    return index_status()
+
 if __name__ == '__main__':
     import uvicorn
     
-    print("🚀 Starting SEM Chatbot Server...")
-    print("📱 Server will be available at: http://localhost:5001")
-    print("📊 API Documentation: http://localhost:5001/docs")
-    print("🔧 Alternative docs: http://localhost:5001/redoc")
-    print("❤️  Health check: http://localhost:5001/health")
-    print("-" * 50)
+    logger.info("Starting SEM Chatbot Server on http://localhost:5001 (docs: /docs, /redoc; health: /health)")
     
     uvicorn.run(
         "app:app", 
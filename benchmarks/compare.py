@@ -0,0 +1,51 @@
+# compare.py
+# Compare two load test result files (benchmarks/load_test.py --output)
+#
+# Usage: python benchmarks/compare.py baseline.json candidate.json
+
+import argparse
+import json
+
+
+def load(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def change(old, new):
+    if old in (None, 0) or new is None:
+        return ""
+    return f"{(new - old) / old * 100:+.1f}%"
+
+
+def rows(report):
+    yield "throughput_rps", "", report.get("throughput_rps")
+    for metric in ("latency_ms", "first_token_ms"):
+        for p in ("p50", "p95", "p99"):
+            yield metric, p, report.get(metric, {}).get(p)
+    for stage, stats in report.get("stages_ms", {}).items():
+        for p in ("p50", "p95", "p99"):
+            yield f"stage:{stage}", p, stats.get(p)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two load test result files")
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    args = parser.parse_args()
+
+    baseline, candidate = load(args.baseline), load(args.candidate)
+    if baseline.get("config") != candidate.get("config"):
+        print("WARNING: the runs used different configurations")
+
+    candidate_rows = {(metric, p): value for metric, p, value in rows(candidate)}
+    print(f"{'metric':<28}{'':<5}{'baseline':>12}{'candidate':>12}{'change':>10}")
+    for metric, p, old in rows(baseline):
+        new = candidate_rows.get((metric, p))
+        if old is None and new is None:
+            continue
+        print(f"{metric:<28}{p:<5}{str(old):>12}{str(new):>12}{change(old, new):>10}")
+
+
+if __name__ == '__main__':
+    main()
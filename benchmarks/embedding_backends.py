@@ -0,0 +1,205 @@
+# embedding_backends.py
+# Compare the embedding backends (EMBEDDING_BACKEND=torch|onnx): load time,
+# memory, encode latency, and how faithful the ONNX vectors are to the
+# PyTorch ones, both as cosine agreement and as top-k retrieval overlap on the
+# existing FAISS index.
+#
+# Every backend is measured in its own subprocess so import time and RSS are
+# not polluted by the other one. Build the ONNX model first with
+# `python -m rag_chatbot.onnx_export`.
+#
+# Usage:
+#   python benchmarks/embedding_backends.py
+#   python benchmarks/embedding_backends.py --backends torch onnx --onnx-files model.onnx model_int8.onnx
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_QUERIES = os.path.join(ROOT, 'benchmarks', 'queries.txt')
+sys.path.insert(0, ROOT)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark and cross-check embedding backends")
+    parser.add_argument('--queries', default=DEFAULT_QUERIES, help="Query corpus, one query per line")
+    parser.add_argument('--backends', nargs='+', default=['torch', 'onnx'])
+    parser.add_argument('--onnx-files', nargs='+', default=['model_int8.onnx'],
+                        help="ONNX model files to compare (in ONNX_MODEL_DIR)")
+    parser.add_argument('--threads', type=int, default=1, help="Intra-op threads")
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--repeat', type=int, default=3, help="Passes over the queries for latency")
+    parser.add_argument('--top-k', type=int, default=15, help="k for retrieval overlap")
+    parser.add_argument('--index', default=os.path.join(ROOT, 'faiss_index.bin'))
+    parser.add_argument('--output', default='embedding_backends.json')
+    # Internal: measure one backend and write its vectors
+    parser.add_argument('--worker', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--onnx-file', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--vectors-out', default=None, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def read_queries(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except FileNotFoundError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentiles_ms(seconds):
+    values = np.sort(np.array(seconds) * 1000)
+    return {
+        "mean": round(float(values.mean()), 3),
+        "p50": round(float(np.percentile(values, 50)), 3),
+        "p95": round(float(np.percentile(values, 95)), 3),
+        "p99": round(float(np.percentile(values, 99)), 3),
+    }
+
+
+def run_worker(args):
+    """Load one backend, time it and save its query vectors"""
+    if args.onnx_file:
+        os.environ['ONNX_MODEL_FILE'] = args.onnx_file
+    os.environ['EMBEDDING_THREADS'] = str(args.threads)
+    queries = read_queries(args.queries)
+    rss_start = rss_mb()
+
+    started = time.perf_counter()
+    from rag_chatbot.embedding import load_encoder
+    encoder = load_encoder(args.worker, threads=args.threads)
+    load_seconds = time.perf_counter() - started
+    rss_loaded = rss_mb()
+
+    encoder.encode(queries[:8], batch_size=8)  # Warm up
+
+    single = []
+    for _ in range(args.repeat):
+        for query in queries:
+            started = time.perf_counter()
+            encoder.encode([query], batch_size=1)
+            single.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    for _ in range(args.repeat):
+        vectors = encoder.encode(queries, batch_size=args.batch_size)
+    batch_seconds = (time.perf_counter() - started) / args.repeat
+
+    np.save(args.vectors_out, np.asarray(vectors, dtype=np.float32))
+    print(json.dumps({
+        "load_s": round(load_seconds, 3),
+        "rss_after_load_mb": round(rss_loaded, 1),
+        "rss_model_mb": round(rss_loaded - rss_start, 1),
+        "rss_peak_mb": round(rss_mb(), 1),
+        "single_query_ms": percentiles_ms(single),
+        "batch_queries_per_s": round(len(queries) / batch_seconds, 1),
+    }))
+
+
+def measure(args, backend, onnx_file, vectors_path):
+    command = [sys.executable, os.path.abspath(__file__), '--worker', backend, '--vectors-out', vectors_path,
+               '--queries', args.queries, '--threads', str(args.threads),
+               '--batch-size', str(args.batch_size), '--repeat', str(args.repeat)]
+    if onnx_file:
+        command += ['--onnx-file', onnx_file]
+    output = subprocess.check_output(command, cwd=ROOT, text=True)
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def cosine_agreement(reference, vectors):
+    cosines = np.sum(reference * vectors, axis=1) / (
+        np.linalg.norm(reference, axis=1) * np.linalg.norm(vectors, axis=1))
+    return {
+        "mean": round(float(cosines.mean()), 5),
+        "p5": round(float(np.percentile(cosines, 5)), 5),
+        "min": round(float(cosines.min()), 5),
+    }
+
+
+def retrieval_overlap(index, reference, vectors, k):
+    """Mean fraction of the reference top-k ids also returned for the other vectors"""
+    import faiss
+
+    reference = np.ascontiguousarray(reference, dtype=np.float32)
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    faiss.normalize_L2(reference)
+    faiss.normalize_L2(vectors)
+    _, reference_ids = index.search(reference, k)
+    _, ids = index.search(vectors, k)
+    overlaps = [len(set(a[a >= 0]) & set(b[b >= 0])) / max(1, len(a[a >= 0]))
+                for a, b in zip(reference_ids, ids)]
+    top1 = np.mean(reference_ids[:, 0] == ids[:, 0])
+    return {"overlap_at_k": round(float(np.mean(overlaps)), 4), "top1_agreement": round(float(top1), 4)}
+
+
+def main():
+    args = parse_args()
+    if args.worker:
+        run_worker(args)
+        return
+
+    runs = []
+    for backend in args.backends:
+        for onnx_file in (args.onnx_files if backend == 'onnx' else [None]):
+            runs.append((backend, onnx_file))
+
+    results = {}
+    vectors = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend, onnx_file in runs:
+            name = backend if onnx_file is None else f"{backend}:{onnx_file}"
+            print(f"Measuring {name} ...")
+            path = os.path.join(tmp, f"{len(vectors)}.npy")
+            results[name] = measure(args, backend, onnx_file, path)
+            vectors[name] = np.load(path)
+
+    reference = 'torch' if 'torch' in vectors else None
+    index = None
+    if reference and os.path.exists(args.index):
+        import faiss
+        index = faiss.read_index(args.index)
+    for name, result in results.items():
+        if reference is None or name == reference:
+            continue
+        result["cosine_vs_torch"] = cosine_agreement(vectors[reference], vectors[name])
+        if index is not None:
+            result["retrieval_vs_torch"] = retrieval_overlap(index, vectors[reference], vectors[name], args.top_k)
+
+    print()
+    for name, result in results.items():
+        latency = result["single_query_ms"]
+        print(f"{name:<24} load={result['load_s']}s  model rss={result['rss_model_mb']}MB  "
+              f"query p50={latency['p50']}ms p95={latency['p95']}ms  batch={result['batch_queries_per_s']} q/s")
+        if "cosine_vs_torch" in result:
+            cosine = result["cosine_vs_torch"]
+            print(f"{'':<24} cosine vs torch mean={cosine['mean']} p5={cosine['p5']} min={cosine['min']}")
+        if "retrieval_vs_torch" in result:
+            retrieval = result["retrieval_vs_torch"]
+            print(f"{'':<24} top-{args.top_k} overlap={retrieval['overlap_at_k']} "
+                  f"top-1 agreement={retrieval['top1_agreement']}")
+
+    report = {"config": {"queries": args.queries, "threads": args.threads, "batch_size": args.batch_size,
+                         "top_k": args.top_k}, "backends": results}
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+# entity_tables_check.py
+# Checks that the shared phrase matcher reports a phrase of one table even
+# when a longer phrase of another table (or of the same table) starts at the
+# same position: a brand that is a prefix of a keyword phrase must still be
+# normalized, and a media key that is a prefix of a longer phrase must still
+# be found. Runs on small made-up tables, then on every prefix collision in
+# the shipped data/entities.json.
+#
+# Usage:
+#   python benchmarks/entity_tables_check.py
+
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from rag_chatbot.entity_tables import ENTITIES_PATH, EntityTables, PhraseMatcher  # noqa: E402
+
+MEDIA = {'images': ['example.png'], 'videos': []}
+
+
+def check(name, ok, detail=""):
+    print(f"{'PASS' if ok else 'FAIL'}  {name}" + (f"  ({detail})" if detail else ""))
+    return ok
+
+
+def synthetic_checks():
+    results = []
+    matcher = PhraseMatcher(['search', 'search engine', 'search engine marketing', 'engine'])
+    hits = list(matcher.finditer('search engine marketing'))
+    results.append(check("every phrase at a position is reported, longest first",
+                         hits[:3] == [(0, 23, 'search engine marketing'), (0, 13, 'search engine'), (0, 6, 'search')]
+                         and (7, 13, 'engine') in hits, f"{hits}"))
+
+    tables = EntityTables({
+        'brand_mappings': {'search': 'SEARCH BRAND'},
+        'media_keywords': ['search engine marketing', 'google ads 360 guide'],
+        'media_map': {'google ads': MEDIA, 'google ads 360': MEDIA},
+    })
+    normalized = tables.normalize_brands('Search engine marketing for search')
+    results.append(check("a brand that is a prefix of a keyword phrase is normalized",
+                         normalized == 'SEARCH BRAND engine marketing for SEARCH BRAND', repr(normalized)))
+    results.append(check("the keyword phrase still turns media on",
+                         tables.match_media('search engine marketing')[0]))
+    media = tables.match_media('google ads 360 guide')
+    results.append(check("a media key that is a prefix of a keyword phrase is found",
+                         media == (True, 'google ads'), f"{media}"))
+    media = tables.match_media('what is google ads 360')
+    results.append(check("the first listed of two nested media keys wins",
+                         media == (True, 'google ads'), f"{media}"))
+    return results
+
+
+def shipped_data_checks(path):
+    """Every phrase of the shipped tables that is a prefix of a longer one, from any table"""
+    with open(path, 'r', encoding='utf-8') as f:
+        tables = EntityTables(json.load(f))
+    phrases = sorted(set(tables.brand_mappings) | set(tables.media_priority) | set(tables.media_words)
+                     | tables.show_media_phrases)
+
+    collisions, missed = [], []
+    for phrase in phrases:
+        hits = set(tables.matcher.finditer(phrase))
+        for prefix in phrases:
+            if prefix != phrase and phrase.startswith(prefix):
+                collisions.append(prefix)
+                if (0, len(prefix), prefix) not in hits:
+                    missed.append((prefix, phrase))
+
+    brand_misses = [(brand, phrase) for brand, phrase in missed if brand in tables.brand_mappings]
+    return [
+        check(f"prefixes of longer phrases are reported ({len(set(collisions))} shadowed phrases, "
+              f"e.g. {sorted(set(collisions))[:6]})", not missed, f"{missed[:5]}"),
+        check("brands that prefix a longer phrase are reported", not brand_misses, f"{brand_misses[:5]}"),
+    ]
+
+
+def main():
+    results = synthetic_checks() + shipped_data_checks(ENTITIES_PATH)
+    print(f"\n{sum(results)}/{len(results)} checks passed")
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == '__main__':
+    main()
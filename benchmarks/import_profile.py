@@ -0,0 +1,71 @@
+# import_profile.py
+# Import-time profile of the server: runs `python -X importtime -c "import app"`
+# in a fresh interpreter, prints the slowest imports (cumulative, i.e.
+# including everything they pulled in) and checks that modules which belong
+# to the warmup or to ingestion are not imported by the app at all.
+#
+# Usage:
+#   python benchmarks/import_profile.py
+#   python benchmarks/import_profile.py --top 40 --module rag_chatbot.chatbot
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Loaded by the warmup (model backends, LLM SDK) or only by the indexer (PDF extraction, chunking)
+DEFERRED_MODULES = (
+    'torch', 'sentence_transformers', 'transformers', 'onnxruntime',
+    'google.generativeai',
+    'langchain', 'fitz', 'pymupdf',
+)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Import-time profile of the server")
+    parser.add_argument('--module', default='app', help="Module to import")
+    parser.add_argument('--top', type=int, default=25, help="Slowest imports to list")
+    return parser.parse_args()
+
+
+def profile_imports(module):
+    """[(module, self_us, cumulative_us, depth)] in import order, and the wall time of the import"""
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=ROOT, capture_output=True, text=True)
+    wall = time.perf_counter() - started
+    if result.returncode != 0:
+        sys.exit(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return rows, wall
+
+
+def main():
+    args = parse_args()
+    rows, wall = profile_imports(args.module)
+    imported = {name for name, _, _, _ in rows}
+
+    print(f"import {args.module}: {wall:.2f}s wall (interpreter start included), {len(rows)} modules\n")
+    print(f"{'cumulative':>12} {'self':>10}  module")
+    for name, self_us, cumulative_us, depth in sorted(rows, key=lambda row: -row[2])[:args.top]:
+        print(f"{cumulative_us / 1000:10.1f}ms {self_us / 1000:8.1f}ms  {'  ' * depth}{name}")
+
+    loaded = [name for name in DEFERRED_MODULES if name in imported]
+    print()
+    for name in DEFERRED_MODULES:
+        print(f"{'FAIL' if name in loaded else 'PASS'}  {name} not imported")
+    sys.exit(1 if loaded else 0)
+
+
+if __name__ == '__main__':
+    main()
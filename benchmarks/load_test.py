@@ -0,0 +1,302 @@
+# load_test.py
+# End-to-end load test: starts the FastAPI app with the fake LLM backend and
+# replays a query corpus against it, closed-loop (fixed concurrency) or
+# open-loop (fixed arrival rate). Reports throughput and p50/p95/p99 latency,
+# end-to-end and per stage (from the Server-Timing header / "done" event),
+# and writes everything as JSON so runs can be compared (benchmarks/compare.py).
+#
+# Runs offline on CPU; the embedding model must already be in the local cache.
+#
+# Usage:
+#   python benchmarks/load_test.py --concurrency 16 --requests 500
+#   python benchmarks/load_test.py --rate 20 --duration 60 --endpoint stream --output run.json
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_QUERIES = os.path.join(ROOT, 'benchmarks', 'queries.txt')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load test the chatbot with a fake LLM backend")
+    parser.add_argument('--queries', default=DEFAULT_QUERIES, help="Query corpus, one query per line")
+    parser.add_argument('--endpoint', choices=['chat', 'stream'], default='chat')
+    parser.add_argument('--concurrency', type=int, default=8, help="Closed loop: requests in flight")
+    parser.add_argument('--rate', type=float, default=None,
+                        help="Open loop: Poisson arrivals per second (overrides --concurrency)")
+    parser.add_argument('--requests', type=int, default=200, help="Requests to send (closed loop)")
+    parser.add_argument('--duration', type=float, default=30, help="Seconds of arrivals (open loop)")
+    parser.add_argument('--warmup', type=int, default=10, help="Requests sent before measuring")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--llm-latency', type=float, default=0.5, help="Fake LLM time to first token (s)")
+    parser.add_argument('--llm-jitter', type=float, default=0.1, help="Random extra fake LLM latency (s)")
+    parser.add_argument('--llm-token-delay', type=float, default=0.01, help="Fake LLM seconds per streamed word")
+    parser.add_argument('--cache', action='store_true', help="Keep the semantic cache enabled")
+    parser.add_argument('--coalesce', action='store_true',
+                        help="Keep identical in-flight requests sharing one answer (COALESCE_REQUESTS)")
+    parser.add_argument('--port', type=int, default=5099)
+    parser.add_argument('--url', default=None, help="Benchmark an already running server instead")
+    parser.add_argument('--server-log', default='load_test_server.log')
+    parser.add_argument('--output', default='load_test_results.json')
+    return parser.parse_args()
+
+
+def read_queries(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(values):
+    values = sorted(values)
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), 2),
+        "p50": round(percentile(values, 50), 2),
+        "p95": round(percentile(values, 95), 2),
+        "p99": round(percentile(values, 99), 2),
+        "max": round(values[-1], 2),
+    }
+
+
+def parse_server_timing(header):
+    timings = {}
+    for part in (header or "").split(","):
+        name, _, rest = part.strip().partition(";dur=")
+        if name and rest:
+            timings[name] = float(rest)
+    return timings
+
+
+def start_server(args):
+    env = dict(
+        os.environ,
+        LLM_BACKEND='fake',
+        FAKE_LLM_LATENCY=str(args.llm_latency),
+        FAKE_LLM_JITTER=str(args.llm_jitter),
+        FAKE_LLM_TOKEN_DELAY=str(args.llm_token_delay),
+        HF_HUB_OFFLINE='1',
+        TRANSFORMERS_OFFLINE='1',
+    )
+    if not args.cache:
+        env['SEMANTIC_CACHE_MAX_ENTRIES'] = '0'
+    if not args.coalesce:
+        # The corpus is small, so identical queries are often in flight together
+        env['COALESCE_REQUESTS'] = '0'
+    log = open(args.server_log, 'w')
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'app:app', '--host', '127.0.0.1', '--port', str(args.port),
+         '--log-level', 'warning'],
+        cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+    return process, log
+
+
+async def wait_until_ready(client, process, timeout=300):
+    started = time.time()
+    while time.time() - started < timeout:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError("Server exited during startup, see the server log")
+        try:
+            # /health answers during warmup; /ready only once the model and index are loaded
+            if (await client.get('/ready')).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError("Server did not become ready in time")
+
+
+async def send(client, endpoint, query):
+    """One request; returns a result record (latencies in ms)"""
+    started = time.perf_counter()
+    record = {"query": query, "status": None, "error": None, "latency_ms": None,
+              "first_token_ms": None, "stages": {}}
+    try:
+        if endpoint == 'chat':
+            response = await client.post('/chat', json={"message": query})
+            record["status"] = response.status_code
+            record["stages"] = parse_server_timing(response.headers.get('server-timing'))
+        else:
+            async with client.stream('POST', '/chat/stream', json={"message": query}) as response:
+                record["status"] = response.status_code
+                event = None
+                async for line in response.aiter_lines():
+                    if line.startswith('event: '):
+                        event = line[len('event: '):]
+                    elif line.startswith('data: '):
+                        if event == 'token' and record["first_token_ms"] is None:
+                            record["first_token_ms"] = (time.perf_counter() - started) * 1000
+                        elif event == 'done':
+                            record["stages"] = json.loads(line[len('data: '):]).get('timings', {})
+                        elif event == 'error':
+                            record["error"] = "stream error event"
+    except httpx.HTTPError as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["latency_ms"] = (time.perf_counter() - started) * 1000
+    return record
+
+
+async def run_closed_loop(client, args, queries):
+    results = []
+    counter = iter(range(args.requests))
+
+    async def worker():
+        for i in counter:
+            results.append(await send(client, args.endpoint, queries[i % len(queries)]))
+
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    return results
+
+
+async def run_open_loop(client, args, queries):
+    """Poisson arrivals; latency is measured from the scheduled arrival, so a stalled server isn't hidden"""
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    tasks = []
+    arrival = 0.0
+    i = 0
+    while arrival < args.duration:
+        scheduled = started + arrival
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        request = send(client, args.endpoint, queries[i % len(queries)])
+        tasks.append(asyncio.ensure_future(timed_from(scheduled, request)))
+        i += 1
+        arrival += rng.expovariate(args.rate)
+    return await asyncio.gather(*tasks)
+
+
+async def timed_from(scheduled, request):
+    record = await request
+    # Include time spent waiting for the client to get to this arrival
+    record["latency_ms"] = (time.perf_counter() - scheduled) * 1000
+    return record
+
+
+def build_report(args, results, elapsed, queries):
+    ok = [r for r in results if r["status"] == 200 and not r["error"]]
+    statuses = {}
+    for r in results:
+        key = str(r["status"]) if r["status"] is not None else "transport_error"
+        statuses[key] = statuses.get(key, 0) + 1
+
+    stage_values = {}
+    for r in ok:
+        for stage, ms in r["stages"].items():
+            stage_values.setdefault(stage, []).append(ms)
+
+    return {
+        "config": {
+            "endpoint": args.endpoint,
+            "mode": "open" if args.rate else "closed",
+            "concurrency": None if args.rate else args.concurrency,
+            "rate": args.rate,
+            "requests": len(results),
+            "queries": len(queries),
+            "llm_latency": args.llm_latency,
+            "llm_jitter": args.llm_jitter,
+            "llm_token_delay": args.llm_token_delay,
+            "semantic_cache": args.cache,
+            "coalesce_requests": args.coalesce,
+        },
+        "environment": {
+            "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+        },
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(ok) / elapsed, 2) if elapsed else 0.0,
+        "statuses": statuses,
+        "errors": len(results) - len(ok),
+        "latency_ms": summarize([r["latency_ms"] for r in ok]),
+        "first_token_ms": summarize([r["first_token_ms"] for r in ok if r["first_token_ms"] is not None]),
+        "stages_ms": {stage: summarize(values) for stage, values in sorted(stage_values.items())},
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(report):
+    latency = report["latency_ms"]
+    config = report['config']
+    print(f"\n=== {config['mode']} loop, /{config['endpoint']} "
+          f"(semantic cache {'on' if config['semantic_cache'] else 'off'}, "
+          f"coalescing {'on' if config['coalesce_requests'] else 'off'}) ===")
+    print(f"Throughput: {report['throughput_rps']} req/s   errors: {report['errors']}   statuses: {report['statuses']}")
+    if latency["count"]:
+        print(f"End-to-end  p50={latency['p50']}ms  p95={latency['p95']}ms  p99={latency['p99']}ms")
+    if report["first_token_ms"]["count"]:
+        ttft = report["first_token_ms"]
+        print(f"First token p50={ttft['p50']}ms  p95={ttft['p95']}ms  p99={ttft['p99']}ms")
+    for stage, stats in report["stages_ms"].items():
+        print(f"  {stage:<16} n={stats['count']:<5} p50={stats['p50']}ms  p95={stats['p95']}ms  p99={stats['p99']}ms")
+
+
+async def main():
+    args = parse_args()
+    queries = read_queries(args.queries)
+
+    process = log = None
+    base_url = args.url
+    if base_url is None:
+        process, log = start_server(args)
+        base_url = f"http://127.0.0.1:{args.port}"
+
+    limits = httpx.Limits(max_connections=1000, max_keepalive_connections=1000)
+    try:
+        async with httpx.AsyncClient(base_url=base_url, timeout=300, limits=limits) as client:
+            print(f"Waiting for {base_url} ...")
+            await wait_until_ready(client, process)
+
+            for query in queries[:args.warmup]:
+                await send(client, args.endpoint, query)
+
+            started = time.perf_counter()
+            if args.rate:
+                results = await run_open_loop(client, args, queries)
+            else:
+                results = await run_closed_loop(client, args, queries)
+            elapsed = time.perf_counter() - started
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+            log.close()
+
+    report = build_report(args, results, elapsed, queries)
+    print_report(report)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,267 @@
+# retrieval_eval.py
+# Offline retrieval quality vs latency sweep over the FAISS store.
+#
+# Chunks company_docs with the indexer's own pipeline, embeds the chunks once
+# per embedding backend, builds an in-memory store per index type and runs
+# the labeled queries in benchmarks/retrieval_queries.jsonl through the same
+# ranking and context packing /chat uses for every combination of top_k,
+# score threshold, fallback threshold and retrieval mode:
+#   dense   FAISS only
+#   hybrid  FAISS fused with BM25 (what /chat does after the fast path)
+#   full    the brand/product lexical fast path first, then hybrid
+#
+# Gold chunks are the chunks containing one of a query's "gold" phrases
+# (case-insensitive), so the labels survive re-chunking. Per configuration it
+# reports recall@k (share of a query's gold chunks in its top k, out of at
+# most k) and MRR over the ranked rows (in every mode, before packing), how
+# often a gold chunk and a gold phrase made it into the packed context, the
+# context size in characters and tokens, and search latency percentiles;
+# encode latency is reported per backend.
+#
+# Usage:
+#   python benchmarks/retrieval_eval.py
+#   python benchmarks/retrieval_eval.py --backends torch onnx --index-types flat hnsw ivf_flat \
+#       --top-k 5 10 15 20 --thresholds 0.1 0.15 0.25 0.35 --fallback-thresholds 0.1 0.2 --modes dense hybrid
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_QUERIES = os.path.join(ROOT, 'benchmarks', 'retrieval_queries.jsonl')
+sys.path.insert(0, ROOT)
+
+from rag_chatbot.chunk_store import ChunkStore, ChunkStoreWriter, utf8_offsets  # noqa: E402
+from rag_chatbot.context_packer import MAX_CONTEXT_TOKENS  # noqa: E402
+from rag_chatbot.embedding import EMBEDDING_BACKEND, LocalEmbeddingFunction  # noqa: E402
+from rag_chatbot.entity_tables import entity_tables  # noqa: E402
+from rag_chatbot.lexical_index import LexicalIndex  # noqa: E402
+from rag_chatbot.vector_store import FALLBACK_SCORE_THRESHOLD, FaissVectorStore  # noqa: E402
+
+MODES = ('dense', 'hybrid', 'full')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Retrieval quality vs latency sweep")
+    parser.add_argument('--queries', default=DEFAULT_QUERIES, help="Labeled queries (JSON lines)")
+    parser.add_argument('--docs', default=os.path.join(ROOT, 'company_docs'), help="PDF directory")
+    parser.add_argument('--backends', nargs='+', default=[EMBEDDING_BACKEND])
+    parser.add_argument('--index-types', nargs='+', default=['flat'])
+    parser.add_argument('--top-k', nargs='+', type=int, default=[5, 10, 15, 20])
+    parser.add_argument('--thresholds', nargs='+', type=float, default=[0.1, 0.15, 0.25, 0.35])
+    parser.add_argument('--fallback-thresholds', nargs='+', type=float, default=[FALLBACK_SCORE_THRESHOLD])
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=['hybrid'])
+    parser.add_argument('--recall-at', nargs='+', type=int, default=[1, 5, 10], help="k values for recall@k")
+    parser.add_argument('--max-context-length', type=int, default=25000, help="Character cap, as in /chat")
+    parser.add_argument('--ef-search', type=int, default=None, help="HNSW efSearch")
+    parser.add_argument('--nprobe', type=int, default=None, help="IVF nprobe")
+    parser.add_argument('--repeat', type=int, default=3, help="Passes over the queries for latency")
+    parser.add_argument('--by-group', action='store_true', help="Also print recall/MRR per language and category")
+    parser.add_argument('--output', default='retrieval_eval.json')
+    return parser.parse_args()
+
+
+def read_queries(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def build_chunk_store(docs_path):
+    """Chunk store of company_docs, built exactly as the indexer does"""
+    from rag_chatbot.document_loader import list_pdf_files
+    from rag_chatbot.ingestion import process_document
+
+    writer = ChunkStoreWriter()
+    for filename in list_pdf_files(docs_path):
+        _, _, parents, children = process_document(os.path.join(docs_path, filename))
+        for parent in parents:
+            writer.add_parent(parent.id, parent.text, parent.source)
+        offsets_parent = offsets = None
+        for child_id, parent, start, end in children:
+            if parent is not offsets_parent:
+                offsets_parent, offsets = parent, utf8_offsets(parent.text)
+            writer.add_child(child_id, parent.text[start:end], parent.id, parent.source,
+                             (int(offsets[start]), int(offsets[end])))
+    return ChunkStore(writer.to_bytes())
+
+
+def gold_ids(chunks, queries):
+    """Chunk ids containing one of each query's gold phrases"""
+    texts = [chunks.child_text(row).lower() for row in range(len(chunks))]
+    result = []
+    for query in queries:
+        phrases = [phrase.lower() for phrase in query['gold']]
+        ids = {chunks.child_id(row) for row, text in enumerate(texts) if any(p in text for p in phrases)}
+        if not ids:
+            print(f"warning: no gold chunk for {query['query']!r}")
+        result.append(ids)
+    return result
+
+
+def percentiles_ms(seconds):
+    values = np.sort(np.array(seconds) * 1000)
+    return {
+        "mean": round(float(values.mean()), 3),
+        "p50": round(float(np.percentile(values, 50)), 3),
+        "p95": round(float(np.percentile(values, 95)), 3),
+        "p99": round(float(np.percentile(values, 99)), 3),
+    }
+
+
+def encode_queries(embedding_fn, queries, repeat):
+    """Query vectors (one encode per query, as /chat does without batching) and encode latency"""
+    embedding_fn.embed_query(queries[0]['query'])  # Warm up
+    seconds, vectors = [], []
+    for _ in range(repeat):
+        vectors = []
+        for query in queries:
+            started = time.perf_counter()
+            vectors.append(embedding_fn.embed_query(query['query']))
+            seconds.append(time.perf_counter() - started)
+    return np.vstack(vectors), percentiles_ms(seconds)
+
+
+def build_store(index_type, chunks, lexical, ids, vectors, embedding_fn):
+    store = FaissVectorStore(vectors.shape[1], index_type)
+    store.add_embeddings(ids, vectors)
+    store.train_pending()
+    store.chunks = chunks
+    store.lexical = lexical
+    store.context_packer.count_tokens = embedding_fn.count_tokens
+    store.context_packer.max_tokens = MAX_CONTEXT_TOKENS
+    return store
+
+
+def search(store, mode, query, vector, top_k, threshold, fallback, args):
+    """(context segments, packed chunk ids, ranked chunk ids) like /chat for one query"""
+    rows = None
+    if mode == 'full':
+        # lexical_fast_path, keeping the ranking it packs
+        rows, _ = store.lexical_rows(query, entity_tables.current(), top_k)
+    if rows is None:
+        # search_with_ids without previous_ids, plus efSearch/nprobe
+        query_texts = None if mode == 'dense' else [query]
+        rows = store.ranked_rows(vector, top_k, threshold, args.ef_search, args.nprobe, query_texts, fallback)[0]
+    segments, packed_ids = store.pack_rows_with_ids(rows, args.max_context_length)
+    return segments, packed_ids, store.ids_for_rows(rows)
+
+
+def score(ranked_ids, packed_ids, gold, segments, phrases, recall_at):
+    ranked_ids = [int(i) for i in ranked_ids]
+    metrics = {}
+    for k in recall_at:
+        found = len(gold.intersection(ranked_ids[:k]))
+        metrics[f"recall@{k}"] = found / max(1, min(k, len(gold)))
+    rank = next((i + 1 for i, chunk_id in enumerate(ranked_ids) if chunk_id in gold), None)
+    metrics["mrr"] = 1.0 / rank if rank else 0.0
+    metrics["packed_hit"] = float(not gold.isdisjoint(int(i) for i in packed_ids))
+    context = "\n".join(segments).lower()
+    metrics["context_hit"] = float(any(phrase.lower() in context for phrase in phrases))
+    return metrics
+
+
+def mean_metrics(per_query, names):
+    return {name: round(float(np.mean([m[name] for m in per_query])), 4) for name in names}
+
+
+def evaluate(store, mode, queries, vectors, gold, top_k, threshold, fallback, args, embedding_fn):
+    per_query, seconds, chars, tokens = [], [], [], []
+    for repetition in range(args.repeat):
+        per_query = []
+        for query, vector, gold_set in zip(queries, vectors, gold):
+            started = time.perf_counter()
+            segments, packed_ids, ranked_ids = search(store, mode, query['query'], vector, top_k, threshold,
+                                                      fallback, args)
+            seconds.append(time.perf_counter() - started)
+            per_query.append(score(ranked_ids, packed_ids, gold_set, segments, query['gold'], args.recall_at))
+            if repetition == 0:
+                context = "\n\n".join(segments)
+                chars.append(len(context))
+                tokens.append(embedding_fn.count_tokens(context) if context else 0)
+
+    names = [f"recall@{k}" for k in args.recall_at] + ["mrr", "packed_hit", "context_hit"]
+    result = mean_metrics(per_query, names)
+    result["context_chars"] = round(float(np.mean(chars)), 1)
+    result["context_tokens"] = round(float(np.mean(tokens)), 1)
+    result["search_ms"] = percentiles_ms(seconds)
+
+    groups = {}
+    for key in ('lang', 'category'):
+        for value in sorted({query[key] for query in queries}):
+            members = [m for m, query in zip(per_query, queries) if query[key] == value]
+            groups[f"{key}={value}"] = mean_metrics(members, names)
+    result["groups"] = groups
+    return result
+
+
+def main():
+    args = parse_args()
+    queries = read_queries(args.queries)
+    started = time.perf_counter()
+    chunks = build_chunk_store(args.docs)
+    gold = gold_ids(chunks, queries)
+    ids = np.array([chunks.child_id(row) for row in range(len(chunks))], dtype='int64')
+    texts = [chunks.child_text(row) for row in range(len(chunks))]
+    lexical = LexicalIndex.build(chunks)
+    print(f"{len(queries)} queries, {len(chunks)} chunks from {args.docs} ({time.perf_counter() - started:.1f}s)\n")
+
+    names = [f"recall@{k}" for k in args.recall_at]
+    header = (f"{'backend':<8} {'index':<9} {'mode':<7} {'top_k':>5} {'thr':>5} {'fb':>5} "
+              + " ".join(f"{name:>9}" for name in names)
+              + f" {'MRR':>6} {'packed':>7} {'ctx hit':>7} {'chars':>7} {'tokens':>6} {'p50 ms':>7} {'p95 ms':>7}")
+    results, encoders = [], {}
+    for backend in args.backends:
+        embedding_fn = LocalEmbeddingFunction(backend)
+        started = time.perf_counter()
+        embedding_fn.load()
+        load_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        document_vectors = embedding_fn.embed_documents(texts)
+        embed_seconds = time.perf_counter() - started
+        query_vectors, encode_ms = encode_queries(embedding_fn, queries, args.repeat)
+        encoders[backend] = {"load_s": round(load_seconds, 3),
+                             "documents_per_s": round(len(texts) / max(embed_seconds, 1e-9), 1),
+                             "query_encode_ms": encode_ms}
+        print(f"{backend}: load {load_seconds:.2f}s, {encoders[backend]['documents_per_s']} docs/s, "
+              f"query encode p50={encode_ms['p50']}ms p95={encode_ms['p95']}ms p99={encode_ms['p99']}ms")
+
+        for index_type in args.index_types:
+            store = build_store(index_type, chunks, lexical, ids, document_vectors, embedding_fn)
+            print(f"\n{header}")
+            for mode in args.modes:
+                for fallback in args.fallback_thresholds:
+                    for top_k in args.top_k:
+                        for threshold in args.thresholds:
+                            result = evaluate(store, mode, queries, query_vectors, gold, top_k, threshold,
+                                              fallback, args, embedding_fn)
+                            result.update({"backend": backend, "index_type": index_type, "mode": mode,
+                                           "top_k": top_k, "threshold": threshold, "fallback_threshold": fallback})
+                            results.append(result)
+                            latency = result["search_ms"]
+                            print(f"{backend:<8} {index_type:<9} {mode:<7} {top_k:>5} {threshold:>5} {fallback:>5} "
+                                  + " ".join(f"{result[name]:>9.3f}" for name in names)
+                                  + f" {result['mrr']:>6.3f} {result['packed_hit']:>7.3f} {result['context_hit']:>7.3f} "
+                                  f"{result['context_chars']:>7.0f} {result['context_tokens']:>6.0f} "
+                                  f"{latency['p50']:>7.3f} {latency['p95']:>7.3f}")
+                            if args.by_group:
+                                for group, metrics in result["groups"].items():
+                                    print(f"{'':<8} {group:<33} "
+                                          + " ".join(f"{metrics[name]:>9.3f}" for name in names)
+                                          + f" {metrics['mrr']:>6.3f} {metrics['packed_hit']:>7.3f} "
+                                            f"{metrics['context_hit']:>7.3f}")
+
+    report = {"config": {"queries": args.queries, "docs": args.docs, "chunks": len(chunks),
+                         "max_context_length": args.max_context_length, "max_context_tokens": MAX_CONTEXT_TOKENS,
+                         "ef_search": args.ef_search, "nprobe": args.nprobe, "repeat": args.repeat},
+              "encoders": encoders, "results": results}
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
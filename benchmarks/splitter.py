@@ -0,0 +1,132 @@
+# splitter.py
+# Child chunking: LangChain's RecursiveCharacterTextSplitter (chunk strings)
+# vs SpanSplitter (offsets into the parent text), with the child splitter's
+# settings. Reports time, peak allocation while splitting and the memory the
+# result keeps alive, and checks that both produce the same chunks.
+# Uses the parents of the PDFs in company_docs, or a synthetic corpus of
+# --synthetic-mb megabytes (a stand-in for a large PDF).
+#
+# Usage:
+#   python benchmarks/splitter.py
+#   python benchmarks/splitter.py --synthetic-mb 50 --repeat 3
+
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from rag_chatbot.text_splitter import SpanSplitter  # noqa: E402
+
+CHUNK_SIZE = 400
+CHUNK_OVERLAP = 100
+SEPARATORS = ["\n\n", "\n", ". ", ", ", " "]
+
+WORDS = ("SEM dijital pazarlama kampanya performans müşteri strateji büyüme analiz "
+         "search engine marketing conversion rate optimization brand awareness "
+         "Migros Boyner LC Waikiki e-ticaret satış artışı %35 ROAS 2023").split()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="LangChain splitter vs SpanSplitter")
+    parser.add_argument('--docs', default=os.path.join(ROOT, 'company_docs'), help="PDF directory")
+    parser.add_argument('--synthetic-mb', type=float, default=0, help="Use a synthetic text of this size instead")
+    parser.add_argument('--repeat', type=int, default=3, help="Timed runs per splitter (best is reported)")
+    return parser.parse_args()
+
+
+def synthetic_texts(megabytes, seed=0):
+    """Parent-sized texts with paragraphs, lines, sentences and commas, in ~1 MB parents"""
+    rng = random.Random(seed)
+    texts, total = [], 0
+    while total < megabytes * (1 << 20):
+        paragraphs = []
+        for _ in range(400):
+            sentences = []
+            for _ in range(rng.randint(1, 6)):
+                words = rng.choices(WORDS, k=rng.randint(4, 30))
+                if rng.random() < 0.3:
+                    words[rng.randrange(len(words))] += ","
+                sentences.append(" ".join(words))
+            paragraphs.append(". ".join(sentences) + ("\n" if rng.random() < 0.5 else "."))
+        text = "\n\n".join(paragraphs)
+        texts.append(text)
+        total += len(text.encode('utf-8'))
+    return texts
+
+
+def pdf_texts(docs_path):
+    from rag_chatbot.document_loader import extract_pdf_text, list_pdf_files, split_into_parents
+    texts = []
+    for filename in list_pdf_files(docs_path):
+        full_text, _ = extract_pdf_text(os.path.join(docs_path, filename))
+        texts.extend(parent.text for parent in split_into_parents(full_text, filename))
+    return texts
+
+
+def langchain_splitter():
+    try:
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+    except ImportError:
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+    return RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, separators=SEPARATORS)
+
+
+def best_time(fn, texts, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for text in texts:
+            fn(text)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def memory(fn, texts):
+    """(peak traced allocation while splitting, allocation still held by the results)"""
+    tracemalloc.start()
+    try:
+        start, _ = tracemalloc.get_traced_memory()
+        results = [fn(text) for text in texts]
+        held, peak = tracemalloc.get_traced_memory()
+        del results
+        return peak - start, held - start
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    args = parse_args()
+    texts = synthetic_texts(args.synthetic_mb) if args.synthetic_mb else pdf_texts(args.docs)
+    size = sum(len(text.encode('utf-8')) for text in texts)
+    print(f"{len(texts)} parents, {size / (1 << 20):.2f} MB of text\n")
+
+    span_splitter = SpanSplitter(CHUNK_SIZE, CHUNK_OVERLAP, SEPARATORS)
+    splitters = [("SpanSplitter.split_spans", span_splitter.split_spans)]
+    try:
+        reference = langchain_splitter()
+        splitters.insert(0, ("LangChain split_text", reference.split_text))
+    except ImportError:
+        reference = None
+        print("LangChain text splitter not installed; timing SpanSplitter only\n")
+
+    print(f"{'splitter':<28} {'time':>9} {'MB/s':>8} {'peak alloc':>12} {'result held':>12}")
+    for name, fn in splitters:
+        seconds = best_time(fn, texts, args.repeat)
+        peak, held = memory(fn, texts)
+        print(f"{name:<28} {seconds:8.3f}s {size / (1 << 20) / seconds:8.1f} "
+              f"{peak / (1 << 20):10.2f}MB {held / (1 << 20):10.2f}MB")
+
+    if reference is not None:
+        mismatched = sum(reference.split_text(text) != span_splitter.split_text(text) for text in texts)
+        chunks = sum(len(span_splitter.split_spans(text)) // 2 for text in texts)
+        print(f"\n{chunks} chunks; {'identical output' if not mismatched else f'{mismatched} parents differ'}")
+        sys.exit(1 if mismatched else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+# zero_copy_check.py
+# Checks that embedding vectors reach FAISS without being copied: the search
+# and indexing paths must hand the embedding model's float32 matrix to FAISS
+# as is, and must not allocate anything the size of the query/document matrix.
+# Uses random unit vectors by default; --model also checks the real
+# embedding function's output (dtype, layout, norms).
+#
+# Usage:
+#   python benchmarks/zero_copy_check.py
+#   python benchmarks/zero_copy_check.py --model
+
+import argparse
+import os
+import sys
+import tracemalloc
+from unittest import mock
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from rag_chatbot.chunk_store import ChunkStore  # noqa: E402
+from rag_chatbot.vector_store import FaissVectorStore  # noqa: E402
+from rag_chatbot.vectors import as_unit_vectors  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Check the embedding → FAISS path for copies")
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--corpus', type=int, default=20000, help="Vectors in the test index")
+    parser.add_argument('--queries', type=int, default=256, help="Queries per batch search")
+    parser.add_argument('--model', action='store_true', help="Also check LocalEmbeddingFunction output")
+    return parser.parse_args()
+
+
+def unit_matrix(rng, n, dim):
+    vectors = rng.standard_normal((n, dim), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def peak_allocation(fn, *args):
+    """Largest traced (numpy/Python) memory peak while running fn"""
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        start, _ = tracemalloc.get_traced_memory()
+        fn(*args)
+        _, peak = tracemalloc.get_traced_memory()
+        return peak - start
+    finally:
+        tracemalloc.stop()
+
+
+class FaissInputSpy:
+    """Wraps an index and records whether search/add received the caller's buffer"""
+
+    def __init__(self, index, expected):
+        self.index = index
+        self.expected = expected
+        self.shared = []
+
+    def __getattr__(self, name):
+        return getattr(self.index, name)
+
+    def search(self, x, k, **kwargs):
+        self.shared.append(np.shares_memory(x, self.expected))
+        return self.index.search(x, k, **kwargs)
+
+    def add_with_ids(self, x, ids):
+        self.shared.append(np.shares_memory(x, self.expected))
+        return self.index.add_with_ids(x, ids)
+
+
+def check(name, ok, detail=""):
+    print(f"{'PASS' if ok else 'FAIL'}  {name}" + (f"  ({detail})" if detail else ""))
+    return ok
+
+
+def build_store(args, rng):
+    store = FaissVectorStore(args.dim, 'flat')
+    ids = np.arange(1, args.corpus + 1, dtype='int64')
+    store.add_embeddings(ids, unit_matrix(rng, args.corpus, args.dim))
+    store.chunks = ChunkStore.build(
+        [("p", "parent", "doc.pdf")],
+        ((int(i), f"chunk {i}", "p", "doc.pdf") for i in ids)
+    )
+    return store
+
+
+def main():
+    args = parse_args()
+    rng = np.random.default_rng(0)
+    results = []
+
+    store = build_store(args, rng)
+    queries = unit_matrix(rng, args.queries, args.dim)
+    matrix_bytes = queries.nbytes
+
+    results.append(check("as_unit_vectors returns unit float32 input as is",
+                         as_unit_vectors(queries) is queries or np.shares_memory(as_unit_vectors(queries), queries)))
+    results.append(check("a single query row is searched as a view", np.shares_memory(as_unit_vectors(queries[3]), queries)))
+
+    raw = queries * 3
+    normalized = as_unit_vectors(raw)
+    results.append(check("foreign (unnormalized) input is normalized on a copy",
+                         not np.shares_memory(normalized, raw) and np.allclose(raw, queries * 3)))
+
+    spy = FaissInputSpy(store.index, queries)
+    with mock.patch.object(store, 'index', spy):
+        store.ranked_rows(queries, 15, 0.0)
+        store.ranked_rows(queries[0], 15, 0.0)
+    results.append(check("FAISS search receives the embedding buffer", all(spy.shared), f"{spy.shared}"))
+
+    peak = peak_allocation(store.ranked_rows, queries, 15, 0.0)
+    results.append(check("batch search allocates less than the query matrix", peak < matrix_bytes,
+                         f"peak {peak} B vs matrix {matrix_bytes} B"))
+
+    documents = unit_matrix(rng, 4096, args.dim)
+    target = FaissVectorStore(args.dim, 'flat')
+    spy = FaissInputSpy(target.index, documents)
+    with mock.patch.object(target, 'index', spy):
+        target.add_embeddings(np.arange(1, len(documents) + 1), documents)
+    results.append(check("FAISS add receives the embedding buffer", all(spy.shared), f"{spy.shared}"))
+
+    target = FaissVectorStore(args.dim, 'flat')
+    peak = peak_allocation(target.add_embeddings, np.arange(1, len(documents) + 1), documents)
+    results.append(check("indexing allocates less than the document matrix", peak < documents.nbytes,
+                         f"peak {peak} B vs matrix {documents.nbytes} B"))
+
+    if args.model:
+        from rag_chatbot.embedding import LocalEmbeddingFunction
+        embedding_fn = LocalEmbeddingFunction()
+        vectors = embedding_fn.embed_queries(["what does SEM do?", "migros case study", "kampanya sonuçları"])
+        results.append(check("model output is a C-contiguous float32 matrix",
+                             isinstance(vectors, np.ndarray) and vectors.dtype == np.float32
+                             and vectors.flags['C_CONTIGUOUS'], f"{type(vectors).__name__} {getattr(vectors, 'dtype', '')}"))
+        norms = np.linalg.norm(vectors, axis=1)
+        results.append(check("model output rows have unit norm", bool(np.allclose(norms, 1.0, atol=1e-4)),
+                             f"norms {np.round(norms, 5).tolist()}"))
+        results.append(check("model output is searched without a copy",
+                             np.shares_memory(as_unit_vectors(vectors), vectors)))
+
+    print(f"\n{sum(results)}/{len(results)} checks passed")
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+# batch.py
+# Command line batch runner: answers a file of questions without going through HTTP
+#
+# Usage: python -m rag_chatbot.batch questions.txt --output answers.jsonl [--concurrency 8] [--retrieval-only]
+
+import argparse
+import asyncio
+import json
+import logging
+import time
+
+from .chatbot import get_chatbot_responses_batch, warmup
+
+logger = logging.getLogger(__name__)
+
+
+def read_questions(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+async def run_batches(questions, output_path, batch_size, concurrency, retrieval_only):
+    started = time.perf_counter()
+    answered = 0
+    with open(output_path, 'w', encoding='utf-8') as out:
+        for start in range(0, len(questions), batch_size):
+            batch = questions[start:start + batch_size]
+            results = await get_chatbot_responses_batch(batch, concurrency=concurrency, retrieval_only=retrieval_only)
+            for result in results:
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            answered += len(results)
+            elapsed = time.perf_counter() - started
+            logger.info("batch: %d/%d questions, %.1f q/s", answered, len(questions), answered / elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a file of questions (one per line) in bulk")
+    parser.add_argument('questions', help="Text file with one question per line")
+    parser.add_argument('--output', default='answers.jsonl')
+    parser.add_argument('--batch-size', type=int, default=256, help="Questions retrieved per FAISS call")
+    parser.add_argument('--concurrency', type=int, default=8, help="LLM calls in flight")
+    parser.add_argument('--retrieval-only', action='store_true', help="Only retrieve contexts, skip the LLM")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+
+    if not warmup.run():
+        raise SystemExit(f"Warmup failed: {warmup.error}")
+    questions = read_questions(args.questions)
+    asyncio.run(run_batches(questions, args.output, args.batch_size, args.concurrency, args.retrieval_only))
+
+
+if __name__ == '__main__':
+    main()
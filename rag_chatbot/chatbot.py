@@ -3,52 +3,172 @@
 from dotenv import load_dotenv
 load_dotenv()  # Load environment variables
 
-from .document_loader import load_and_chunk_documents
 from .embedding import LocalEmbeddingFunction
+from .embedding_batcher import EmbeddingBatcher
 from .vector_store import FaissVectorStore
-from .llm import generate_answer_async
+from .semantic_cache import SemanticCache
+from .session_store import SessionStore, format_history
+from .single_flight import SingleFlight
+from .snapshots import ReloadableVectorStore, SnapshotDirectory
+from .startup import Warmup
+from .executors import embedding_stage, search_stage, StageOverloadedError
+from .lexical_index import tokenize
+from .entity_tables import entity_tables
+from .timing import record, stage_timer
+from .metrics import observe_context, register_stats
+from .llm import generate_answer_async, generate_answer_stream, llm_client, BLOCKED_RESPONSE_MESSAGE, LLM_ERROR_MESSAGE
 import os
 import asyncio
+import logging
+import subprocess
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
 
 # Configuration constants
 EMBEDDING_DIM = 384
-VECTOR_STORE_PATH = 'faiss_index.bin'
-METADATA_PATH = 'faiss_child_metadata.pkl'
-DOCSTORE_PATH = 'faiss_parent_docstore.pkl'
+
+# Retrieval settings
+SEARCH_TOP_K = 15  # Number of chunks to retrieve
+SEARCH_SCORE_THRESHOLD = 0.15  # Lower threshold for better case study retrieval
+MAX_CONTEXT_LENGTH = 25000  # Characters (hard cap; the token budget usually binds first)
+MAX_CONTEXT_TOKENS = int(os.getenv('MAX_CONTEXT_TOKENS', '5500'))  # Measured with the embedding tokenizer
+
+# Semantic answer cache settings
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.92'))  # Cosine similarity cutoff
+SEMANTIC_CACHE_TTL = int(os.getenv('SEMANTIC_CACHE_TTL', '3600'))  # Seconds
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv('SEMANTIC_CACHE_MAX_ENTRIES', '1000'))
+
+# Conversation session settings (SESSION_MAX_ENTRIES=0 disables sessions)
+SESSION_TTL = int(os.getenv('SESSION_TTL', '1800'))  # Seconds since the last message
+SESSION_MAX_ENTRIES = int(os.getenv('SESSION_MAX_ENTRIES', '10000'))
+SESSION_MAX_MB = float(os.getenv('SESSION_MAX_MB', '64'))  # Estimated memory cap for all sessions
+SESSION_MAX_TURNS = int(os.getenv('SESSION_MAX_TURNS', '6'))  # Turns kept per session
+SESSION_ANSWER_CHARS = int(os.getenv('SESSION_ANSWER_CHARS', '600'))  # Answer prefix kept per turn
+SESSION_HISTORY_TOKENS = int(os.getenv('SESSION_HISTORY_TOKENS', '500'))  # History budget in the prompt
+SESSION_FOLLOWUP_MAX_TOKENS = int(os.getenv('SESSION_FOLLOWUP_MAX_TOKENS', '8'))  # Shorter messages are follow-ups
+SESSION_FOLLOWUP_TOP_K = int(os.getenv('SESSION_FOLLOWUP_TOP_K', '5'))  # New chunks searched for a follow-up
+# A short message is a follow-up only if, on its own, it is this similar to one of the previous turn's chunks
+SESSION_FOLLOWUP_MIN_SIMILARITY = float(os.getenv('SESSION_FOLLOWUP_MIN_SIMILARITY', '0.25'))
+
+# Identical concurrent /chat requests share one pipeline run
+COALESCE_REQUESTS = os.getenv('COALESCE_REQUESTS', '1') == '1'
+
+# Index updates at startup run `indexer --snapshot` in a child process (0 disables)
+INDEX_UPDATE_ON_STARTUP = os.getenv('INDEX_UPDATE_ON_STARTUP', '1') == '1'
+INDEX_BUILD_COMMAND = [sys.executable, '-m', 'rag_chatbot.indexer', '--snapshot']
+
+# Sent through the embedding model and the index once during warmup
+WARMUP_QUERY = "SEM hangi hizmetleri sunuyor?"
+
+# Query embedding micro-batching settings
+EMBEDDING_BATCH_MAX_SIZE = int(os.getenv('EMBEDDING_BATCH_MAX_SIZE', '32'))
+EMBEDDING_BATCH_WAIT_MS = float(os.getenv('EMBEDDING_BATCH_WAIT_MS', '5'))
 
 embedding_fn = LocalEmbeddingFunction()
-vector_store = FaissVectorStore(EMBEDDING_DIM)
+embedding_batcher = EmbeddingBatcher(
+    embedding_fn,
+    max_batch_size=EMBEDDING_BATCH_MAX_SIZE,
+    max_wait_ms=EMBEDDING_BATCH_WAIT_MS,
+    stage=embedding_stage
+)
+semantic_cache = SemanticCache(
+    EMBEDDING_DIM,
+    similarity_threshold=SEMANTIC_CACHE_THRESHOLD,
+    ttl_seconds=SEMANTIC_CACHE_TTL,
+    max_entries=SEMANTIC_CACHE_MAX_ENTRIES
+)
+session_store = SessionStore(
+    ttl_seconds=SESSION_TTL,
+    max_sessions=SESSION_MAX_ENTRIES,
+    max_turns=SESSION_MAX_TURNS,
+    answer_chars=SESSION_ANSWER_CHARS,
+    max_bytes=int(SESSION_MAX_MB * 1024 * 1024)
+)
+register_stats('rag_sessions', session_store.stats, counters=('created', 'expired', 'evictions'))
+single_flight = SingleFlight()
+register_stats('rag_single_flight', single_flight.stats, counters=('executions', 'coalesced'))
+register_stats('rag_semantic_cache', semantic_cache.stats, counters=('hits', 'misses', 'evictions'))
+register_stats('rag_embedding_batcher', embedding_batcher.stats, counters=('batches', 'queries'))
+
+def configure_store(store):
+    store.context_packer.count_tokens = embedding_fn.count_tokens
+    store.context_packer.max_tokens = MAX_CONTEXT_TOKENS
+    return store
+
+def load_vector_store(directory):
+    store = configure_store(FaissVectorStore(EMBEDDING_DIM, directory=directory))
+    store.load()
+    return store
+
+def on_index_swap(version):
+    # Cached answers were produced from the previous index
+    semantic_cache.invalidate()
+
+# Index snapshots: requests take vector_stores.current() once and search that store
+snapshots = SnapshotDirectory()
+vector_stores = ReloadableVectorStore(snapshots, load_vector_store, on_swap=on_index_swap)
+register_stats('rag_index_snapshot', vector_stores.stats, counters=('swaps',))
+
+def start_index_build():
+    """
+    Bring the index up to date with company_docs in a child process, so PDF
+    extraction and chunking (PyMuPDF, LangChain) are never imported into the
+    server. A published snapshot is swapped in as soon as the process exits.
+    """
+    process = subprocess.Popen(INDEX_BUILD_COMMAND)
+
+    def swap_when_done():
+        process.wait()
+        vector_stores.reload()
+
+    threading.Thread(target=swap_when_done, name='index-build', daemon=True).start()
+    return process
 
 def setup_vector_store():
-    if not all(os.path.exists(p) for p in [VECTOR_STORE_PATH, METADATA_PATH, DOCSTORE_PATH]):
-        print("INFO: Vector store not found, building a new one...")
-        parent_docs, child_docs = load_and_chunk_documents()
-        vector_store.add(parent_docs, child_docs, embedding_fn)
-        vector_store.save()
-        print("INFO: Vector store built and saved successfully.")
-    else:
-        print("INFO: Loading existing vector store.")
-        vector_store.load()
-
-async def get_chatbot_response(user_message):
-    # Generate query embedding
-    loop = asyncio.get_event_loop()
-    query_embedding = await loop.run_in_executor(None, embedding_fn.embed_query, user_message)
-    
-    # Lower threshold for better case study retrieval
-    score_threshold = 0.15
-    
-    # Run CPU-bound search in thread pool with dynamic parameters
-    retrieved_chunks = await loop.run_in_executor(
-        None, 
-        vector_store.search,
-        query_embedding, 
-        15,  # top_k - number of chunks to retrieve
-        score_threshold,  # similarity threshold
-        25000  # max_context_length
-    )
-    
-    # Build context from retrieved chunks
+    """Serve the current index snapshot; on the very first start, wait for it to be built"""
+    pinned = snapshots.pinned_version()
+    if pinned is not None and INDEX_UPDATE_ON_STARTUP:
+        logger.info("Index snapshot %s is pinned by a rollback; skipping the startup index build.", pinned)
+    build = start_index_build() if INDEX_UPDATE_ON_STARTUP and pinned is None else None
+    if vector_stores.reload() is None and build is not None:
+        logger.info("No index snapshot yet; waiting for the first build...")
+        build.wait()
+        # Our build may have found another process already building
+        snapshots.wait_for_build()
+        vector_stores.reload()
+
+    if vector_stores.store is None:
+        logger.warning("No index snapshot published yet; serving an empty index until one is.")
+        vector_stores.set(configure_store(FaissVectorStore(EMBEDDING_DIM)), None)
+
+def warmup_search():
+    """One dummy query through the encoder and the index (first-call allocations, page faults)"""
+    query_embedding = embedding_fn.embed_query(WARMUP_QUERY)
+    # .store, not current(): serve.py's parent warms up but never serves, so it needs no watcher
+    vector_stores.store.search(query_embedding, SEARCH_TOP_K, SEARCH_SCORE_THRESHOLD, MAX_CONTEXT_LENGTH,
+                              query_text=WARMUP_QUERY)
+
+# Run by the app's lifespan in the background (or by serve.py before forking)
+warmup = Warmup([
+    ("index", setup_vector_store),
+    ("embedding_model", embedding_fn.load),
+    ("llm_client", llm_client.load),
+    ("search", warmup_search),
+])
+
+async def embed_query(user_message):
+    # Concurrent queries are encoded together in one model.encode call
+    return await embedding_batcher.embed_query(user_message)
+
+def build_context(retrieved_chunks):
+    """Build the LLM context from retrieved chunks"""
+    with stage_timer("context"):
+        return _build_context(retrieved_chunks)
+
+def _build_context(retrieved_chunks):
     context = ""
     if retrieved_chunks:
         enriched_chunks = []
@@ -58,14 +178,218 @@ async def get_chatbot_response(user_message):
         
         context = "\n\n---\n\n".join(enriched_chunks)
         
-        # Log token usage estimation
+        # Record token usage
         context_chars = len(context)
-        estimated_tokens = int(context_chars * 0.222)
-        print(f"--- [TOKEN USAGE] Context: {context_chars} chars, ~{estimated_tokens} tokens")
+        context_tokens = embedding_fn.count_tokens(context)
+        observe_context(context_chars, context_tokens)
+        logger.debug("context chars=%d tokens=%d", context_chars, context_tokens)
+
+    return context
+
+async def retrieve_context(store, user_message, query_embedding, top_k=SEARCH_TOP_K, previous_ids=None):
+    """
+    Search the vector store (dense + BM25) for a query and build the LLM
+    context. Returns (context, chunk_ids).
+    """
+    # Run CPU-bound search in the search stage pool with dynamic parameters
+    with stage_timer("search"):
+        retrieved_chunks, chunk_ids = await search_stage.run(
+            store.search_with_ids,
+            query_embedding, 
+            top_k,
+            SEARCH_SCORE_THRESHOLD,
+            MAX_CONTEXT_LENGTH,
+            user_message,
+            previous_ids
+        )
+    return build_context(retrieved_chunks), chunk_ids
+
+def is_cacheable(answer):
+    return bool(answer) and answer not in (BLOCKED_RESPONSE_MESSAGE, LLM_ERROR_MESSAGE)
+
+def is_followup(user_message, turns):
+    """
+    A short message in an ongoing conversation ("what were the results?")
+    may refer to the last turn; prepare_answer confirms it against the
+    previous turn's chunks
+    """
+    return bool(turns) and len(tokenize(user_message)) <= SESSION_FOLLOWUP_MAX_TOKENS
+
+def conversation_history(turns):
+    """Recent turns for the prompt, within SESSION_HISTORY_TOKENS"""
+    if not turns:
+        return ""
+    return format_history(turns, embedding_fn.count_tokens, SESSION_HISTORY_TOKENS)
+
+async def prepare_answer(user_message, turns=()):
+    """
+    Resolve a message to either a cached answer or an LLM context.
+    Returns (cached_answer, query_embedding, cache_key, context, chunk_ids).
+    Brand/product queries are answered from the lexical index without an
+    embedding (query_embedding is None); they are cached by their exact text.
+    Follow-ups in a conversation (turns) extend the previous turn's chunks
+    with a small search for the follow-up in light of the previous question;
+    their answers depend on the conversation, so they bypass the cache
+    (cache_key and query_embedding are None). A short message that isn't
+    similar to any of the previous turn's chunks ("SEO hizmetiniz var mı?")
+    is a new question and gets the normal retrieval.
+    """
+    cache_key = " ".join(tokenize(user_message))
+    # The whole request searches one snapshot, even if a new one is swapped in meanwhile
+    store = vector_stores.current()
+    # Brand and product names (entity_tables) are resolved without the embedding model
+    with stage_timer("lexical"):
+        lexical_result = await search_stage.run(
+            store.lexical_fast_path, user_message, entity_tables.current(), SEARCH_TOP_K, MAX_CONTEXT_LENGTH)
+
+    query_embedding = None
+    if lexical_result is None and is_followup(user_message, turns):
+        previous = turns[-1]
+        with stage_timer("embedding"):
+            # Encoded together by the batcher
+            query_embedding, followup_embedding = await asyncio.gather(
+                embed_query(user_message), embed_query(f"{previous.question} {user_message}"))
+        with stage_timer("search"):
+            similarity = await search_stage.run(store.similarity_to_ids, query_embedding, previous.chunk_ids)
+        if similarity >= SESSION_FOLLOWUP_MIN_SIMILARITY:
+            context, chunk_ids = await retrieve_context(
+                store, user_message, followup_embedding, top_k=SESSION_FOLLOWUP_TOP_K,
+                previous_ids=previous.chunk_ids)
+            return None, None, None, context, chunk_ids
+        logger.debug("short message is not a follow-up (similarity %.3f to the previous chunks)", similarity)
+
+    if lexical_result is not None:
+        with stage_timer("cache"):
+            cached_answer = semantic_cache.lookup(key=cache_key)
+    else:
+        if query_embedding is None:
+            with stage_timer("embedding"):
+                query_embedding = await embed_query(user_message)
+        # Near-duplicate questions are answered from the semantic cache
+        with stage_timer("cache"):
+            cached_answer = semantic_cache.lookup(query_embedding, key=cache_key)
+
+    if cached_answer is not None:
+        logger.debug("semantic cache hit, skipping retrieval and LLM call")
+        return cached_answer, query_embedding, cache_key, None, None
+
+    if lexical_result is not None:
+        lexical_chunks, chunk_ids = lexical_result
+        context = build_context(lexical_chunks)
+    else:
+        context, chunk_ids = await retrieve_context(store, user_message, query_embedding)
+    return None, query_embedding, cache_key, context, chunk_ids
+
+async def answer_message(user_message, turns=()):
+    """Run the whole pipeline for a message; returns (answer, chunk_ids)"""
+    cached_answer, query_embedding, cache_key, context, chunk_ids = await prepare_answer(user_message, turns)
+    if cached_answer is not None:
+        return cached_answer, None
 
     # Generate response using LLM
-    answer = await generate_answer_async(user_message, context)
+    answer = await generate_answer_async(user_message, context, conversation_history(turns))
+    # Answers written with a conversation's history stay out of the shared cache
+    if is_cacheable(answer) and cache_key is not None and not turns:
+        semantic_cache.store(query_embedding, answer, key=cache_key)
+    return answer, chunk_ids
+
+def coalescing_key(user_message):
+    """Messages that preprocess to the same text get the same answer"""
+    return " ".join(embedding_fn.preprocess_text(user_message).split())
+
+async def get_chatbot_response(user_message, session_id=None, turns=()):
+    """
+    Answer a message. With a session (from session_store.open), the answer
+    is recorded as a new turn and earlier turns shape retrieval and the prompt.
+    Concurrent identical messages without history await one shared run.
+    """
+    if COALESCE_REQUESTS and not turns:
+        key = coalescing_key(user_message)
+        joined = key in single_flight.calls
+        started = time.perf_counter()
+        answer, chunk_ids = await single_flight.run(key, answer_message, user_message)
+        if joined:
+            # Joined a run started by another request; its stages were timed there
+            record("coalesced", time.perf_counter() - started)
+    else:
+        answer, chunk_ids = await answer_message(user_message, turns)
+
+    if is_cacheable(answer):
+        session_store.append(session_id, user_message, answer, chunk_ids)
     return answer
 
-# Initialize vector store on startup
-setup_vector_store()
\ No newline at end of file
+async def stream_chatbot_response(user_message, session_id=None, turns=()):
+    """
+    Streaming variant of get_chatbot_response.
+    Yields (event, data) tuples: "token" events while the answer is generated,
+    then an optional "media" event (or an "error" event if generation failed).
+    """
+    cached_answer, query_embedding, cache_key, context, chunk_ids = await prepare_answer(user_message, turns)
+    if cached_answer is not None:
+        session_store.append(session_id, user_message, cached_answer)
+        yield "token", cached_answer
+        return
+
+    answer_parts = []
+    failed = False
+    async for event, data in generate_answer_stream(user_message, context, conversation_history(turns)):
+        if event == "error":
+            failed = True
+        else:
+            answer_parts.append(data)
+        yield event, data
+
+    answer = "".join(answer_parts)
+    if not failed and is_cacheable(answer):
+        # Answers written with a conversation's history stay out of the shared cache
+        if cache_key is not None and not turns:
+            semantic_cache.store(query_embedding, answer, key=cache_key)
+        session_store.append(session_id, user_message, answer, chunk_ids)
+
+async def get_chatbot_responses_batch(user_messages, concurrency=8, retrieval_only=False):
+    """
+    Answer many messages at once (offline evaluation, FAQ generation).
+    All messages are embedded in one encode call and searched with one FAISS
+    call; LLM calls then run with at most `concurrency` in flight.
+    Returns one dict per message: {"message", "response", "context", "error"}.
+    """
+    if not user_messages:
+        return []
+
+    query_embeddings = await embedding_stage.run(embedding_fn.embed_queries, user_messages, EMBEDDING_BATCH_MAX_SIZE)
+    retrieved = await search_stage.run(
+        vector_stores.current().search_batch,
+        query_embeddings,
+        SEARCH_TOP_K,
+        SEARCH_SCORE_THRESHOLD,
+        MAX_CONTEXT_LENGTH,
+        None,
+        None,
+        user_messages
+    )
+    contexts = [build_context(chunks) for chunks in retrieved]
+
+    results = [{"message": message, "response": None, "context": context, "error": None}
+               for message, context in zip(user_messages, contexts)]
+    if retrieval_only:
+        return results
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def answer(result, query_embedding):
+        cached_answer = semantic_cache.lookup(query_embedding)
+        if cached_answer is not None:
+            result["response"] = cached_answer
+            return
+        async with semaphore:
+            try:
+                response = await generate_answer_async(result["message"], result["context"])
+            except StageOverloadedError as e:
+                result["error"] = str(e)
+                return
+        result["response"] = response
+        if is_cacheable(response):
+            semantic_cache.store(query_embedding, response)
+
+    await asyncio.gather(*(answer(result, embedding) for result, embedding in zip(results, query_embeddings)))
+    return results
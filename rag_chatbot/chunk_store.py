@@ -0,0 +1,418 @@
+# chunk_store.py
+# Versioned, pickle-free, memory-mapped storage for child chunks and parent documents
+#
+# File layout (little endian):
+#   header          magic(8s) version(u32) n_children(u32) n_parents(u32) n_sources(u32)
+#   string_offsets  int64[n_strings + 1]  -> byte offsets into the blob
+#   child_ids       int64[n_children]     -> FAISS id of each child (version 2+)
+#   child_spans     int64[n_children, 2]  -> start/end of each child's text in the blob (version 3)
+#   child_parent    int32[n_children]     -> parent row of each child (FAISS row id order)
+#   child_source    int32[n_children]     -> source row of each child
+#   parent_source   int32[n_parents]      -> source row of each parent
+#   blob            utf-8 bytes of every string, back to back
+#
+# Strings are numbered: child texts, then parent texts, then parent ids, then
+# source file names. Opening a store only maps the file; nothing is decoded
+# until a row is actually read. Version 1 files have no child_ids section; their
+# FAISS ids are the row numbers. From version 3 a child whose text is a slice
+# of its parent's text is stored as that slice (child_spans points into the
+# parent string and its own string is empty), so overlapping chunks no longer
+# store their text again; other children still have their own string.
+
+import io
+import logging
+import mmap
+import os
+import pickle
+import shutil
+import struct
+from array import array
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"SEMCHNK\0"
+FORMAT_VERSION = 3
+SUPPORTED_VERSIONS = (1, 2, 3)
+HEADER = struct.Struct("<8sIIII")
+
+
+def id_to_int64(hex_id):
+    """FAISS id for a hex content id (positive 60-bit integer)"""
+    return int(hex_id[:15], 16)
+
+
+def _aligned(offset, alignment=8):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def utf8_offsets(text):
+    """
+    Byte offset in text's UTF-8 encoding of every character position
+    (len(text) + 1 entries), for turning character spans into byte spans
+    """
+    if text.isascii():
+        return range(len(text) + 1)
+    code_points = np.frombuffer(text.encode('utf-32-le'), dtype='<u4')
+    widths = 1 + (code_points >= 0x80).astype('i8') + (code_points >= 0x800) + (code_points >= 0x10000)
+    offsets = np.zeros(len(text) + 1, dtype='i8')
+    np.cumsum(widths, out=offsets[1:])
+    return offsets
+
+
+class ChunkStore:
+    """Read access to child chunks and parent documents by FAISS row id"""
+
+    def __init__(self, buffer, file=None):
+        self.buffer = buffer
+        self.file = file
+        self.view = memoryview(buffer)
+
+        magic, version, n_children, n_parents, n_sources = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            raise ValueError("Not a chunk store file")
+        if version not in SUPPORTED_VERSIONS:
+            raise ValueError(f"Unsupported chunk store version {version} (expected {FORMAT_VERSION})")
+
+        self.n_children = n_children
+        self.n_parents = n_parents
+        self.n_sources = n_sources
+        n_strings = n_children + 2 * n_parents + n_sources
+
+        # All arrays are zero-copy views over the (memory-mapped) buffer
+        offset = HEADER.size
+        self.string_offsets = np.frombuffer(buffer, dtype='<i8', count=n_strings + 1, offset=offset)
+        offset += self.string_offsets.nbytes
+        if version >= 2:
+            self.child_ids = np.frombuffer(buffer, dtype='<i8', count=n_children, offset=offset)
+            offset += self.child_ids.nbytes
+        else:
+            self.child_ids = np.arange(n_children, dtype='<i8')
+        if version >= 3:
+            self.child_spans = np.frombuffer(buffer, dtype='<i8', count=2 * n_children, offset=offset).reshape(-1, 2)
+            offset += self.child_spans.nbytes
+        else:
+            self.child_spans = None
+        self.child_parents = np.frombuffer(buffer, dtype='<i4', count=n_children, offset=offset)
+        offset += self.child_parents.nbytes
+        self.child_sources = np.frombuffer(buffer, dtype='<i4', count=n_children, offset=offset)
+        offset += self.child_sources.nbytes
+        self.parent_sources = np.frombuffer(buffer, dtype='<i4', count=n_parents, offset=offset)
+        offset += self.parent_sources.nbytes
+        self.blob_offset = _aligned(offset)
+
+        self.parent_rows = None  # parent id -> row, built on first use
+        self.id_order = None  # argsort of child_ids, built on first use
+        self.sorted_ids = None
+
+    # --- Building ---
+
+    @classmethod
+    def build(cls, parents, children):
+        """
+        Build an in-memory store.
+        parents: iterable of (parent_id, text, source)
+        children: iterable of (child_id, text, parent_id, source), where
+                  child_id is the child's int64 FAISS id
+        """
+        writer = ChunkStoreWriter()
+        for parent_id, text, source in parents:
+            writer.add_parent(parent_id, text, source)
+        for child_id, text, parent_id, source in children:
+            writer.add_child(child_id, text, parent_id, source)
+        return cls(writer.to_bytes())
+
+    @classmethod
+    def from_documents(cls, parent_docs, child_docs, child_ids):
+        """
+        Build a store from LangChain-style parent/child documents.
+        child_ids are the FAISS ids of the children, in the same order.
+        """
+        return cls.build(
+            ((doc.metadata['doc_id'], doc.page_content, doc.metadata.get('source', '')) for doc in parent_docs),
+            ((child_id, doc.page_content, doc.metadata.get('doc_id', ''), doc.metadata.get('source', ''))
+             for child_id, doc in zip(child_ids, child_docs))
+        )
+
+    @classmethod
+    def empty(cls):
+        return cls.build([], [])
+
+    # --- Persistence ---
+
+    @classmethod
+    def open(cls, path):
+        """Memory-map a store file; pages are only read when rows are accessed"""
+        f = open(path, 'rb')
+        try:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            f.close()
+            raise
+        return cls(buffer, file=f)
+
+    def save(self, path):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(self.view)
+        os.replace(tmp_path, path)
+
+    def close(self):
+        # numpy views must go before the mmap can be closed
+        self.string_offsets = self.child_ids = self.child_spans = self.id_order = self.sorted_ids = None
+        self.child_parents = self.child_sources = self.parent_sources = None
+        self.view = None
+        if isinstance(self.buffer, mmap.mmap):
+            try:
+                self.buffer.close()
+            except BufferError:
+                # A caller still holds a row view; the map is freed with it
+                pass
+        if self.file is not None:
+            self.file.close()
+
+    # --- Lookups ---
+
+    def __len__(self):
+        return self.n_children
+
+    def _string_bytes(self, index):
+        start = self.blob_offset + int(self.string_offsets[index])
+        end = self.blob_offset + int(self.string_offsets[index + 1])
+        return self.view[start:end]
+
+    def _string(self, index):
+        return str(self._string_bytes(index), 'utf-8')
+
+    def rows_for_ids(self, ids):
+        """Map FAISS ids (as returned by a search) to rows; unknown ids map to -1"""
+        ids = np.asarray(ids, dtype='<i8')
+        if self.n_children == 0:
+            return np.full(len(ids), -1, dtype='<i8')
+        if self.id_order is None:
+            self.id_order = np.argsort(self.child_ids, kind='stable')
+            self.sorted_ids = self.child_ids[self.id_order]
+        positions = np.minimum(np.searchsorted(self.sorted_ids, ids), self.n_children - 1)
+        rows = self.id_order[positions]
+        return np.where(self.sorted_ids[positions] == ids, rows, -1)
+
+    def child_id(self, row):
+        return int(self.child_ids[row])
+
+    def child_bytes(self, row):
+        """Raw utf-8 bytes of a child chunk, without copying"""
+        if self.child_spans is None:
+            return self._string_bytes(row)
+        start, end = self.child_spans[row]
+        return self.view[self.blob_offset + int(start):self.blob_offset + int(end)]
+
+    def child_text(self, row):
+        return str(self.child_bytes(row), 'utf-8')
+
+    def child_span(self, row):
+        """
+        (start, end) byte offsets of a child's text within its parent's
+        utf-8 text, or None if it isn't stored as a slice of the parent
+        """
+        parent_row = int(self.child_parents[row])
+        if self.child_spans is None or parent_row < 0:
+            return None
+        parent_start = int(self.string_offsets[self.n_children + parent_row])
+        parent_end = int(self.string_offsets[self.n_children + parent_row + 1])
+        start, end = int(self.child_spans[row, 0]), int(self.child_spans[row, 1])
+        if parent_start <= start and end <= parent_end:
+            return start - parent_start, end - parent_start
+        return None
+
+    def child_parent_row(self, row):
+        return int(self.child_parents[row])
+
+    def child_source(self, row):
+        return self._string(self.n_children + 2 * self.n_parents + int(self.child_sources[row]))
+
+    def parent_bytes(self, parent_row):
+        """Raw utf-8 bytes of a parent document, without copying"""
+        return self._string_bytes(self.n_children + parent_row)
+
+    def parent_text(self, parent_row):
+        return self._string(self.n_children + parent_row)
+
+    def parent_id(self, parent_row):
+        return self._string(self.n_children + self.n_parents + parent_row)
+
+    def parent_source(self, parent_row):
+        return self._string(self.n_children + 2 * self.n_parents + int(self.parent_sources[parent_row]))
+
+    def parent_row(self, parent_id):
+        if self.parent_rows is None:
+            self.parent_rows = {self.parent_id(row): row for row in range(self.n_parents)}
+        return self.parent_rows.get(parent_id)
+
+
+class ChunkStoreWriter:
+    """
+    Builds a chunk store incrementally. Child and parent texts are streamed
+    to (temporary) blob files, so memory stays flat however large the corpus
+    is; only the per-row integer arrays and the parent id table are kept.
+    Parents must be added before their children. A child given as a span of
+    its parent's text stores no text of its own.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        if path is None:
+            self.child_blob = io.BytesIO()
+            self.parent_blob = io.BytesIO()
+        else:
+            self.child_blob = open(path + '.children.tmp', 'w+b')
+            self.parent_blob = open(path + '.parents.tmp', 'w+b')
+
+        self.child_lengths = array('q')
+        self.child_span_starts = array('q')  # In the parent's text; -1 for children with their own string
+        self.child_span_ends = array('q')
+        self.child_ids = array('q')
+        self.child_parents = array('i')
+        self.child_sources = array('i')
+        self.parent_lengths = array('q')
+        self.parent_sources = array('i')
+        self.parent_ids = []
+        self.parent_rows = {}
+        self.sources = {}
+
+    def source_row(self, source):
+        return self.sources.setdefault(source, len(self.sources))
+
+    def add_parent(self, parent_id, text, source):
+        data = text.encode('utf-8')
+        self.parent_blob.write(data)
+        self.parent_rows[parent_id] = len(self.parent_ids)
+        self.parent_ids.append(parent_id)
+        self.parent_lengths.append(len(data))
+        self.parent_sources.append(self.source_row(source))
+
+    def add_child(self, child_id, text, parent_id, source, span=None):
+        """
+        span: (start, end) byte offsets of the child's text within its
+        parent's utf-8 text; the text is then not stored again
+        """
+        parent_row = self.parent_rows.get(parent_id, -1)
+        if span is not None and parent_row >= 0:
+            start, end = span
+            self.child_lengths.append(0)
+        else:
+            data = text.encode('utf-8')
+            self.child_blob.write(data)
+            self.child_lengths.append(len(data))
+            start = end = -1
+        self.child_span_starts.append(start)
+        self.child_span_ends.append(end)
+        self.child_ids.append(child_id)
+        self.child_parents.append(parent_row)
+        self.child_sources.append(self.source_row(source))
+
+    def __len__(self):
+        return len(self.child_ids)
+
+    def _header_and_tail(self):
+        encoded_ids = [parent_id.encode('utf-8') for parent_id in self.parent_ids]
+        encoded_sources = [source.encode('utf-8') for source in self.sources]
+
+        lengths = np.concatenate([
+            np.frombuffer(self.child_lengths, dtype='q') if len(self.child_lengths) else np.zeros(0, dtype='q'),
+            np.frombuffer(self.parent_lengths, dtype='q') if len(self.parent_lengths) else np.zeros(0, dtype='q'),
+            np.array([len(b) for b in encoded_ids + encoded_sources], dtype='q'),
+        ])
+        string_offsets = np.zeros(len(lengths) + 1, dtype='<i8')
+        np.cumsum(lengths, out=string_offsets[1:])
+
+        # Children's own strings, or their slice of the parent's string
+        n_children = len(self.child_ids)
+        child_spans = np.stack([string_offsets[:n_children], string_offsets[1:n_children + 1]], axis=1)
+        in_parent = np.array(self.child_span_starts, dtype='<i8') >= 0
+        if in_parent.any():
+            parent_starts = string_offsets[n_children + np.array(self.child_parents, dtype='i8')[in_parent]]
+            child_spans[in_parent, 0] = parent_starts + np.array(self.child_span_starts, dtype='<i8')[in_parent]
+            child_spans[in_parent, 1] = parent_starts + np.array(self.child_span_ends, dtype='<i8')[in_parent]
+
+        parts = [
+            HEADER.pack(MAGIC, FORMAT_VERSION, n_children, len(self.parent_ids), len(self.sources)),
+            string_offsets.tobytes(),
+            np.array(self.child_ids, dtype='<i8').tobytes(),
+            child_spans.astype('<i8').tobytes(),
+            np.array(self.child_parents, dtype='<i4').tobytes(),
+            np.array(self.child_sources, dtype='<i4').tobytes(),
+            np.array(self.parent_sources, dtype='<i4').tobytes(),
+        ]
+        header_size = sum(len(p) for p in parts)
+        parts.append(b"\0" * (_aligned(header_size) - header_size))
+        return b"".join(parts), b"".join(encoded_ids + encoded_sources)
+
+    def _write_to(self, out):
+        header, tail = self._header_and_tail()
+        out.write(header)
+        for blob in (self.child_blob, self.parent_blob):
+            blob.seek(0)
+            shutil.copyfileobj(blob, out, 1 << 20)
+        out.write(tail)
+
+    def to_bytes(self):
+        out = io.BytesIO()
+        self._write_to(out)
+        return out.getvalue()
+
+    def finish(self):
+        """Write the store to self.path (atomically) and return it memory-mapped"""
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as out:
+                self._write_to(out)
+            os.replace(tmp_path, self.path)
+        finally:
+            self.discard()
+        return ChunkStore.open(self.path)
+
+    def discard(self):
+        for blob in (self.child_blob, self.parent_blob):
+            blob.close()
+            if self.path is not None and os.path.exists(blob.name):
+                os.remove(blob.name)
+
+
+def convert_pickles(metadata_path, docstore_path, output_path):
+    """
+    One-shot conversion of the legacy pickles (child Document list + parent
+    docstore dict) into a chunk store file. Unpickling the Documents needs
+    langchain installed; the converted store doesn't.
+    """
+    with open(metadata_path, 'rb') as f:
+        child_docs = pickle.load(f)
+    with open(docstore_path, 'rb') as f:
+        docstore = pickle.load(f)
+
+    # The legacy docstore only kept parent text; take the source from a child
+    parent_sources = {}
+    for doc in child_docs:
+        parent_sources.setdefault(doc.metadata.get('doc_id', ''), doc.metadata.get('source', ''))
+
+    store = ChunkStore.build(
+        ((parent_id, text, parent_sources.get(parent_id, '')) for parent_id, text in docstore.items()),
+        # The legacy index is a plain IndexFlatIP, so its ids are the row numbers
+        ((row, doc.page_content, doc.metadata.get('doc_id', ''), doc.metadata.get('source', ''))
+         for row, doc in enumerate(child_docs))
+    )
+    store.save(output_path)
+    logger.info("Converted %d child chunks and %d parents to %s", len(store), store.n_parents, output_path)
+    return store
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Convert legacy FAISS pickles to the chunk store format")
+    parser.add_argument('--metadata', default='faiss_child_metadata.pkl')
+    parser.add_argument('--docstore', default='faiss_parent_docstore.pkl')
+    parser.add_argument('--output', default='faiss_chunk_store.bin')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+    convert_pickles(args.metadata, args.docstore, args.output)
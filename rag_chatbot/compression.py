@@ -0,0 +1,92 @@
+# compression.py
+# Response compression: Accept-Encoding negotiation (shared with the
+# precompressed static assets) and gzip for JSON responses
+#
+# Only complete application/json bodies above a size threshold are gzipped:
+# small bodies gain nothing, and streamed responses (/chat/stream events)
+# must reach the client as they are produced, so they are never touched.
+
+import gzip
+import os
+
+from starlette.datastructures import Headers, MutableHeaders
+
+GZIP_MIN_BYTES = int(os.getenv('GZIP_MIN_BYTES', '1024'))  # Smaller JSON bodies are sent as is
+GZIP_LEVEL = 6  # Dynamic responses: most of level 9's ratio at a fraction of the CPU
+
+# Preferred first when the client accepts several equally
+ENCODING_PREFERENCE = ('br', 'gzip')
+
+
+def accepted_encodings(accept_encoding):
+    """{coding: q} from an Accept-Encoding header"""
+    accepted = {}
+    for item in (accept_encoding or '').split(','):
+        coding, _, params = item.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+def negotiate_encoding(accept_encoding, available):
+    """The best of the available content codings for the client, or None for identity"""
+    accepted = accepted_encodings(accept_encoding)
+    best, best_q = None, 0.0
+    for coding in ENCODING_PREFERENCE:
+        if coding not in available:
+            continue
+        q = accepted.get(coding, accepted.get('*', 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+class JSONGZipMiddleware:
+    """
+    ASGI middleware gzipping single-message application/json responses of
+    at least `minimum_size` bytes for clients that accept gzip
+    """
+
+    def __init__(self, app, minimum_size=GZIP_MIN_BYTES, level=GZIP_LEVEL):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.level = level
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or negotiate_encoding(Headers(scope=scope).get('accept-encoding'), ('gzip',)) is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+
+        async def send_compressed(message):
+            nonlocal start
+            if message['type'] == 'http.response.start':
+                start = message  # Held until the body shows whether to compress
+                return
+            if message['type'] == 'http.response.body' and start is not None:
+                headers = MutableHeaders(raw=start['headers'])
+                body = message.get('body', b'')
+                if (not message.get('more_body', False)
+                        and len(body) >= self.minimum_size
+                        and headers.get('content-type', '').startswith('application/json')
+                        and 'content-encoding' not in headers):
+                    body = gzip.compress(body, self.level)
+                    headers['Content-Encoding'] = 'gzip'
+                    headers['Content-Length'] = str(len(body))
+                    headers.add_vary_header('Accept-Encoding')
+                    message = {**message, 'body': body}
+                await send(start)
+                start = None
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,162 @@
+# context_packer.py
+# Turns ranked child chunks into the LLM context: overlapping/adjacent children
+# of the same parent are merged by offset, near-duplicates are dropped and the
+# result is packed to a token budget
+
+import os
+
+import numpy as np
+
+from .lexical_index import tokenize
+
+MAX_CONTEXT_TOKENS = int(os.getenv('MAX_CONTEXT_TOKENS', '5500'))  # ~ the old 25000-character limit
+MERGE_GAP_CHARS = int(os.getenv('CONTEXT_MERGE_GAP_CHARS', '50'))  # Children closer than this (utf-8 bytes) are joined
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv('CONTEXT_NEAR_DUPLICATE_THRESHOLD', '0.85'))
+SHINGLE_SIZE = 3
+
+
+def estimate_tokens(text):
+    """Character-based estimate, used when no tokenizer is configured"""
+    return int(len(text) * 0.222)
+
+
+def shingles(text):
+    words = tokenize(text)
+    if len(words) < SHINGLE_SIZE:
+        return {tuple(words)}
+    return {tuple(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+class ContextPacker:
+    """
+    Packs chunk store rows (best first) into context segments.
+    `count_tokens` is any callable text -> int, e.g. a tokenizer's length.
+    Children's token counts are cached by row, so each child is tokenized
+    once per chunk store rather than on every request.
+    """
+
+    def __init__(self, count_tokens=None, max_tokens=MAX_CONTEXT_TOKENS, merge_gap=MERGE_GAP_CHARS,
+                 near_duplicate_threshold=NEAR_DUPLICATE_THRESHOLD):
+        self.count_tokens = count_tokens or estimate_tokens
+        self.max_tokens = max_tokens
+        self.merge_gap = merge_gap
+        self.near_duplicate_threshold = near_duplicate_threshold
+        # (chunks, count_tokens, token count per row or -1), replaced as a whole so
+        # search threads never pair one store's counts with another store
+        self._row_tokens = (None, None, None)
+
+    def token_counts(self, chunks):
+        """The (chunks, count_tokens, counts) row token cache for a chunk store"""
+        cache = self._row_tokens
+        if cache[0] is not chunks or cache[1] is not self.count_tokens:
+            cache = (chunks, self.count_tokens, np.full(len(chunks), -1, dtype=np.int32))
+            self._row_tokens = cache
+        return cache
+
+    @staticmethod
+    def row_tokens(cache, row):
+        """Token count of a child, counted on first use"""
+        chunks, count_tokens, counts = cache
+        tokens = counts[row]
+        if tokens < 0:
+            tokens = counts[row] = count_tokens(chunks.child_text(row))
+        return int(tokens)
+
+    def merge_spans(self, chunks, rows):
+        """
+        Locate each child in its parent and join children whose spans overlap
+        or nearly touch. Returns (text, rows) segments, best rank first; rows
+        are the children in the segment.
+        Spans are utf-8 byte offsets (stored in the chunk store, or found in
+        the parent for older stores); only the merged segments are decoded.
+        """
+        segments = []  # (rank, text, rows)
+        spans_by_parent = {}  # parent_row -> [(start, end, rank)]
+
+        for rank, row in enumerate(rows):
+            parent_row = chunks.child_parent_row(row)
+            span = chunks.child_span(row) if parent_row >= 0 else None
+            if span is None and parent_row >= 0:
+                data = bytes(chunks.child_bytes(row))
+                start = bytes(chunks.parent_bytes(parent_row)).find(data)
+                span = (start, start + len(data)) if start >= 0 else None
+            if span is None:
+                segments.append((rank, chunks.child_text(row), [row]))
+            else:
+                spans_by_parent.setdefault(parent_row, []).append((span[0], span[1], rank))
+
+        for parent_row, spans in spans_by_parent.items():
+            parent_bytes = chunks.parent_bytes(parent_row)
+            spans.sort()
+            start, end, rank = spans[0]
+            ranks = [rank]
+            for next_start, next_end, next_rank in spans[1:]:
+                if next_start <= end + self.merge_gap:
+                    end = max(end, next_end)
+                    rank = min(rank, next_rank)
+                    ranks.append(next_rank)
+                else:
+                    segments.append((rank, str(parent_bytes[start:end], 'utf-8'), [rows[r] for r in sorted(ranks)]))
+                    start, end, rank = next_start, next_end, next_rank
+                    ranks = [rank]
+            segments.append((rank, str(parent_bytes[start:end], 'utf-8'), [rows[r] for r in sorted(ranks)]))
+
+        segments.sort(key=lambda segment: segment[0])
+        return [(text, segment_rows) for _, text, segment_rows in segments]
+
+    def drop_near_duplicates(self, segments):
+        """Drop segments mostly contained in a better-ranked one (e.g. the same case study in two PDFs)"""
+        kept, kept_shingles = [], []
+        for text, segment_rows in segments:
+            text_shingles = shingles(text)
+            duplicate = False
+            for other in kept_shingles:
+                overlap = len(text_shingles & other) / max(1, min(len(text_shingles), len(other)))
+                if overlap >= self.near_duplicate_threshold:
+                    duplicate = True
+                    break
+            if not duplicate:
+                kept.append((text, segment_rows))
+                kept_shingles.append(text_shingles)
+        return kept
+
+    def pack(self, chunks, rows, max_context_length=None):
+        """
+        Context segments for ranked rows within the token budget (and the
+        optional character limit). Returns (segments, packed_rows, stats);
+        packed_rows are the rows whose text made it into the segments, best
+        segment first.
+        """
+        rows = [int(row) for row in rows]
+        cache = self.token_counts(chunks)  # Read once: a concurrent swap doesn't affect this call
+        count_tokens = cache[1]
+        raw_tokens = sum(self.row_tokens(cache, row) for row in rows)
+
+        merged = self.merge_spans(chunks, rows)
+        unique = self.drop_near_duplicates(merged)
+
+        segments, packed_rows, total_tokens, total_chars = [], [], 0, 0
+        for text, segment_rows in unique:
+            # A segment of one child is that child's text
+            tokens = self.row_tokens(cache, segment_rows[0]) if len(segment_rows) == 1 else count_tokens(text)
+            if total_tokens + tokens > self.max_tokens or (
+                    max_context_length is not None and total_chars + len(text) > max_context_length):
+                # Skip it; a smaller, lower-ranked segment may still fit
+                continue
+            segments.append(text)
+            packed_rows.extend(segment_rows)
+            total_tokens += tokens
+            total_chars += len(text)
+
+        stats = {
+            "candidates": len(rows),
+            "segments": len(segments),
+            "merged": len(rows) - len(merged),
+            "duplicates": len(merged) - len(unique),
+            "skipped": len(unique) - len(segments),
+            "raw_tokens": raw_tokens,
+            "tokens": total_tokens,
+            "chars": total_chars,
+            "tokens_saved": raw_tokens - total_tokens,
+        }
+        return segments, packed_rows, stats
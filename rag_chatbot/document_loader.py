@@ -1,6 +1,8 @@
 import os
 import re
-import uuid
+import hashlib
+import logging
+from array import array
 
 # Import PyMuPDF (the correct PDF library)
 try:
@@ -13,11 +15,158 @@ except ImportError:
             raise ImportError("Wrong fitz package installed")
     except (ImportError, AttributeError):
         raise ImportError("PyMuPDF is required. Install with: pip install PyMuPDF")
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.schema.document import Document
+from .chunk_store import id_to_int64
+from .text_splitter import SpanSplitter
+
+logger = logging.getLogger(__name__)
 
 DOCS_PATH = 'company_docs'
 
+
+class Parent:
+    """A parent document (logical block of a PDF); its id is set by chunk_parents"""
+
+    __slots__ = ('id', 'text', 'source')
+
+    def __init__(self, text, source, id=None):
+        self.id = id
+        self.text = text
+        self.source = source
+
+
+class ChildSpans:
+    """
+    The child chunks of a list of parents, as (parent, start, end) character
+    spans into the parent texts instead of copies of the chunk strings.
+    Column arrays: FAISS id, parent index, start, end.
+    """
+
+    __slots__ = ('parents', 'ids', 'parent_rows', 'starts', 'ends')
+
+    def __init__(self, parents):
+        self.parents = parents
+        self.ids = array('q')
+        self.parent_rows = array('i')
+        self.starts = array('i')
+        self.ends = array('i')
+
+    def __len__(self):
+        return len(self.ids)
+
+    def parent(self, i):
+        return self.parents[self.parent_rows[i]]
+
+    def text(self, i):
+        return self.parent(i).text[self.starts[i]:self.ends[i]]
+
+    def __iter__(self):
+        """(child_id, parent, start, end) for each child"""
+        parents = self.parents
+        for child_id, parent_row, start, end in zip(self.ids, self.parent_rows, self.starts, self.ends):
+            yield child_id, parents[parent_row], start, end
+
+def make_id(*parts):
+    """Deterministic id from content: the same input always gives the same id"""
+    return hashlib.sha1("\0".join(str(p) for p in parts).encode('utf-8')).hexdigest()
+
+def file_content_hash(filepath):
+    sha = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def list_pdf_files(docs_path=DOCS_PATH):
+    return sorted(f for f in os.listdir(docs_path) if f.lower().endswith('.pdf'))
+
+def split_into_parents(full_text, filename):
+    """Bir PDF'in tam metnini ana mantıksal bloklara (Parent Document) ayırır"""
+    parent_documents = []
+
+    # --- ANA MANTIKSAL BLOKLARI (PARENT) OLUŞTURMA ---
+
+    # 1. Önce metni "SECTION" başlıklarına göre büyük parçalara ayıralım.
+    # Bu, dokümanın genel yapısını korur. `(?=SECTION \d)` ifadesi ayıracı silmeden böler.
+    sections = re.split(r'(?=SECTION \d:)', full_text, flags=re.IGNORECASE)
+    
+    for section_text in sections:
+        if not section_text.strip():
+            continue
+            
+        # Eğer bölüm "PROJECTS, SUCCESS STORIES" ise, onu daha da küçük mantıksal
+        # parçalara, yani her bir vaka çalışmasına ayıralım.
+        if "PROJECTS, SUCCESS STORIES" in section_text[:100]:
+            # Vaka çalışmaları genellikle "• Ad (Kategori):" ile başlıyor. Bu bizim anahtarımız.
+            # Geliştirilmiş regex: hem tek kelime hem de boşluklu markaları yakalar
+            # Örnek: "• LC WAIKIKI (", "• Migros (", "• Boyner (" vs.
+            case_studies = re.split(r'(?=\n•\s*[A-ZÇĞİİÖŞÜ][A-ZÇĞİİÖŞÜ\s]*\()', section_text)
+            
+            # İlk eleman genellikle bölüm başlığıdır, onu ayrı bir parent yapalım
+            if case_studies[0].strip():
+                parent_documents.append(Parent(case_studies[0].strip(), filename))
+            
+            # Geri kalan her bir vaka çalışmasını ayrı bir parent yapalım
+            for study_text in case_studies[1:]:
+                if study_text.strip():
+                    parent_documents.append(Parent(study_text.strip(), filename))
+        else:
+            # Diğer bölümleri tek bir büyük parent olarak ekleyelim
+            parent_documents.append(Parent(section_text.strip(), filename))
+
+    return parent_documents
+
+def make_child_splitter():
+    return SpanSplitter(
+        chunk_size=400,  # Smaller chunks for better precision
+        chunk_overlap=100,  # More overlap to preserve context
+        separators=["\n\n", "\n", ". ", ", ", " "]
+    )
+
+def chunk_parents(parent_documents, child_splitter=None):
+    """
+    Her parent'a deterministik bir id verir ve onu aranabilir child parçalara böler.
+    Id'ler içerikten türetilir (uuid değil), böylece aynı doküman her seferinde aynı id'leri üretir.
+    Child'lar metin kopyası değil, parent metni içindeki (başlangıç, bitiş) aralıkları olarak döner.
+    """
+    child_splitter = child_splitter or make_child_splitter()
+    children = ChildSpans(parent_documents)
+
+    for parent_index, parent in enumerate(parent_documents):
+        parent.id = make_id(parent.source, parent_index, parent.text)
+
+        # Ana dokümanın tam metninden küçük, aranabilir çocuk parçaların aralıklarını çıkarıyoruz
+        spans = child_splitter.split_spans(parent.text)
+
+        for chunk_index in range(len(spans) // 2):
+            start, end = spans[2 * chunk_index], spans[2 * chunk_index + 1]
+            # Id, eskisi gibi parça metninden türetilir; metin yalnızca burada dilimlenir
+            children.ids.append(id_to_int64(make_id(parent.id, chunk_index, parent.text[start:end])))
+            children.parent_rows.append(parent_index)
+            children.starts.append(start)
+            children.ends.append(end)
+
+    return children
+
+def extract_pdf_text(filepath):
+    """PDF'in tam metnini ve sayfa sayısını döndürür"""
+    # Open PDF document
+    doc = fitz.open(filepath)
+    try:
+        full_text = "".join(page.get_text() for page in doc)
+        page_count = doc.page_count
+    finally:
+        doc.close()
+    return full_text, page_count
+
+def load_and_chunk_document(filepath):
+    """Tek bir PDF'i okur ve (parent_list, ChildSpans) döndürür"""
+    filename = os.path.basename(filepath)
+    full_text, _ = extract_pdf_text(filepath)
+
+    parent_documents = split_into_parents(full_text, filename)
+    child_documents = chunk_parents(parent_documents)
+    return parent_documents, child_documents
+
 def load_and_chunk_documents():
     """
     Akıllı Mantıksal Gruplama Yöntemini Uygular:
@@ -26,79 +175,23 @@ def load_and_chunk_documents():
        Bu bloklar bizim "Parent Document"larımız (Ana Dokümanlar) olur.
     3. Her bir tam ve anlamlı Ana Dokümanı, aranabilir küçük "Child" (Çocuk) parçalara böler.
     """
-    print("Starting Intelligent Logical Grouping process...")
+    logger.info("Starting Intelligent Logical Grouping process...")
     
     all_parent_documents = []
+    child_documents = []  # [(child_id, chunk_text, parent_id, source)]
     
     # Her bir PDF dosyasını ayrı ayrı işleyeceğiz
-    for filename in os.listdir(DOCS_PATH):
-        if not filename.lower().endswith('.pdf'):
-            continue
-            
+    for filename in list_pdf_files():
         filepath = os.path.join(DOCS_PATH, filename)
-        print(f"--> Processing document: {filename}")
-        
-        # Open PDF document
-        doc = fitz.open(filepath)
-        try:
-            full_text = "".join(page.get_text() for page in doc)
-        finally:
-            doc.close()
-
-        # --- ANA MANTIKSAL BLOKLARI (PARENT) OLUŞTURMA ---
-
-        # 1. Önce metni "SECTION" başlıklarına göre büyük parçalara ayıralım.
-        # Bu, dokümanın genel yapısını korur. `(?=SECTION \d)` ifadesi ayıracı silmeden böler.
-        sections = re.split(r'(?=SECTION \d:)', full_text, flags=re.IGNORECASE)
+        logger.info("Processing document: %s", filename)
         
-        for section_text in sections:
-            if not section_text.strip():
-                continue
-                
-            # Eğer bölüm "PROJECTS, SUCCESS STORIES" ise, onu daha da küçük mantıksal
-            # parçalara, yani her bir vaka çalışmasına ayıralım.
-            if "PROJECTS, SUCCESS STORIES" in section_text[:100]:
-                # Vaka çalışmaları genellikle "• Ad (Kategori):" ile başlıyor. Bu bizim anahtarımız.
-                # Geliştirilmiş regex: hem tek kelime hem de boşluklu markaları yakalar
-                # Örnek: "• LC WAIKIKI (", "• Migros (", "• Boyner (" vs.
-                case_studies = re.split(r'(?=\n•\s*[A-ZÇĞİİÖŞÜ][A-ZÇĞİİÖŞÜ\s]*\()', section_text)
-                
-                # İlk eleman genellikle bölüm başlığıdır, onu ayrı bir parent yapalım
-                if case_studies[0].strip():
-                    all_parent_documents.append(Document(page_content=case_studies[0].strip(), metadata={"source": filename}))
-                
-                # Geri kalan her bir vaka çalışmasını ayrı bir parent yapalım
-                for study_text in case_studies[1:]:
-                    if study_text.strip():
-                        all_parent_documents.append(Document(page_content=study_text.strip(), metadata={"source": filename}))
-            else:
-                # Diğer bölümleri tek bir büyük parent olarak ekleyelim
-                all_parent_documents.append(Document(page_content=section_text.strip(), metadata={"source": filename}))
-
-    # --- ARANABİLİR ÇOCUK PARÇALARI (CHILD) OLUŞTURMA ---
-    
-    child_documents = []
-    child_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=400,  # Smaller chunks for better precision
-        chunk_overlap=100,  # More overlap to preserve context
-        separators=["\n\n", "\n", ". ", ", ", " "]
-    )
-    
-    for parent_doc in all_parent_documents:
-        parent_id = str(uuid.uuid4())
-        parent_doc.metadata['doc_id'] = parent_id
-        
-        # Ana dokümanın tam metninden küçük, aranabilir çocuk parçalar oluşturuyoruz
-        smaller_chunks = child_splitter.split_text(parent_doc.page_content)
-        
-        for chunk_text in smaller_chunks:
-            # Her çocuğa, ana dokümanın referansını ve metadatasını kopyalıyoruz
-            child_metadata = parent_doc.metadata.copy()
-            child_documents.append(Document(page_content=chunk_text, metadata=child_metadata))
-
-    print(f"Total Parent Chunks (logical blocks) created: {len(all_parent_documents)}")
-    print(f"Total Child Chunks for indexing created: {len(child_documents)}")
-    print("Document loading and chunking finished successfully. 🚀")
+        parent_documents, children = load_and_chunk_document(filepath)
+        all_parent_documents.extend(parent_documents)
+        child_documents.extend((child_id, parent.text[start:end], parent.id, parent.source)
+                               for child_id, parent, start, end in children)
+
+    logger.info("Document loading and chunking finished: %d parent chunks (logical blocks), "
+                "%d child chunks for indexing", len(all_parent_documents), len(child_documents))
     
     # Fonksiyonun çıktısı diğer dosyalarla uyumlu: (parent_list, child_list)
-    return all_parent_documents, child_documents
\ No newline at end of file
+    return all_parent_documents, child_documents
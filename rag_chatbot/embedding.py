@@ -1,47 +1,205 @@
-from sentence_transformers import SentenceTransformer
-import re
+# embedding.py
+# Query/document embeddings with all-MiniLM-L6-v2, on one of two backends:
+#   torch - the SentenceTransformer model (default)
+#   onnx  - an int8-quantized ONNX export of the same model on ONNX Runtime
+#           (build it once with `python -m rag_chatbot.onnx_export`); no torch
+#           import, a fraction of the memory and faster CPU encoding
+# Either way embeddings come out as C-contiguous float32 numpy matrices with
+# L2-normalized rows, which FAISS consumes without copying or renormalizing.
+
+import os
+import threading
+from functools import lru_cache
+
+import numpy as np
+
+from .entity_tables import entity_tables
 
 MODEL_NAME = "all-MiniLM-L6-v2"
+MAX_SEQ_LENGTH = 256  # SentenceTransformer's max_seq_length for this model
+
+# Backend settings
+EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'torch')  # torch or onnx
+ONNX_MODEL_DIR = os.getenv('ONNX_MODEL_DIR', 'models/all-MiniLM-L6-v2-onnx')
+ONNX_MODEL_FILE = os.getenv('ONNX_MODEL_FILE', 'model_int8.onnx')  # model.onnx for the unquantized export
+EMBEDDING_THREADS = int(os.getenv('EMBEDDING_THREADS', '1'))  # Intra-op threads per process
+TOKENIZER_CACHE_SIZE = int(os.getenv('TOKENIZER_CACHE_SIZE', '4096'))  # Tokenized texts kept (onnx)
+EMBEDDING_BACKENDS = ('torch', 'onnx')
+
+
+class TorchEncoder:
+    """SentenceTransformer on PyTorch; returns L2-normalized float32 vectors"""
+
+    def __init__(self, model_name=MODEL_NAME, threads=None):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name)
+        if threads:
+            self.set_threads(threads)
+
+    def set_threads(self, threads):
+        import torch
+        torch.set_num_threads(threads)
+
+    def encode(self, texts, batch_size=32):
+        embeddings = self.model.encode(texts, batch_size=batch_size, show_progress_bar=False,
+                                       convert_to_numpy=True, normalize_embeddings=True)
+        return np.ascontiguousarray(embeddings, dtype=np.float32)
+
+    def count_tokens(self, text):
+        return len(self.model.tokenizer(text, add_special_tokens=False, verbose=False)['input_ids'])
+
+
+class OnnxEncoder:
+    """
+    The exported transformer on ONNX Runtime with SentenceTransformer's mean
+    pooling and normalization done in numpy. Token ids of recently seen texts
+    are cached (repeated queries skip the tokenizer), and batches are sorted
+    by length so padding stays small.
+    """
+
+    def __init__(self, model_dir=ONNX_MODEL_DIR, model_file=ONNX_MODEL_FILE, threads=EMBEDDING_THREADS,
+                 max_length=MAX_SEQ_LENGTH, cache_size=TOKENIZER_CACHE_SIZE):
+        from tokenizers import Tokenizer
+
+        self.model_path = os.path.join(model_dir, model_file)
+        if not os.path.exists(self.model_path):
+            raise FileNotFoundError(
+                f"ONNX model {self.model_path} not found; run `python -m rag_chatbot.onnx_export` first")
+
+        tokenizer_path = os.path.join(model_dir, 'tokenizer.json')
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        self.tokenizer.no_padding()
+        self.tokenizer.enable_truncation(max_length)
+        # Token counts are taken over the whole text
+        self.counter = Tokenizer.from_file(tokenizer_path)
+        self.counter.no_padding()
+        self.counter.no_truncation()
+
+        self._token_ids = lru_cache(maxsize=cache_size)(self._tokenize)
+        self.set_threads(threads)
+
+    def set_threads(self, threads):
+        """(Re)create the session; also needed after fork, ONNX Runtime thread pools don't survive it"""
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(self.model_path, options, providers=['CPUExecutionProvider'])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+    def _tokenize(self, text):
+        ids = np.array(self.tokenizer.encode(text).ids, dtype=np.int64)
+        ids.flags.writeable = False  # Shared through the cache
+        return ids
+
+    def _run(self, token_ids):
+        length = max(len(ids) for ids in token_ids)
+        input_ids = np.zeros((len(token_ids), length), dtype=np.int64)
+        attention_mask = np.zeros((len(token_ids), length), dtype=np.int64)
+        for i, ids in enumerate(token_ids):
+            input_ids[i, :len(ids)] = ids
+            attention_mask[i, :len(ids)] = 1
+
+        feeds = {'input_ids': input_ids, 'attention_mask': attention_mask}
+        if 'token_type_ids' in self.input_names:
+            feeds['token_type_ids'] = np.zeros_like(input_ids)
+        hidden = self.session.run(None, feeds)[0]
+
+        # Mean pooling over real tokens, then L2 normalization (in place; the
+        # 1/length factor of the mean cancels out, so a masked sum is enough)
+        pooled = np.einsum('bsd,bs->bd', hidden, attention_mask.astype(hidden.dtype))
+        pooled /= np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+        return np.ascontiguousarray(pooled, dtype=np.float32)
+
+    def encode(self, texts, batch_size=32):
+        token_ids = [self._token_ids(text) for text in texts]
+        order = sorted(range(len(texts)), key=lambda i: len(token_ids[i]))
+        batch_size = max(1, batch_size)
+        embeddings = np.empty((len(texts), 0), dtype=np.float32)
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            vectors = self._run([token_ids[i] for i in batch])
+            if embeddings.shape[1] == 0:
+                embeddings = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+            embeddings[batch] = vectors
+        return embeddings
+
+    def count_tokens(self, text):
+        return len(self.counter.encode(text, add_special_tokens=False).ids)
+
+
+def load_encoder(backend=EMBEDDING_BACKEND, threads=None):
+    """The encoder for a backend name (EMBEDDING_BACKEND by default)"""
+    if backend == 'torch':
+        return TorchEncoder(threads=threads)
+    if backend == 'onnx':
+        return OnnxEncoder(threads=threads or EMBEDDING_THREADS)
+    raise ValueError(f"Unknown EMBEDDING_BACKEND '{backend}', expected one of {EMBEDDING_BACKENDS}")
+
 
 class LocalEmbeddingFunction:
-    def __init__(self):
-        self.model = SentenceTransformer(MODEL_NAME)
-        
-        # Simple brand name mappings for consistency
-        self.brand_mappings = {
-            'lcwaikiki': 'LC WAIKIKI',
-            'lc waikiki': 'LC WAIKIKI', 
-            'beymen': 'BEYMEN',
-            'migros': 'MIGROS',
-            'boyner': 'BOYNER',
-            'teknosa': 'TEKNOSA',
-            'turkcell': 'TURKCELL',
-            'nissan': 'NISSAN',
-            'burger king': 'BURGER KING',
-            'turkiye is bankasi': 'TÜRKİYE İŞ BANKASI',
-            'qnb finansbank': 'QNB FINANSBANK'
-        }
-    
+    """
+    Embeddings and token counts from the selected backend. The encoder is
+    loaded on first use (or by load() during warmup), so importing this
+    module imports neither torch nor onnxruntime.
+    """
+
+    def __init__(self, backend=EMBEDDING_BACKEND):
+        self.backend = backend
+        self.threads = None
+        self._encoder = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        with self.lock:
+            if self._encoder is None:
+                self._encoder = load_encoder(self.backend, self.threads)
+        return self._encoder
+
+    @property
+    def encoder(self):
+        return self._encoder if self._encoder is not None else self.load()
+
+    def set_threads(self, threads):
+        """Intra-op threads for encoding in this process (call in each forked worker)"""
+        self.threads = threads
+        if self._encoder is not None:
+            self._encoder.set_threads(threads)
+
+    @property
+    def brand_mappings(self):
+        """Brand name mappings for consistency (data/entities.json)"""
+        return entity_tables.current().brand_mappings
+
     def preprocess_text(self, text):
         """Simple text preprocessing for brand normalization"""
         if not text:
             return text
-            
-        # Convert to lowercase for processing
-        processed = text.lower()
-        
-        # Simple brand name normalization
-        for brand_key, brand_value in self.brand_mappings.items():
-            processed = re.sub(r'\b' + re.escape(brand_key) + r'\b', brand_value, processed, flags=re.IGNORECASE)
-        
-        return processed
+
+        # Lowercase and normalize every brand name in one pass of the compiled matcher
+        return entity_tables.current().normalize_brands(text)
 
     def embed_documents(self, texts):
+        """(n, dim) float32 matrix of unit vectors"""
         # Preprocess documents for better semantic matching
         processed_texts = [self.preprocess_text(text) for text in texts]
-        return self.model.encode(processed_texts, show_progress_bar=False).tolist()
+        return self.encoder.encode(processed_texts)
 
     def embed_query(self, text):
+        """(dim,) float32 unit vector"""
         # Preprocess query for better semantic matching
         processed_text = self.preprocess_text(text)
-        return self.model.encode([processed_text])[0].tolist()
\ No newline at end of file
+        return self.encoder.encode([processed_text])[0]
+
+    def count_tokens(self, text):
+        """Number of tokens in text according to the model's tokenizer"""
+        return self.encoder.count_tokens(text)
+
+    def embed_queries(self, texts, batch_size=None):
+        """Embed several queries with a single encode call; rows of the result are the query vectors"""
+        processed_texts = [self.preprocess_text(text) for text in texts]
+        return self.encoder.encode(processed_texts, batch_size=batch_size or len(processed_texts))
@@ -0,0 +1,111 @@
+# embedding_batcher.py
+# Dynamic micro-batching of query embeddings across concurrent requests
+
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingBatcher:
+    """
+    Collects queries that arrive within `max_wait_ms` of each other (or until
+    `max_batch_size` is reached) and encodes them with one
+    `embedding_fn.embed_queries` call, resolving each caller's future.
+    While a batch is being encoded new queries keep queueing up, so under load
+    batches grow on their own. If a stage executor is given, each query is
+    admitted against it and batches are encoded in its pool.
+    """
+
+    def __init__(self, embedding_fn, max_batch_size=32, max_wait_ms=5.0, stage=None):
+        self.embedding_fn = embedding_fn
+        self.stage = stage
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+
+        self.queue = None
+        self.worker_task = None
+        self.loop = None
+
+        self.batches = 0
+        self.queries = 0
+
+    def _ensure_worker(self):
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            # Queued futures belong to the old loop
+            self.loop = loop
+            self.queue = asyncio.Queue()
+            self.worker_task = None
+        if self.worker_task is None or self.worker_task.done():
+            if self.worker_task is not None and not self.worker_task.cancelled() and self.worker_task.exception():
+                logger.error("Embedding batch worker died; restarting", exc_info=self.worker_task.exception())
+            # The queue is kept: queries already waiting go to the new worker
+            self.worker_task = loop.create_task(self._worker())
+
+    async def embed_query(self, text):
+        self._ensure_worker()
+        if self.stage is not None:
+            self.stage.admit()
+        try:
+            future = self.loop.create_future()
+            self.queue.put_nowait((text, future))
+            return await future
+        finally:
+            if self.stage is not None:
+                self.stage.release()
+
+    async def _encode(self, texts):
+        if self.stage is not None:
+            return await self.stage.submit(self.embedding_fn.embed_queries, texts)
+        return await self.loop.run_in_executor(None, self.embedding_fn.embed_queries, texts)
+
+    async def _collect_batch(self):
+        batch = [await self.queue.get()]
+        deadline = self.loop.time() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - self.loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        # Callers that gave up (cancelled requests) don't need an embedding
+        return [(text, future) for text, future in batch if not future.done()]
+
+    async def _worker(self):
+        while True:
+            batch = await self._collect_batch()
+            if not batch:
+                continue
+
+            texts = [text for text, _ in batch]
+            try:
+                embeddings = await self._encode(texts)
+            except asyncio.CancelledError:
+                for _, future in batch:
+                    future.cancel()
+                raise
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.queries += len(batch)
+            for (_, future), embedding in zip(batch, embeddings):
+                if not future.done():
+                    future.set_result(embedding)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "queries": self.queries,
+            "avg_batch_size": round(self.queries / self.batches, 2) if self.batches else 0.0,
+        }
@@ -0,0 +1,221 @@
+# entity_tables.py
+# Brand mappings, media keys and media keywords, compiled into one matcher
+#
+# The tables live in data/entities.json and are reloaded when the file
+# changes. Every phrase from every table goes into a single regex built from a
+# character trie, so one scan over a text finds all brand, media and keyword
+# hits no matter how many entries the tables have. Every phrase ending at a
+# match position is reported (a brand that is a prefix of a longer keyword
+# included), and each consumer picks the hits of its own table.
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+from .lexical_index import tokenize
+
+ENTITIES_PATH = os.getenv('ENTITIES_PATH', os.path.join(os.path.dirname(__file__), 'data', 'entities.json'))
+ENTITIES_RELOAD_INTERVAL = float(os.getenv('ENTITIES_RELOAD_INTERVAL', '5'))  # Seconds between mtime checks
+
+logger = logging.getLogger(__name__)
+
+
+def build_trie(phrases):
+    """Character trie of the phrases; '' marks the end of a phrase"""
+    trie = {}
+    for phrase in phrases:
+        node = trie
+        for char in phrase:
+            node = node.setdefault(char, {})
+        node[''] = True
+    return trie
+
+
+def trie_pattern(trie):
+    """
+    Regex source matching any phrase of a trie. Shared prefixes are tested
+    once; at each position the longest phrase wins.
+    """
+    def emit(node):
+        branches = [re.escape(char) + emit(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        if '' in node:
+            body = '(?:' + body + ')?'
+        return body
+
+    return emit(trie) if trie else '(?!)'
+
+
+class PhraseMatcher:
+    """Finds every phrase occurrence in a text with one regex scan"""
+
+    def __init__(self, phrases):
+        self.phrases = sorted(set(p for p in phrases if p))
+        self.trie = build_trie(self.phrases)
+        # The lookahead makes matches at every start position visible, including overlapping ones
+        self.regex = re.compile('(?=(' + trie_pattern(self.trie) + '))')
+
+    def finditer(self, text):
+        """
+        (start, end, phrase) for every phrase occurrence, longest first at
+        each start position. The regex finds the positions where a phrase
+        starts; the shorter phrases there come from walking the trie.
+        """
+        for match in self.regex.finditer(text):
+            start = match.start()
+            longest = match.group(1)
+            yield start, start + len(longest), longest
+            # Shorter phrases are prefixes of the longest one
+            node, ends = self.trie, []
+            for i in range(start, start + len(longest) - 1):
+                node = node[text[i]]
+                if '' in node:
+                    ends.append(i + 1)
+            for end in reversed(ends):
+                yield start, end, text[start:end]
+
+
+def is_word_boundary(text, start, end):
+    before = text[start - 1] if start > 0 else ' '
+    after = text[end] if end < len(text) else ' '
+    return not (before.isalnum() or before == '_') and not (after.isalnum() or after == '_')
+
+
+class EntityTables:
+    """An immutable, compiled snapshot of the tables"""
+
+    def __init__(self, data):
+        self.brand_mappings = {key.lower(): value for key, value in data.get('brand_mappings', {}).items()}
+        self.media_map = data.get('media_map', {})
+        self.media_keywords = [keyword.lower() for keyword in data.get('media_keywords', [])]
+
+        # Media keys in table order (the first listed key wins), only keys that have media
+        self.media_priority = {}
+        for key, media in self.media_map.items():
+            if media.get('images') or media.get('videos'):
+                self.media_priority.setdefault(key.lower(), len(self.media_priority))
+
+        # Partial matching: any word longer than 3 characters of a key, except
+        # Google "360" products, which need their full name (spaces ignored) and "360"
+        self.media_words = {}
+        google_360_keys = []
+        for key in self.media_priority:
+            if 'google' in key and '360' in key:
+                google_360_keys.append(key)
+                continue
+            for word in key.split():
+                if len(word) > 3:
+                    self.media_words.setdefault(word, []).append(key)
+        self.compact_keys = {key.replace(' ', '').replace('360', ''): key for key in google_360_keys}
+        self.compact_matcher = PhraseMatcher(self.compact_keys)
+
+        self.show_media_phrases = set(self.media_keywords) | {key.lower() for key in self.media_map}
+        self.matcher = PhraseMatcher(
+            list(self.brand_mappings) + list(self.media_priority) + list(self.media_words)
+            + list(self.show_media_phrases)
+        )
+
+        # Brand and product names for the lexical fast path, matched on token-joined text
+        entity_names = list(self.brand_mappings) + list(self.brand_mappings.values()) + list(self.media_map)
+        self.entity_matcher = PhraseMatcher({' '.join(tokenize(name)) for name in entity_names})
+
+    def normalize_brands(self, text):
+        """Lowercase text with every brand (as a whole word) replaced by its canonical name"""
+        processed = text.lower()
+        parts, position = [], 0
+        for start, end, phrase in self.matcher.finditer(processed):
+            if start < position or phrase not in self.brand_mappings or not is_word_boundary(processed, start, end):
+                continue
+            parts.append(processed[position:start])
+            parts.append(self.brand_mappings[phrase])
+            position = end
+        if not parts:
+            return processed
+        parts.append(processed[position:])
+        return ''.join(parts)
+
+    def match_media(self, query_lower):
+        """(show_media, media key or '') for a query, from a single scan"""
+        hits = [phrase for _, _, phrase in self.matcher.finditer(query_lower)]
+        show = any(phrase in self.show_media_phrases for phrase in hits)
+
+        exact = [phrase for phrase in hits if phrase in self.media_priority]
+        if exact:
+            return show, min(exact, key=self.media_priority.get)
+
+        partial = [key for phrase in hits for key in self.media_words.get(phrase, ())]
+        if '360' in query_lower:
+            compact_query = query_lower.replace(' ', '')
+            partial += [self.compact_keys[phrase] for _, _, phrase in self.compact_matcher.finditer(compact_query)]
+        if partial:
+            return show, min(partial, key=self.media_priority.get)
+        return show, ''
+
+    def match_entity_query(self, tokens):
+        """
+        Spans of entity names in a token list, as (first token, end token) pairs,
+        longest match first at each position and non-overlapping.
+        """
+        text = ' '.join(tokens)
+        # Character offset -> token index
+        starts, ends = {}, {}
+        offset = 0
+        for i, token in enumerate(tokens):
+            starts[offset] = i
+            ends[offset + len(token)] = i + 1
+            offset += len(token) + 1
+
+        spans, position = [], 0
+        for start, end, _ in self.entity_matcher.finditer(text):
+            if start >= position and start in starts and end in ends:
+                spans.append((starts[start], ends[end]))
+                position = end
+        return spans
+
+
+class ReloadableEntityTables:
+    """Serves the current EntityTables snapshot, recompiling when the data file changes"""
+
+    def __init__(self, path=ENTITIES_PATH, check_interval=ENTITIES_RELOAD_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.mtime = None
+        self.last_check = 0.0
+        self.tables = EntityTables({})
+        self.reload()
+
+    def reload(self):
+        """Load the data file; a broken file keeps the previous tables"""
+        try:
+            mtime = os.stat(self.path).st_mtime
+            with open(self.path, 'r', encoding='utf-8') as f:
+                tables = EntityTables(json.load(f))
+        except (OSError, ValueError) as e:
+            logger.warning("Could not load entity tables from %s: %s", self.path, e)
+            return False
+        self.tables = tables
+        self.mtime = mtime
+        return True
+
+    def current(self):
+        now = time.monotonic()
+        if now - self.last_check >= self.check_interval:
+            with self.lock:
+                if now - self.last_check >= self.check_interval:
+                    self.last_check = now
+                    try:
+                        changed = os.stat(self.path).st_mtime != self.mtime
+                    except OSError:
+                        changed = False
+                    if changed and self.reload():
+                        logger.info("Reloaded entity tables from %s", self.path)
+        return self.tables
+
+
+entity_tables = ReloadableEntityTables()
@@ -0,0 +1,101 @@
+# executors.py
+# Dedicated, bounded thread pools for each pipeline stage with admission control
+
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from .metrics import register_stats
+
+
+class StageOverloadedError(Exception):
+    """Raised when a stage's queue is full and the request should be shed"""
+
+    def __init__(self, stage, retry_after):
+        super().__init__(f"Stage '{stage}' is overloaded, retry after {retry_after}s")
+        self.stage = stage
+        self.retry_after = retry_after
+
+
+class BoundedStageExecutor:
+    """
+    A thread pool for one pipeline stage (embedding, search, llm, media).
+    At most `max_workers` jobs run at once and at most `max_queue` more may
+    wait; anything beyond that is rejected immediately with
+    StageOverloadedError instead of waiting in an unbounded queue.
+    """
+
+    def __init__(self, name, max_workers, max_queue, retry_after=1):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-stage")
+
+        # Only touched from the event loop thread, so no lock is needed
+        self.pending = 0
+        self.rejected = 0
+
+    @property
+    def capacity(self):
+        return self.max_workers + self.max_queue
+
+    def admit(self):
+        """Reserve a slot in this stage or raise StageOverloadedError"""
+        if self.pending >= self.capacity:
+            self.rejected += 1
+            raise StageOverloadedError(self.name, self.retry_after)
+        self.pending += 1
+
+    def release(self):
+        self.pending -= 1
+
+    async def submit(self, fn, *args):
+        """Run fn in this stage's pool without admission control (caller already admitted)"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, fn, *args)
+
+    async def run(self, fn, *args):
+        """Admit, run fn in this stage's pool and release the slot"""
+        self.admit()
+        try:
+            return await self.submit(fn, *args)
+        finally:
+            self.release()
+
+    def stats(self):
+        return {
+            "workers": self.max_workers,
+            "queue_limit": self.max_queue,
+            "pending": self.pending,
+            "queued": max(0, self.pending - self.max_workers),
+            "rejected": self.rejected,
+        }
+
+
+def stage_from_env(name, default_workers, default_queue):
+    """Build a stage executor configured by STAGE_<NAME>_WORKERS / STAGE_<NAME>_QUEUE"""
+    prefix = f"STAGE_{name.upper()}"
+    return BoundedStageExecutor(
+        name,
+        max_workers=int(os.getenv(f"{prefix}_WORKERS", str(default_workers))),
+        max_queue=int(os.getenv(f"{prefix}_QUEUE", str(default_queue))),
+        retry_after=int(os.getenv(f"{prefix}_RETRY_AFTER", "1"))
+    )
+
+
+# One pool per stage, so slow LLM calls can't starve the cheap CPU stages.
+# The embedding stage counts pending queries; the batcher encodes them in batches.
+embedding_stage = stage_from_env("embedding", default_workers=2, default_queue=256)
+search_stage = stage_from_env("search", default_workers=4, default_queue=64)
+llm_stage = stage_from_env("llm", default_workers=32, default_queue=64)
+media_stage = stage_from_env("media", default_workers=2, default_queue=64)
+
+STAGES = [embedding_stage, search_stage, llm_stage, media_stage]
+
+
+def stage_stats():
+    return {stage.name: stage.stats() for stage in STAGES}
+
+
+register_stats('rag_executor', stage_stats, counters=('rejected',), label='stage')
@@ -0,0 +1,362 @@
+# indexer.py
+# Incremental re-indexing of company_docs by content hash
+#
+# A manifest records the content hash of every indexed PDF and the FAISS ids of
+# its child chunks. On update only added/changed PDFs are re-read; vectors of
+# removed chunks are deleted from the ID-mapped index and only chunks that are
+# new are added. Embeddings come from a content-addressed cache keyed by chunk
+# hash and model name, so re-embedding unchanged text is free. Documents go
+# through the parallel, streaming pipeline in ingestion.py. The BM25 index is
+# rebuilt from the new chunk store (tokenizing is cheap next to embedding).
+# build_snapshot writes the result to a new versioned snapshot (snapshots.py)
+# instead of the files the server is reading.
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+import faiss
+import numpy as np
+
+from .chunk_store import ChunkStoreWriter, utf8_offsets
+from .document_loader import DOCS_PATH, file_content_hash, list_pdf_files
+from .embedding import MODEL_NAME
+from .ingestion import INGEST_BATCH_SIZE, INGEST_WORKERS, BatchIndexer, IngestionProgress, iter_processed_documents
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_PATH = 'faiss_manifest.json'
+EMBEDDING_CACHE_PATH = 'embedding_cache'
+MANIFEST_VERSION = 1
+
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding cache keyed by chunk hash and model name.
+    Stored as two .npy files (keys and vectors); vectors are memory-mapped and
+    new ones are appended to a temporary file, so the cache never has to fit
+    in memory.
+    """
+
+    def __init__(self, path=EMBEDDING_CACHE_PATH, model_name=MODEL_NAME):
+        self.keys_path = path + '.keys.npy'
+        self.vectors_path = path + '.vectors.npy'
+        self.new_path = path + '.new.tmp'
+        self.model_name = model_name
+
+        self.rows = {}  # key -> row in the stored vectors
+        self.vectors = None
+        if os.path.exists(self.keys_path) and os.path.exists(self.vectors_path):
+            keys = np.load(self.keys_path)
+            self.vectors = np.load(self.vectors_path, mmap_mode='r')
+            self.rows = {key.decode('ascii'): row for row, key in enumerate(keys)}
+
+        self.new_rows = {}  # key -> row in the temporary append file
+        self.new_file = None
+        self.dim = self.vectors.shape[1] if self.vectors is not None else None
+        self.live_keys = set()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, text):
+        return hashlib.sha1(f"{self.model_name}\0{text}".encode('utf-8')).hexdigest()
+
+    def touch(self, text):
+        """Mark a chunk as still indexed so save() keeps its vector"""
+        self.live_keys.add(self.key(text))
+
+    def _read(self, key):
+        if key in self.rows:
+            return self.vectors[self.rows[key]]
+        self.new_file.flush()
+        size = self.dim * 4
+        data = os.pread(self.new_file.fileno(), size, self.new_rows[key] * size)
+        return np.frombuffer(data, dtype='float32')
+
+    def _append(self, key, vector):
+        if self.new_file is None:
+            self.new_file = open(self.new_path, 'w+b')
+        self.new_rows[key] = len(self.new_rows)
+        self.new_file.write(np.ascontiguousarray(vector, dtype='float32').tobytes())
+
+    def embed(self, texts, embedding_fn):
+        """Return a float32 matrix of embeddings, only encoding texts not in the cache"""
+        keys = [self.key(text) for text in texts]
+        self.live_keys.update(keys)
+        missing = [i for i, key in enumerate(keys) if key not in self.rows and key not in self.new_rows]
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+
+        encoded = {}
+        if missing:
+            new_vectors = embedding_fn.embed_documents([texts[i] for i in missing])
+            self.dim = new_vectors.shape[1]
+            for i, vector in zip(missing, new_vectors):
+                if keys[i] not in self.new_rows:
+                    self._append(keys[i], vector)
+                encoded[i] = vector
+
+        if not keys:
+            return np.zeros((0, self.dim or 0), dtype='float32')
+        if len(missing) == len(keys):
+            # Nothing came from the cache: the model's matrix is already in order
+            return new_vectors
+        return np.stack([encoded[i] if i in encoded else self._read(key) for i, key in enumerate(keys)])
+
+    def save(self):
+        """Persist vectors of live chunks only; entries for chunks no longer indexed are dropped"""
+        live = sorted(self.live_keys)
+        if live and self.dim:
+            tmp_vectors = self.vectors_path + '.tmp'
+            out = np.lib.format.open_memmap(tmp_vectors, mode='w+', dtype='float32', shape=(len(live), self.dim))
+            for row, key in enumerate(live):
+                out[row] = self._read(key)
+            out.flush()
+            del out
+
+            tmp_keys = self.keys_path + '.tmp'
+            with open(tmp_keys, 'wb') as f:
+                np.save(f, np.array(live, dtype='S40'))
+            self.vectors = None
+            os.replace(tmp_vectors, self.vectors_path)
+            os.replace(tmp_keys, self.keys_path)
+
+        if self.new_file is not None:
+            self.new_file.close()
+            os.remove(self.new_path)
+            self.new_file = None
+
+
+def load_manifest(path=MANIFEST_PATH):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get('version') != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def save_manifest(manifest, path=MANIFEST_PATH):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def copy_kept_rows(chunks, sources, writer, embedding_cache):
+    """Stream parents and children of unchanged sources from the old chunk store into the writer"""
+    for parent_row in range(chunks.n_parents):
+        source = chunks.parent_source(parent_row)
+        if source in sources:
+            writer.add_parent(chunks.parent_id(parent_row), chunks.parent_text(parent_row), source)
+
+    for row in range(len(chunks)):
+        source = chunks.child_source(row)
+        if source in sources:
+            parent_row = chunks.child_parent_row(row)
+            parent_id = chunks.parent_id(parent_row) if parent_row >= 0 else ''
+            text = chunks.child_text(row)
+            writer.add_child(chunks.child_id(row), text, parent_id, source, chunks.child_span(row))
+            embedding_cache.touch(text)
+
+
+def update_index(vector_store, embedding_fn, docs_path=DOCS_PATH, force=False,
+                 workers=INGEST_WORKERS, batch_size=INGEST_BATCH_SIZE, output_directory=None):
+    """
+    Bring the vector store in line with the PDFs in docs_path, touching only
+    what changed. Returns True if the index was modified (and saved).
+    The result is written to output_directory (default: the store's own
+    directory), and the store then points there.
+    """
+    from .vector_store import CHUNK_STORE_PATH, INDEX_TYPE, VECTOR_STORE_PATH, supports_removal
+
+    if output_directory is None:
+        output_directory = vector_store.directory
+    manifest = load_manifest(vector_store.path(MANIFEST_PATH))
+    files = {filename: file_content_hash(os.path.join(docs_path, filename))
+             for filename in list_pdf_files(docs_path)}
+
+    full_rebuild = (
+        force
+        or manifest is None
+        or manifest.get('model') != MODEL_NAME
+        or manifest.get('index_type', 'flat') != INDEX_TYPE
+        or vector_store.index_type != INDEX_TYPE
+        or not isinstance(vector_store.index, faiss.IndexIDMap2)
+    )
+    old_documents = {} if full_rebuild else manifest['documents']
+
+    added = [f for f in files if f not in old_documents]
+    changed = [f for f in files if f in old_documents and old_documents[f]['hash'] != files[f]]
+    removed = [f for f in old_documents if f not in files]
+
+    if (changed or removed) and not supports_removal(INDEX_TYPE):
+        # Stale vectors can't be deleted from this index type; rebuild (embeddings come from the cache)
+        full_rebuild = True
+        old_documents = {}
+        added, changed, removed = list(files), [], []
+
+    unchanged = {f for f in files if f in old_documents and f not in changed}
+
+    if not (full_rebuild or added or changed or removed):
+        logger.info("Vector store is up to date with company_docs.")
+        return False
+
+    logger.info("Re-indexing (full=%s): %d added, %d changed, %d removed, %d unchanged",
+                full_rebuild, len(added), len(changed), len(removed), len(unchanged))
+
+    old_chunks = vector_store.chunks
+    if full_rebuild:
+        vector_store.reset(INDEX_TYPE)
+    elif os.path.exists(vector_store.path(VECTOR_STORE_PATH)):
+        # The serving copy may be memory-mapped read-only; edit a private copy
+        vector_store.index = faiss.read_index(vector_store.path(VECTOR_STORE_PATH))
+    vector_store.directory = output_directory
+
+    old_ids = set()
+    for f in changed + removed:
+        old_ids.update(old_documents[f]['child_ids'])
+
+    embedding_cache = EmbeddingCache()
+    writer = ChunkStoreWriter(vector_store.path(CHUNK_STORE_PATH))
+    progress = IngestionProgress(len(added) + len(changed))
+    batch_indexer = BatchIndexer(vector_store, embedding_fn, embedding_cache, progress, batch_size)
+
+    try:
+        copy_kept_rows(old_chunks, unchanged, writer, embedding_cache)
+        documents = {f: old_documents[f] for f in unchanged}
+        current_ids = set()
+
+        filepaths = [os.path.join(docs_path, f) for f in added + changed]
+        for filename, page_count, parents, children in iter_processed_documents(filepaths, workers):
+            for parent in parents:
+                writer.add_parent(parent.id, parent.text, parent.source)
+
+            child_ids = []
+            offsets_parent = offsets = None
+            for child_id, parent, start, end in children:
+                if parent is not offsets_parent:
+                    offsets_parent, offsets = parent, utf8_offsets(parent.text)
+                text = parent.text[start:end]
+                writer.add_child(child_id, text, parent.id, parent.source, (int(offsets[start]), int(offsets[end])))
+                child_ids.append(child_id)
+                if child_id in old_ids:
+                    # Unchanged chunk of a changed document: its vector stays
+                    embedding_cache.touch(text)
+                else:
+                    batch_indexer.add(child_id, text)
+
+            current_ids.update(child_ids)
+            documents[filename] = {'hash': files[filename], 'child_ids': child_ids}
+            progress.document_done(page_count, len(children))
+
+        batch_indexer.flush()
+    except Exception:
+        writer.discard()
+        raise
+
+    stale_ids = sorted(old_ids - current_ids)
+    vector_store.remove_ids(stale_ids)
+
+    vector_store.chunks = writer.finish()
+    vector_store.rebuild_lexical()
+    vector_store.save_index()
+    vector_store.save_lexical()
+    embedding_cache.save()
+    save_manifest({'version': MANIFEST_VERSION, 'model': MODEL_NAME, 'index_type': vector_store.index_type,
+                   'documents': documents}, vector_store.path(MANIFEST_PATH))
+
+    progress.report(final=True)
+    logger.info("Removed %d stale vectors, added %d (%d from embedding cache, %d encoded). "
+                "Index now has %d vectors.", len(stale_ids), batch_indexer.added,
+                embedding_cache.hits, embedding_cache.misses, vector_store.index.ntotal)
+    return True
+
+
+def build_snapshot(snapshots, embedding_fn, embedding_dim, docs_path=DOCS_PATH, force=False,
+                   workers=INGEST_WORKERS, batch_size=INGEST_BATCH_SIZE, unpin=False):
+    """
+    Build the next index snapshot from the current one (or from the legacy
+    files in the working directory) and publish it. Returns the new version,
+    or None when nothing changed or a rollback pinned the current version
+    (unpin=True removes the pin first). Raises SnapshotBuildInProgress if
+    another process is building.
+    """
+    from .vector_store import FaissVectorStore
+
+    with snapshots.build_lock():
+        pinned = snapshots.unpin() if unpin else snapshots.pinned_version()
+        if pinned is not None and not unpin:
+            logger.info("Index snapshot %s is pinned by a rollback; not building. "
+                        "Run `python -m rag_chatbot.indexer --unpin` to resume builds.", pinned)
+            return None
+        current = snapshots.current_version()
+        store = FaissVectorStore(embedding_dim, directory=snapshots.path(current) if current else '')
+        build_dir = snapshots.new_build_dir()
+        try:
+            # Legacy pickles are converted into the new snapshot, not next to them
+            store.load(convert_legacy_to=build_dir)
+            source_manifest = store.path(MANIFEST_PATH)
+            if len(store.chunks) and not os.path.exists(source_manifest):
+                # Without one, what the index holds is unknown; update_index rebuilds it
+                logger.warning("No index manifest found in %s; rebuilding the index from company_docs.",
+                               store.directory or "the working directory")
+            changed = update_index(store, embedding_fn, docs_path, force, workers, batch_size,
+                                   output_directory=build_dir)
+            if not changed:
+                if current is not None or not len(store.chunks):
+                    shutil.rmtree(build_dir)
+                    return None
+                # First snapshot: publish the (up to date) index in the working directory as is
+                store.directory = build_dir
+                store.save()
+                shutil.copy2(source_manifest, store.path(MANIFEST_PATH))
+        except BaseException:
+            shutil.rmtree(build_dir, ignore_errors=True)
+            raise
+        return snapshots.publish(build_dir)
+
+
+if __name__ == '__main__':
+    import argparse
+    from .embedding import LocalEmbeddingFunction
+    from .snapshots import SnapshotBuildInProgress, SnapshotDirectory
+    from .vector_store import FaissVectorStore
+
+    parser = argparse.ArgumentParser(description="Incrementally re-index company_docs")
+    parser.add_argument('--full', action='store_true', help="Rebuild everything from scratch")
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--workers', type=int, default=INGEST_WORKERS, help="PDF extraction processes")
+    parser.add_argument('--batch-size', type=int, default=INGEST_BATCH_SIZE, help="Chunks embedded per batch")
+    parser.add_argument('--snapshot', action='store_true',
+                        help="Publish the result as a new index snapshot instead of rewriting the working directory")
+    parser.add_argument('--rollback', nargs='?', const='', metavar='VERSION',
+                        help="Point the current index snapshot at VERSION (default: the previous one), "
+                             "pin it and exit")
+    parser.add_argument('--unpin', action='store_true',
+                        help="Remove a rollback's pin (with --snapshot: then build)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+
+    if args.rollback is not None:
+        SnapshotDirectory().rollback(args.rollback or None)
+    elif args.unpin and not args.snapshot:
+        if SnapshotDirectory().unpin() is None:
+            logger.info("No index snapshot is pinned.")
+    elif args.snapshot:
+        try:
+            version = build_snapshot(SnapshotDirectory(), LocalEmbeddingFunction(), args.dim, force=args.full,
+                                     workers=args.workers, batch_size=args.batch_size, unpin=args.unpin)
+        except SnapshotBuildInProgress as e:
+            logger.info("%s", e)
+        else:
+            if version is None:
+                logger.info("Index is up to date; no new snapshot published.")
+    else:
+        store = FaissVectorStore(args.dim)
+        store.load(convert_legacy_to=store.directory)
+        update_index(store, LocalEmbeddingFunction(), force=args.full,
+                     workers=args.workers, batch_size=args.batch_size)
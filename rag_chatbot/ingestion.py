@@ -0,0 +1,125 @@
+# ingestion.py
+# Parallel, streaming PDF ingestion pipeline
+#
+# PDFs are extracted, split into SECTION/case-study parents and chunked in a
+# process pool (one document per task, a bounded number in flight). Results
+# stream back as they complete; child chunks are embedded and added to the
+# index in fixed-size batches, and texts go straight to a ChunkStoreWriter, so
+# peak memory depends on the batch size and not on the size of the corpus.
+
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from .document_loader import chunk_parents, extract_pdf_text, make_child_splitter, split_into_parents
+
+logger = logging.getLogger(__name__)
+
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', str(os.cpu_count() or 1)))
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', '256'))
+
+# One splitter per worker process
+child_splitter = None
+
+
+def process_document(filepath):
+    """
+    Worker task: extract one PDF and split it into parents and children.
+    Returns (filename, page_count, [Parent], ChildSpans); children are spans
+    into the parent texts, so each text is sent back from the worker once.
+    """
+    global child_splitter
+    if child_splitter is None:
+        child_splitter = make_child_splitter()
+
+    filename = os.path.basename(filepath)
+    full_text, page_count = extract_pdf_text(filepath)
+    parents = split_into_parents(full_text, filename)
+    children = chunk_parents(parents, child_splitter)
+    return filename, page_count, parents, children
+
+
+def iter_processed_documents(filepaths, workers=INGEST_WORKERS):
+    """Yield process_document results as they complete, with at most 2 * workers documents in flight"""
+    if workers <= 1 or len(filepaths) <= 1:
+        for filepath in filepaths:
+            yield process_document(filepath)
+        return
+
+    remaining = iter(filepaths)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        while True:
+            while len(pending) < workers * 2:
+                filepath = next(remaining, None)
+                if filepath is None:
+                    break
+                pending.add(executor.submit(process_document, filepath))
+            if not pending:
+                break
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+class IngestionProgress:
+    """Progress and throughput report for an ingestion run"""
+
+    def __init__(self, total_documents, report_every=10):
+        self.total_documents = total_documents
+        self.report_every = report_every
+        self.started = time.perf_counter()
+        self.documents = 0
+        self.pages = 0
+        self.chunks = 0
+        self.embedded = 0
+
+    def document_done(self, page_count, chunk_count):
+        self.documents += 1
+        self.pages += page_count
+        self.chunks += chunk_count
+        if self.documents % self.report_every == 0:
+            self.report()
+
+    def batch_embedded(self, count):
+        self.embedded += count
+
+    def report(self, final=False):
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        logger.info("ingest %s: %d/%d docs, %d pages, %d chunks, %d embedded in %.1fs | "
+                    "%.1f docs/s, %.1f pages/s, %.1f chunks/s",
+                    "done" if final else "progress", self.documents, self.total_documents, self.pages,
+                    self.chunks, self.embedded, elapsed, self.documents / elapsed, self.pages / elapsed,
+                    self.chunks / elapsed)
+
+
+class BatchIndexer:
+    """Buffers new child chunks and embeds + adds them to the index batch_size at a time"""
+
+    def __init__(self, vector_store, embedding_fn, embedding_cache, progress, batch_size=INGEST_BATCH_SIZE):
+        self.vector_store = vector_store
+        self.embedding_fn = embedding_fn
+        self.embedding_cache = embedding_cache
+        self.progress = progress
+        self.batch_size = batch_size
+        self.ids = []
+        self.texts = []
+        self.added = 0
+
+    def add(self, child_id, text):
+        self.ids.append(child_id)
+        self.texts.append(text)
+        if len(self.ids) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.ids:
+            return
+        embeddings = self.embedding_cache.embed(self.texts, self.embedding_fn)
+        self.vector_store.add_embeddings(self.ids, embeddings)
+        self.progress.batch_embedded(len(self.ids))
+        self.added += len(self.ids)
+        self.ids = []
+        self.texts = []
@@ -0,0 +1,178 @@
+# lexical_index.py
+# BM25 inverted index over child chunks, used for the brand/product fast path
+# and fused with dense results (reciprocal rank fusion)
+
+import os
+import re
+
+import numpy as np
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+# Words that don't change what an entity query is about ("Migros case study",
+# "SmartFeed nedir?"). A query made only of entities and these words is
+# answered from the lexical index without running the embedding model.
+QUERY_FILLER_WORDS = {
+    'what', 'is', 'are', 'the', 'a', 'an', 'about', 'tell', 'me', 'us', 'show', 'give', 'info',
+    'information', 'details', 'detail', 'explain', 'overview', 'of', 'on', 'for', 'with', 'and',
+    'case', 'study', 'studies', 'project', 'projects', 'success', 'story', 'stories', 'results',
+    'sem', 'semtr', 'please', 'can', 'you', 'do', 'does', 'how', 'work', 'works',
+    'nedir', 'ne', 'hakkında', 'bilgi', 'ver', 'verir', 'misin', 'mısın', 'anlat', 'anlatır',
+    'proje', 'projesi', 'projeler', 'başarı', 'hikayesi', 'hikayeleri', 'vaka', 'çalışması',
+    'sonuçları', 'detayları', 'nasıl', 'çalışır', 'örnek', 'bana', 've', 'ile', 'için',
+}
+
+
+def tokenize(text):
+    """Lowercase word tokens (Turkish dotted capital I folded to i)"""
+    return TOKEN_PATTERN.findall(text.replace('İ', 'i').lower())
+
+
+def match_entity_query(query_text, entity_tables):
+    """
+    Return the entity phrases (token tuples) a query is about if the query
+    consists only of entities and filler words, otherwise None.
+    entity_tables: an EntityTables snapshot (see entity_tables.py)
+    """
+    tokens = tokenize(query_text)
+    if not tokens:
+        return None
+
+    spans = entity_tables.match_entity_query(tokens)
+    if not spans:
+        return None
+
+    covered = set()
+    for start, end in spans:
+        covered.update(range(start, end))
+    for i, token in enumerate(tokens):
+        if i not in covered and token not in QUERY_FILLER_WORDS:
+            return None
+
+    matched = []
+    for start, end in spans:
+        phrase = tuple(tokens[start:end])
+        if phrase not in matched:
+            matched.append(phrase)
+    return matched
+
+
+class LexicalIndex:
+    """
+    Inverted index with BM25 scoring. Rows are chunk store rows.
+    Stored as flat numpy arrays: a term blob + offsets, and per-term slices of
+    posting rows and term frequencies.
+    """
+
+    def __init__(self, terms, postings_offsets, postings_rows, postings_tf, doc_lengths):
+        self.terms = terms  # term -> term id
+        self.postings_offsets = postings_offsets
+        self.postings_rows = postings_rows
+        self.postings_tf = postings_tf
+        self.doc_lengths = doc_lengths
+        self.n_docs = len(doc_lengths)
+        self.avg_doc_length = float(doc_lengths.mean()) if self.n_docs else 0.0
+
+        document_frequency = np.diff(postings_offsets).astype('float32')
+        self.idf = np.log(1.0 + (self.n_docs - document_frequency + 0.5) / (document_frequency + 0.5))
+
+    @classmethod
+    def build(cls, chunks):
+        """Build from a chunk store (one document per child chunk row)"""
+        postings = {}
+        doc_lengths = np.zeros(len(chunks), dtype='float32')
+        for row in range(len(chunks)):
+            tokens = tokenize(chunks.child_text(row))
+            doc_lengths[row] = len(tokens)
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, count in counts.items():
+                postings.setdefault(token, []).append((row, count))
+
+        term_list = sorted(postings)
+        offsets = np.zeros(len(term_list) + 1, dtype='int64')
+        np.cumsum([len(postings[t]) for t in term_list], out=offsets[1:])
+        rows = np.empty(offsets[-1], dtype='int32')
+        tfs = np.empty(offsets[-1], dtype='float32')
+        for term_id, term in enumerate(term_list):
+            entries = postings[term]
+            rows[offsets[term_id]:offsets[term_id + 1]] = [r for r, _ in entries]
+            tfs[offsets[term_id]:offsets[term_id + 1]] = [c for _, c in entries]
+
+        return cls({term: i for i, term in enumerate(term_list)}, offsets, rows, tfs, doc_lengths)
+
+    def save(self, path):
+        term_list = sorted(self.terms, key=self.terms.get)
+        encoded = [t.encode('utf-8') for t in term_list]
+        term_offsets = np.zeros(len(encoded) + 1, dtype='int64')
+        np.cumsum([len(b) for b in encoded], out=term_offsets[1:])
+
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f,
+                     term_blob=np.frombuffer(b"".join(encoded), dtype='uint8'),
+                     term_offsets=term_offsets,
+                     postings_offsets=self.postings_offsets,
+                     postings_rows=self.postings_rows,
+                     postings_tf=self.postings_tf,
+                     doc_lengths=self.doc_lengths)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        blob = data['term_blob'].tobytes()
+        term_offsets = data['term_offsets']
+        terms = {blob[term_offsets[i]:term_offsets[i + 1]].decode('utf-8'): i for i in range(len(term_offsets) - 1)}
+        return cls(terms, data['postings_offsets'], data['postings_rows'], data['postings_tf'], data['doc_lengths'])
+
+    def rows_with_term(self, token):
+        term_id = self.terms.get(token)
+        if term_id is None:
+            return np.zeros(0, dtype='int32')
+        return self.postings_rows[self.postings_offsets[term_id]:self.postings_offsets[term_id + 1]]
+
+    def rows_with_phrase_terms(self, phrase):
+        """Rows containing every token of a phrase"""
+        rows = None
+        for token in phrase:
+            token_rows = self.rows_with_term(token)
+            rows = token_rows if rows is None else np.intersect1d(rows, token_rows, assume_unique=True)
+            if len(rows) == 0:
+                break
+        return rows if rows is not None else np.zeros(0, dtype='int32')
+
+    def search(self, query_text, top_k=10):
+        """BM25 top_k as (rows, scores), best first"""
+        term_ids = {self.terms[t] for t in tokenize(query_text) if t in self.terms}
+        if not term_ids or self.n_docs == 0:
+            return np.zeros(0, dtype='int32'), np.zeros(0, dtype='float32')
+
+        all_rows, all_scores = [], []
+        for term_id in term_ids:
+            start, end = self.postings_offsets[term_id], self.postings_offsets[term_id + 1]
+            rows = self.postings_rows[start:end]
+            tf = self.postings_tf[start:end]
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[rows] / self.avg_doc_length)
+            all_rows.append(rows)
+            all_scores.append(self.idf[term_id] * tf * (BM25_K1 + 1) / (tf + norm))
+
+        unique_rows, inverse = np.unique(np.concatenate(all_rows), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(all_scores)).astype('float32')
+        top = np.argsort(-scores, kind='stable')[:top_k]
+        return unique_rows[top], scores[top]
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Merge ranked lists of rows: score(row) = sum of 1 / (k + rank) over the lists it appears in"""
+    scores = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking):
+            row = int(row)
+            scores[row] = scores.get(row, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
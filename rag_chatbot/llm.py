@@ -1,11 +1,12 @@
-import os
-import google.generativeai as genai
+import logging
+import time
 from .media_extractor import MediaExtractor
-import asyncio
+from .executors import llm_stage, media_stage, StageOverloadedError
+from .llm_client import LLMClient, backend_from_env
+from .timing import record, stage_timer
+from .metrics import LLM_TOKENS, register_stats
 
-GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
-
-genai.configure(api_key=GEMINI_API_KEY)
+logger = logging.getLogger(__name__)
 
 # Gemini model configuration
 MODEL_NAME = 'gemini-2.5-flash'
@@ -27,19 +28,40 @@ Your response MUST adhere to these rules:
 - If context is irrelevant, state that you cannot help professionally.
 """
 
+GENERATION_CONFIG = {
+    "temperature": 0.7,
+    "max_output_tokens": 2048,  # Increased for more comprehensive responses
+}
+
+BLOCKED_RESPONSE_MESSAGE = "I'm sorry, I couldn't generate a response for that. It might have been blocked by a safety filter."
+LLM_ERROR_MESSAGE = "Sorry, I encountered an error while communicating with the language model. The technical team has been notified. Please check the server logs for details."
+
 # Media extractor for enhancing responses
 media_extractor = MediaExtractor()
 
+# One long-lived client (and Gemini model object) for all requests; set
+# LLM_BACKEND=fake to run without Gemini
+llm_client = LLMClient(backend_from_env(MODEL_NAME, SYSTEM_INSTRUCTION, GENERATION_CONFIG))
+register_stats('rag_llm', llm_client.stats,
+               counters=('calls', 'retries', 'retries_denied', 'timeouts', 'errors', 'hedges', 'hedge_wins'))
 
-async def generate_answer_async(question, context):
-    """Generate answer using Gemini LLM with async support"""
-    try:
-        # Configure Gemini 2.5 model
-        model = genai.GenerativeModel(MODEL_NAME,
-                                      system_instruction=SYSTEM_INSTRUCTION
-                                      )
 
-        prompt = f"""
+def record_token_usage(prompt_tokens, output_tokens):
+    if prompt_tokens:
+        LLM_TOKENS.labels('prompt').inc(prompt_tokens)
+    if output_tokens:
+        LLM_TOKENS.labels('output').inc(output_tokens)
+
+
+def build_prompt(question, context, history=""):
+    """Build the user prompt sent to Gemini for a question, its retrieved context and the conversation so far"""
+    if history:
+        history = f"""
+        **Conversation so far**:
+        {history}
+
+        ---"""
+    return f"""{history}
         **Context**:
         {context}
 
@@ -51,43 +73,94 @@ async def generate_answer_async(question, context):
         Provide a comprehensive and detailed response to the question. Include relevant background information, context, and elaborate on key points with specific examples and metrics where available. Give thorough explanations that help the user understand the complete picture. Use the full context provided to deliver a rich, informative answer.
         """
 
-        generation_config = {
-            "temperature": 0.7,
-            "max_output_tokens": 2048,  # Increased for more comprehensive responses
-        }
-        
-        # Run the API call in a thread pool to avoid blocking
-        loop = asyncio.get_event_loop()
-        
-        def generate_content_wrapper():
-            return model.generate_content(prompt, generation_config=generation_config)
-        
-        response = await loop.run_in_executor(None, generate_content_wrapper)
+
+async def generate_answer_async(question, context, history=""):
+    """Generate answer using Gemini LLM with async support"""
+    # The async API doesn't use a thread, but the LLM stage still bounds concurrency
+    llm_stage.admit()
+    try:
+        try:
+            with stage_timer("llm"):
+                response = await llm_client.generate(build_prompt(question, context, history))
+        finally:
+            llm_stage.release()
+        record_token_usage(response.prompt_tokens, response.output_tokens)
 
         # Response might be empty due to safety filters
-        if not response.parts:
-            return "I'm sorry, I couldn't generate a response for that. It might have been blocked by a safety filter."
+        if response.blocked or not response.text:
+            return BLOCKED_RESPONSE_MESSAGE
 
         # Get the base response from LLM
         base_response = response.text.strip()
         
         # Enhance response with relevant media (images/videos)
-        enhanced_response = await loop.run_in_executor(
-            None,
-            media_extractor.enhance_response_with_media,
-            base_response,
-            context,
-            question
-        )
+        try:
+            with stage_timer("media"):
+                enhanced_response = await media_stage.run(
+                    media_extractor.enhance_response_with_media,
+                    base_response,
+                    context,
+                    question
+                )
+        except StageOverloadedError:
+            # The answer is already paid for; media is optional
+            enhanced_response = base_response
         
         return enhanced_response
 
-    except Exception as e:
-        print("\n" + "="*50)
-        print("!!!!!! FATAL ERROR IN GEMINI API CALL !!!!!!")
-        print(f"Error Type: {type(e).__name__}")
-        print(f"Error Details: {e}")
-        print("="*50 + "\n")
-        
-        return "Sorry, I encountered an error while communicating with the language model. The technical team has been notified. Please check the server logs for details."
+    except StageOverloadedError:
+        # Shed load: let the API answer with 503 + Retry-After
+        raise
+    except Exception:
+        logger.exception("Gemini API call failed")
+
+        return LLM_ERROR_MESSAGE
+
+
+async def generate_answer_stream(question, context, history=""):
+    """
+    Stream the answer from Gemini as it is generated.
+    Yields ("token", text) for each generated piece and, once the answer is
+    complete, a single ("media", html) event with the media block (if any).
+    """
+    # The async API doesn't use a thread, but the LLM stage still bounds concurrency
+    llm_stage.admit()
+    released = False
+    try:
+        produced_text = False
+        started = time.perf_counter()
+        usage = {}
+        async for text in llm_client.stream(build_prompt(question, context, history), usage):
+            if not produced_text:
+                record("llm_first_token", time.perf_counter() - started)
+            produced_text = True
+            yield "token", text
+
+        llm_stage.release()
+        released = True
+        record("llm", time.perf_counter() - started)
+        record_token_usage(usage.get('prompt_tokens'), usage.get('output_tokens'))
+
+        if not produced_text:
+            yield "token", BLOCKED_RESPONSE_MESSAGE
+            return
+
+        try:
+            with stage_timer("media"):
+                media_block = await media_stage.run(media_extractor.get_media_block, question)
+        except StageOverloadedError:
+            # The answer is already sent; media is optional
+            media_block = ""
+        if media_block:
+            yield "media", media_block
+
+    except StageOverloadedError:
+        raise
+    except Exception:
+        logger.exception("Gemini streaming API call failed")
+
+        yield "error", LLM_ERROR_MESSAGE
+    finally:
+        if not released:
+            llm_stage.release()
  
\ No newline at end of file
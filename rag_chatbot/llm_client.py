@@ -0,0 +1,356 @@
+# llm_client.py
+# Long-lived async LLM client: per-call deadlines, jittered retries under a
+# global retry budget and optional hedged requests, over a pluggable backend
+
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+
+# Client settings
+LLM_BACKEND = os.getenv('LLM_BACKEND', 'gemini')  # gemini or fake
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', '60'))  # Seconds per attempt (whole stream for streaming)
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '2'))
+LLM_BACKOFF_BASE = float(os.getenv('LLM_BACKOFF_BASE', '0.5'))  # Seconds, doubled per attempt
+LLM_BACKOFF_MAX = float(os.getenv('LLM_BACKOFF_MAX', '8'))
+LLM_RETRY_BUDGET_RATIO = float(os.getenv('LLM_RETRY_BUDGET_RATIO', '0.1'))  # Retries allowed per request
+LLM_RETRY_BUDGET_MIN_PER_SECOND = float(os.getenv('LLM_RETRY_BUDGET_MIN_PER_SECOND', '1'))
+LLM_HEDGE_AFTER = float(os.getenv('LLM_HEDGE_AFTER', '0'))  # Seconds before a hedged request; 0 disables
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationResult:
+    """
+    Text of a completed generation; blocked is True when safety filters
+    removed the answer. Token counts are as reported by the backend.
+    """
+
+    def __init__(self, text, blocked=False, prompt_tokens=None, output_tokens=None):
+        self.text = text
+        self.blocked = blocked
+        self.prompt_tokens = prompt_tokens
+        self.output_tokens = output_tokens
+
+
+def read_usage(response, usage):
+    """Copy Gemini usage metadata (if present) into a usage dict"""
+    metadata = getattr(response, 'usage_metadata', None)
+    if metadata is not None and usage is not None:
+        usage['prompt_tokens'] = getattr(metadata, 'prompt_token_count', None)
+        usage['output_tokens'] = getattr(metadata, 'candidates_token_count', None)
+
+
+class GeminiBackend:
+    """
+    Gemini through google-generativeai's async API. The SDK is imported and
+    the model object created on first use (or by load() during warmup), then
+    reused.
+    """
+
+    def __init__(self, model_name, system_instruction, generation_config, api_key=None):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        self.generation_config = generation_config
+        self.api_key = api_key
+        self.model = None
+        self.retryable_errors = ()
+        self.lock = threading.Lock()
+
+    def load(self):
+        with self.lock:
+            if self.model is None:
+                import google.generativeai as genai
+                from google.api_core import exceptions
+
+                genai.configure(api_key=self.api_key)
+                self.retryable_errors = (
+                    exceptions.ServiceUnavailable,
+                    exceptions.ResourceExhausted,
+                    exceptions.InternalServerError,
+                    exceptions.DeadlineExceeded,
+                    exceptions.TooManyRequests,
+                )
+                self.model = genai.GenerativeModel(self.model_name, system_instruction=self.system_instruction)
+        return self.model
+
+    async def generate(self, prompt, timeout):
+        response = await (self.model or self.load()).generate_content_async(
+            prompt,
+            generation_config=self.generation_config,
+            request_options={"timeout": timeout}
+        )
+        usage = {}
+        read_usage(response, usage)
+        # Response might be empty due to safety filters
+        if not response.parts:
+            return GenerationResult("", blocked=True, **usage)
+        return GenerationResult(response.text, **usage)
+
+    async def stream(self, prompt, timeout, usage=None):
+        response = await (self.model or self.load()).generate_content_async(
+            prompt,
+            generation_config=self.generation_config,
+            stream=True,
+            request_options={"timeout": timeout}
+        )
+        async for chunk in response:
+            # The last chunk carries the totals
+            read_usage(chunk, usage)
+            # Chunks without parts (e.g. safety filtered) have no text
+            if not chunk.parts:
+                continue
+            if chunk.text:
+                yield chunk.text
+
+    def is_retryable(self, error):
+        return isinstance(error, self.retryable_errors)
+
+
+class FakeBackendError(Exception):
+    """Transient failure injected by FakeBackend"""
+
+
+class FakeBackend:
+    """
+    Local stand-in for Gemini (tests, load tests): answers after a simulated
+    latency, streams the answer word by word and can fail at a given rate.
+    """
+
+    def __init__(self, latency=0.2, jitter=0.0, token_delay=0.01, failure_rate=0.0, answer=None, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.token_delay = token_delay
+        self.failure_rate = failure_rate
+        self.answer = answer
+        self.random = random.Random(seed)
+        self.calls = 0
+
+    def load(self):
+        pass
+
+    def _answer(self, prompt):
+        if self.answer is not None:
+            return self.answer
+        return f"**Fake answer** ({len(prompt)} prompt characters)\n\n* This response was generated locally."
+
+    async def _wait(self):
+        self.calls += 1
+        await asyncio.sleep(self.latency + self.random.uniform(0, self.jitter))
+        if self.random.random() < self.failure_rate:
+            raise FakeBackendError("Injected fake backend failure")
+
+    async def generate(self, prompt, timeout):
+        await self._wait()
+        answer = self._answer(prompt)
+        return GenerationResult(answer, prompt_tokens=len(prompt) // 4, output_tokens=len(answer.split()))
+
+    async def stream(self, prompt, timeout, usage=None):
+        await self._wait()
+        answer = self._answer(prompt)
+        if usage is not None:
+            usage.update(prompt_tokens=len(prompt) // 4, output_tokens=len(answer.split()))
+        for i, word in enumerate(answer.split(" ")):
+            if i and self.token_delay:
+                await asyncio.sleep(self.token_delay)
+            yield word if i == 0 else " " + word
+
+    def is_retryable(self, error):
+        return isinstance(error, FakeBackendError)
+
+
+class RetryBudget:
+    """
+    Caps retries (and hedges) to a fraction of recent traffic: every request
+    deposits `ratio` tokens, every retry spends one. `min_per_second` tokens
+    are added over time so a quiet service can still retry.
+    Without it, an upstream outage turns every request into 1 + max_retries calls.
+    """
+
+    def __init__(self, ratio=0.1, min_per_second=1.0, max_tokens=None):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens if max_tokens is not None else max(10.0, min_per_second * 10)
+        self.tokens = self.max_tokens
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.max_tokens, self.tokens + (now - self.updated) * self.min_per_second)
+        self.updated = now
+
+    def deposit(self):
+        self._refill()
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self):
+        """Spend a token for a retry; False if the budget is exhausted"""
+        self._refill()
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class LLMClient:
+    """
+    Async client over a backend. Each attempt has a deadline; failed attempts
+    are retried with full-jitter exponential backoff while the shared retry
+    budget allows it. With hedge_after set, a second identical request is sent
+    if the first hasn't answered by then, and the first answer wins.
+    """
+
+    def __init__(self, backend, timeout=LLM_TIMEOUT, max_retries=LLM_MAX_RETRIES,
+                 backoff_base=LLM_BACKOFF_BASE, backoff_max=LLM_BACKOFF_MAX,
+                 retry_budget=None, hedge_after=LLM_HEDGE_AFTER):
+        self.backend = backend
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_budget = retry_budget or RetryBudget(LLM_RETRY_BUDGET_RATIO, LLM_RETRY_BUDGET_MIN_PER_SECOND)
+        self.hedge_after = hedge_after
+
+        self.calls = 0
+        self.retries = 0
+        self.retries_denied = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def load(self):
+        """Load the backend ahead of the first call"""
+        self.backend.load()
+
+    def _is_retryable(self, error):
+        return isinstance(error, asyncio.TimeoutError) or self.backend.is_retryable(error)
+
+    async def _backoff(self, attempt):
+        await asyncio.sleep(random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt)))
+
+    def _may_retry(self, error, attempt):
+        if attempt >= self.max_retries or not self._is_retryable(error):
+            return False
+        if not self.retry_budget.withdraw():
+            self.retries_denied += 1
+            return False
+        self.retries += 1
+        return True
+
+    async def _attempt(self, prompt):
+        return await asyncio.wait_for(self.backend.generate(prompt, self.timeout), self.timeout)
+
+    async def _hedged_attempt(self, prompt):
+        primary = asyncio.ensure_future(self._attempt(prompt))
+        tasks = [primary]
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=self.hedge_after)
+            if done or not self.retry_budget.withdraw():
+                return await primary
+
+            self.hedges += 1
+            hedge = asyncio.ensure_future(self._attempt(prompt))
+            tasks.append(hedge)
+            pending = {primary, hedge}
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # Also when the caller is cancelled: don't leave a request running
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def generate(self, prompt):
+        """Complete generation as a GenerationResult; raises after the last failed attempt"""
+        self.calls += 1
+        self.retry_budget.deposit()
+        attempt = 0
+        while True:
+            try:
+                if self.hedge_after:
+                    return await self._hedged_attempt(prompt)
+                return await self._attempt(prompt)
+            except Exception as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    self.timeouts += 1
+                if not self._may_retry(e, attempt):
+                    self.errors += 1
+                    raise
+                logger.warning("LLM attempt %d failed (%s), retrying", attempt + 1, type(e).__name__)
+                await self._backoff(attempt)
+                attempt += 1
+
+    async def stream(self, prompt, usage=None):
+        """
+        Yield text pieces as they are generated. The whole stream shares one
+        deadline; failures are retried only before the first piece is sent.
+        Token counts reported by the backend are written into `usage`.
+        """
+        self.calls += 1
+        self.retry_budget.deposit()
+        attempt = 0
+        while True:
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + self.timeout
+            pieces = self.backend.stream(prompt, self.timeout, usage).__aiter__()
+            sent = False
+            try:
+                while True:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        raise asyncio.TimeoutError()
+                    try:
+                        piece = await asyncio.wait_for(pieces.__anext__(), remaining)
+                    except StopAsyncIteration:
+                        return
+                    sent = True
+                    yield piece
+            except Exception as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    self.timeouts += 1
+                if sent or not self._may_retry(e, attempt):
+                    self.errors += 1
+                    raise
+                logger.warning("LLM stream attempt %d failed (%s), retrying", attempt + 1, type(e).__name__)
+                await self._backoff(attempt)
+                attempt += 1
+            finally:
+                await pieces.aclose()
+
+    def stats(self):
+        return {
+            "backend": type(self.backend).__name__,
+            "calls": self.calls,
+            "retries": self.retries,
+            "retries_denied": self.retries_denied,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "retry_budget_tokens": round(self.retry_budget.tokens, 2),
+        }
+
+
+def backend_from_env(model_name, system_instruction, generation_config):
+    """The backend selected by LLM_BACKEND"""
+    if LLM_BACKEND == 'fake':
+        return FakeBackend(
+            latency=float(os.getenv('FAKE_LLM_LATENCY', '0.2')),
+            jitter=float(os.getenv('FAKE_LLM_JITTER', '0')),
+            token_delay=float(os.getenv('FAKE_LLM_TOKEN_DELAY', '0.01')),
+            failure_rate=float(os.getenv('FAKE_LLM_FAILURE_RATE', '0'))
+        )
+    if LLM_BACKEND == 'gemini':
+        return GeminiBackend(model_name, system_instruction, generation_config, api_key=os.getenv('GEMINI_API_KEY'))
+    raise ValueError(f"Unknown LLM_BACKEND '{LLM_BACKEND}', expected 'gemini' or 'fake'")
@@ -14,4 +14,11 @@ class MediaExtractor:
         Now uses the simplified MediaMapping system
         """
         # Context parameter kept for API compatibility but not used in new system
-        return self.media_mapping.enhance_response(response, user_query)
\ No newline at end of file
+        return self.media_mapping.enhance_response(response, user_query)
+    
+    def get_media_block(self, user_query: str) -> str:
+        """
+        Media block for a query on its own, used when the LLM response is
+        streamed and the media has to be sent after the text
+        """
+        return self.media_mapping.get_media_block(user_query)
\ No newline at end of file
@@ -4,169 +4,52 @@
 import re
 from typing import Dict, List
 
+from .entity_tables import entity_tables
+
 class MediaMapping:
     """Simple media URL mapping for services and case studies"""
     
     def __init__(self):
-        # Static media mapping - easy to maintain and extend
-        self.media_map = {
-            # Google Services
-            'google analytics 360': {
-                'images': [],
-                'videos': ['https://www.youtube.com/watch?v=9Y4U7REuHcg']
-            },
-            'search ads 360': {
-                'images': ['https://improvado.io/5a1eb87c9afe1000014a4c7d/64e351decceb1eb3cec39ac3_5cb03a81fbe81c038054e534_gmp_search_ads_360_90.png'],
-                'videos': []
-            },
-            'campaign manager 360': {
-                'images': ['https://ppcexpo.com/blog/wp-content/uploads/2024/10/google-campaign-manager-360-1-1.jpg'],
-                'videos': []
-            },
-            'display video 360': {
-                'images': [],
-                'videos': ['https://www.youtube.com/watch?app=desktop&v=ISB-KOW3oCI']
-            },
-            'google meridian': {
-                'images': [],
-                'videos': ['https://www.youtube.com/watch?v=5ag97Phtw4Y']
-            },
-            'cltv': {
-                'images': [],
-                'videos': ['https://www.youtube.com/watch?v=kinhxJvA4a0']
-            },
-            'customer lifetime value': {
-                'images': [],
-                'videos': ['https://www.youtube.com/watch?v=kinhxJvA4a0']
-            },
-            
-            # SEM Products
-            'smartfeed': {
-                'images': ['https://webtest.semtr.com/wp-content/uploads/2025/05/Hero-header-section-1.png'],
-                'videos': ['https://www.youtube.com/watch?v=hA3o8C8P71o']
-            },
-            'data bridge': {
-                'images': [],
-                'videos': ['https://www.youtube.com/watch?v=KeCaFyQLFV8']
-            },
-            
-            # Company Info
-            'sem journey': {
-                'images': ['https://webtest.semtr.com/wp-content/uploads/2025/05/c3e0e556c647c3c8d815e5bef5878c33.png'],
-                'videos': []
-            },
-            'sem milestones': {
-                'images': ['https://webtest.semtr.com/wp-content/uploads/2025/05/c3e0e556c647c3c8d815e5bef5878c33.png'],
-                'videos': []
-            },
-            
-            # Brand Case Studies
-            'migros': {
-                'images': ['https://webtest.semtr.com/wp-content/uploads/2025/05/25ce6a54bc5e301bb7dd9aff52bf8e33.png'],
-                'videos': []
-            },
-            'beymen': {
-                'images': ['https://webtest.semtr.com/wp-content/uploads/2025/05/Beymen.com_.png'],
-                'videos': []
-            },
-            'boyner': {
-                'images': ['https://webtest.semtr.com/wp-content/uploads/2025/05/c279dd2eabd8ce7c0fcf30accd80aacb.svg'],
-                'videos': []
-            },
-            'lc waikiki': {
-                'images': ['https://webtest.semtr.com/wp-content/uploads/2025/05/a0a21448ddc2f13b87f5dcf9e012a430.png'],
-                'videos': []
-            },
-            'popeyes': {
-                'images': ['https://webtest.semtr.com/wp-content/uploads/2025/05/5002ccbfed36ca9c3eb08579516ab5c6.png'],
-                'videos': []
-            },
-            'tab gıda': {
-                'images': ['https://webtest.semtr.com/wp-content/uploads/2025/05/747f87fce92bc453444c56d049bf0739.png'],
-                'videos': []
-            },
-            'dominos': {
-                'images': [],
-                'videos': ['https://www.youtube.com/watch?v=-BuCQ47DWck']
-            },
-            'bilyoner': {
-                'images': ['https://webtest.semtr.com/wp-content/uploads/2025/05/748fe9386257b4c999fe28e59561ad01.png'],
-                'videos': []
-            }
-        }
-        
-        # Keywords that should trigger media display
-        self.media_keywords = [
-            'smartfeed', 'data bridge', 'case study', 'başarı hikayesi', 'örnek proje',
-            'google analytics 360', 'search ads 360', 'campaign manager 360', 'display video 360',
-            'google meridian', 'cltv', 'customer lifetime value',
-            'görsel', 'resim', 'image', 'video', 'demo', 'screenshot'
-        ]
-        
-        # Brand keywords
-        self.brand_keywords = list(self.media_map.keys())
-    
+        # The media map, media keywords and brand keys live in data/entities.json
+        # (easy to maintain and extend, reloaded on change) and are matched with
+        # one compiled matcher. Rendered media blocks are cached per key.
+        self.media_blocks = {}
+        self.media_blocks_tables = None
+
+    @property
+    def media_map(self):
+        return entity_tables.current().media_map
+
+    @property
+    def media_keywords(self):
+        return entity_tables.current().media_keywords
+
+    @property
+    def brand_keywords(self):
+        return list(entity_tables.current().media_map.keys())
     
+    def _media_for_key(self, key: str) -> Dict[str, List[str]]:
+        if not key:
+            return {'key': '', 'images': [], 'videos': []}
+        media = self.media_map[key]
+        return {
+            'key': key,
+            'images': media['images'],
+            'videos': media['videos']
+        }
+
     def find_relevant_media(self, user_query: str) -> Dict[str, List[str]]:
         """Find relevant media for a user query"""
-        query_lower = user_query.lower()
-        
-        # Check for exact matches first
-        for key, media in self.media_map.items():
-            if key in query_lower:
-                if media['images'] or media['videos']:
-                    return {
-                        'key': key,
-                        'images': media['images'],
-                        'videos': media['videos']
-                    }
-        
-        # For partial matches, require more specific matching for Google services
-        for key, media in self.media_map.items():
-            # Special handling for Google services - require "360" for specific products
-            if 'google' in key and '360' in key:
-                if key.replace(' ', '').replace('360', '') in query_lower.replace(' ', '') and '360' in query_lower:
-                    if media['images'] or media['videos']:
-                        return {
-                            'key': key,
-                            'images': media['images'],
-                            'videos': media['videos']
-                        }
-            # For other services, use normal partial matching
-            elif 'google' not in key or '360' not in key:
-                key_words = key.split()
-                if any(word in query_lower for word in key_words if len(word) > 3):
-                    if media['images'] or media['videos']:
-                        return {
-                            'key': key,
-                            'images': media['images'],
-                            'videos': media['videos']
-                        }
-        
-        return {'key': '', 'images': [], 'videos': []}
+        # Exact key matches first (in table order), then partial matches on key
+        # words; Google "360" products need their full name and "360"
+        _, key = entity_tables.current().match_media(user_query.lower())
+        return self._media_for_key(key)
     
     def should_show_media(self, user_query: str) -> bool:
         """Determine if query should show media"""
-        query_lower = user_query.lower()
-        
-        # Always show media for specific keywords
-        if any(keyword in query_lower for keyword in self.media_keywords):
-            return True
-            
-        # Always show media for brand mentions
-        if any(brand in query_lower for brand in self.brand_keywords):
-            return True
-        
-        # Don't show media for general questions
-        general_keywords = [
-            'merhaba', 'hello', 'sem ne yapar', 'what does sem do', 'hakkında', 'about',
-            'nasıl', 'how', 'ne yapıyor', 'what do you do'
-        ]
-        
-        if any(keyword in query_lower for keyword in general_keywords):
-            return False
-            
-        return False
+        # Only for media keywords and brand mentions; general questions get none
+        show, _ = entity_tables.current().match_media(user_query.lower())
+        return show
     
     def youtube_url_to_embed(self, youtube_url: str) -> str:
         """Convert YouTube URL to embeddable format"""
@@ -209,17 +92,25 @@ class MediaMapping:
         
         return "\n\n".join(html_parts)
     
+    def get_media_block(self, user_query: str) -> str:
+        """Return the media block appended to responses, or "" if no media applies"""
+        tables = entity_tables.current()
+        show, key = tables.match_media(user_query.lower())
+        if not show or not key:
+            return ""
+
+        if self.media_blocks_tables is not tables:
+            # The tables were reloaded; rendered blocks may be stale
+            self.media_blocks = {}
+            self.media_blocks_tables = tables
+
+        media_block = self.media_blocks.get(key)
+        if media_block is None:
+            media_html = self.format_media_html(self._media_for_key(key), key.title())
+            media_block = f"\n\n---\n\n{media_html}\n\n" if media_html else ""
+            self.media_blocks[key] = media_block
+        return media_block
+    
     def enhance_response(self, response: str, user_query: str) -> str:
         """Main function to enhance response with media"""
-        if not self.should_show_media(user_query):
-            return response
-            
-        media = self.find_relevant_media(user_query)
-        if not media['images'] and not media['videos']:
-            return response
-            
-        media_html = self.format_media_html(media, media['key'].title())
-        if media_html:
-            return response + f"\n\n---\n\n{media_html}\n\n"
-            
-        return response
\ No newline at end of file
+        return response + self.get_media_block(user_query)
\ No newline at end of file
@@ -0,0 +1,76 @@
+# metrics.py
+# Prometheus metrics for the request pipeline, served at /metrics
+#
+# Latency histograms and token/context counters are updated as requests run;
+# executor queue depths, cache, LLM client and batcher counters are read from
+# their stats() methods at scrape time. Process RSS/CPU come from the default
+# process collector.
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (0, 250, 500, 1000, 2000, 3000, 4000, 5000, 6000, 8000, 12000, 25000)
+
+REQUEST_LATENCY = Histogram(
+    'rag_request_seconds', 'End-to-end request latency', ['endpoint'], buckets=LATENCY_BUCKETS)
+STAGE_LATENCY = Histogram(
+    'rag_stage_seconds', 'Latency of one pipeline stage within a request', ['stage'], buckets=LATENCY_BUCKETS)
+CONTEXT_TOKENS = Histogram(
+    'rag_context_tokens', 'Tokens in the LLM context (embedding tokenizer)', buckets=SIZE_BUCKETS)
+CONTEXT_CHARS = Histogram(
+    'rag_context_chars', 'Characters in the LLM context', buckets=SIZE_BUCKETS)
+CONTEXT_TOKENS_SAVED = Counter(
+    'rag_context_tokens_saved_total', 'Tokens removed from contexts by merging, dedup and budgeting')
+LLM_TOKENS = Counter(
+    'rag_llm_tokens_total', 'Tokens reported by the LLM', ['kind'])
+REQUESTS = Counter(
+    'rag_requests_total', 'Requests by endpoint and outcome', ['endpoint', 'outcome'])
+
+
+class StatsCollector:
+    """Exposes a component's stats() dict as gauges/counters at scrape time"""
+
+    def __init__(self, prefix, stats_fn, counters=(), label=None):
+        self.prefix = prefix
+        self.stats_fn = stats_fn
+        self.counters = set(counters)
+        self.label = label  # Set for stats_fn returning {label_value: {stat: value}}
+
+    def _families(self, rows):
+        families = {}
+        for label_value, stats in rows:
+            for name, value in stats.items():
+                if not isinstance(value, (int, float)) or isinstance(value, bool):
+                    continue
+                if name not in families:
+                    labels = [self.label] if self.label else []
+                    if name in self.counters:
+                        families[name] = CounterMetricFamily(f"{self.prefix}_{name}", name, labels=labels)
+                    else:
+                        families[name] = GaugeMetricFamily(f"{self.prefix}_{name}", name, labels=labels)
+                families[name].add_metric([label_value] if self.label else [], value)
+        return families.values()
+
+    def collect(self):
+        stats = self.stats_fn()
+        rows = stats.items() if self.label else [(None, stats)]
+        yield from self._families(rows)
+
+
+def register_stats(prefix, stats_fn, counters=(), label=None):
+    REGISTRY.register(StatsCollector(prefix, stats_fn, counters, label))
+
+
+def observe_stage(stage, seconds):
+    STAGE_LATENCY.labels(stage).observe(seconds)
+
+
+def observe_context(chars, tokens):
+    CONTEXT_CHARS.observe(chars)
+    CONTEXT_TOKENS.observe(tokens)
+
+
+def render_latest():
+    """(body, content type) of the current metrics in Prometheus text format"""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
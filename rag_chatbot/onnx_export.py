@@ -0,0 +1,79 @@
+# onnx_export.py
+# Export all-MiniLM-L6-v2 to ONNX and quantize it to int8 for the onnx
+# embedding backend (EMBEDDING_BACKEND=onnx). Needs torch, transformers and
+# onnx at export time only; serving needs just onnxruntime and tokenizers.
+#
+# Usage: python -m rag_chatbot.onnx_export [--output-dir models/all-MiniLM-L6-v2-onnx]
+
+import argparse
+import logging
+import os
+
+from .embedding import MAX_SEQ_LENGTH, ONNX_MODEL_DIR
+
+HF_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+OPSET = 14
+
+logger = logging.getLogger(__name__)
+
+
+def export(output_dir, model_name=HF_MODEL_NAME, opset=OPSET):
+    """Write model.onnx (float32) and tokenizer.json to output_dir; returns the model path"""
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name)
+    model.eval()
+    # tokenizer.json (fast tokenizer) is all the onnx backend loads
+    tokenizer.save_pretrained(output_dir)
+
+    sample = tokenizer(["an example query", "a somewhat longer example document text"],
+                       padding=True, truncation=True, max_length=MAX_SEQ_LENGTH, return_tensors='pt')
+    inputs = (sample['input_ids'], sample['attention_mask'], sample['token_type_ids'])
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in ('input_ids', 'attention_mask', 'token_type_ids')}
+    dynamic_axes['last_hidden_state'] = {0: 'batch', 1: 'sequence'}
+
+    model_path = os.path.join(output_dir, 'model.onnx')
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            inputs,
+            model_path,
+            input_names=['input_ids', 'attention_mask', 'token_type_ids'],
+            output_names=['last_hidden_state'],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+            do_constant_folding=True,
+        )
+    return model_path
+
+
+def quantize(model_path, output_path):
+    """Dynamic int8 quantization of the weights (activations stay float)"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(model_path, output_path, weight_type=QuantType.QInt8)
+    return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the embedding model to (quantized) ONNX")
+    parser.add_argument('--output-dir', default=ONNX_MODEL_DIR)
+    parser.add_argument('--model', default=HF_MODEL_NAME)
+    parser.add_argument('--opset', type=int, default=OPSET)
+    parser.add_argument('--no-quantize', action='store_true', help="Only write the float32 model.onnx")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+
+    model_path = export(args.output_dir, args.model, args.opset)
+    logger.info("Exported %s (%.1f MB)", model_path, os.path.getsize(model_path) / 1e6)
+    if not args.no_quantize:
+        quantized_path = quantize(model_path, os.path.join(args.output_dir, 'model_int8.onnx'))
+        logger.info("Quantized %s (%.1f MB)", quantized_path, os.path.getsize(quantized_path) / 1e6)
+    logger.info("Check fidelity with: python benchmarks/embedding_backends.py")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+# profiling.py
+# Opt-in diagnostics for a live worker: a sampling CPU profiler and tracemalloc
+# snapshots. Both can be triggered over HTTP (/debug/* endpoints) or, for a
+# specific prefork worker, with signals: SIGUSR1 profiles for
+# PROFILE_SECONDS and SIGUSR2 toggles tracemalloc; reports are written to
+# PROFILE_DIR. Nothing is installed unless PROFILING_ENABLED=1.
+
+import collections
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', '0') == '1'
+PROFILE_SECONDS = float(os.getenv('PROFILE_SECONDS', '10'))
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', '0.005'))  # Seconds between samples
+PROFILE_DIR = os.getenv('PROFILE_DIR', '/tmp')
+TRACEMALLOC_FRAMES = int(os.getenv('TRACEMALLOC_FRAMES', '10'))
+
+logger = logging.getLogger(__name__)
+
+# Only one profile at a time per process
+_profile_lock = threading.Lock()
+
+
+def sample_stacks(seconds=PROFILE_SECONDS, interval=PROFILE_INTERVAL):
+    """
+    Sample the stacks of all threads (except the sampler) for `seconds`.
+    Returns {collapsed stack: samples}, where a collapsed stack is
+    "thread;outer_fn (file:line);...;inner_fn (file:line)", ready for flame graph tools.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        raise RuntimeError("A profile is already running")
+    try:
+        own_id = threading.get_ident()
+        names = {}
+        counts = collections.Counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            if len(names) != threading.active_count():
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                counts[";".join(reversed(stack))] += 1
+            time.sleep(interval)
+        return counts
+    finally:
+        _profile_lock.release()
+
+
+def format_collapsed(counts):
+    return "".join(f"{stack} {samples}\n" for stack, samples in counts.most_common())
+
+
+def start_tracemalloc(frames=TRACEMALLOC_FRAMES):
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+
+
+def stop_tracemalloc():
+    tracemalloc.stop()
+
+
+def tracemalloc_report(limit=25, key_type='lineno'):
+    """Top allocation sites of the current tracemalloc snapshot as text lines"""
+    if not tracemalloc.is_tracing():
+        return ["tracemalloc is not running"]
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+    current, peak = tracemalloc.get_traced_memory()
+    lines = [f"traced current={current / 1e6:.1f}MB peak={peak / 1e6:.1f}MB"]
+    for stat in snapshot.statistics(key_type)[:limit]:
+        lines.append(str(stat))
+    return lines
+
+
+def _report_path(kind):
+    return os.path.join(PROFILE_DIR, f"{kind}-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}.txt")
+
+
+def _profile_to_file():
+    try:
+        counts = sample_stacks()
+    except RuntimeError as e:
+        logger.warning("%s", e)
+        return
+    path = _report_path('profile')
+    with open(path, 'w') as f:
+        f.write(format_collapsed(counts))
+    logger.info("Wrote CPU profile to %s", path)
+
+
+def _handle_profile_signal(signum, frame):
+    # Sample from a separate thread so the worker keeps serving
+    threading.Thread(target=_profile_to_file, name="profiler", daemon=True).start()
+
+
+def _handle_tracemalloc_signal(signum, frame):
+    if not tracemalloc.is_tracing():
+        start_tracemalloc()
+        logger.info("tracemalloc started (pid=%d)", os.getpid())
+        return
+    path = _report_path('tracemalloc')
+    with open(path, 'w') as f:
+        f.write("\n".join(tracemalloc_report(limit=100)) + "\n")
+    stop_tracemalloc()
+    logger.info("Wrote tracemalloc report to %s and stopped tracing", path)
+
+
+def install_signal_handlers():
+    """Install the SIGUSR1/SIGUSR2 handlers (main thread only); no-op unless PROFILING_ENABLED"""
+    if not PROFILING_ENABLED or not hasattr(signal, 'SIGUSR1'):
+        return False
+    signal.signal(signal.SIGUSR1, _handle_profile_signal)
+    signal.signal(signal.SIGUSR2, _handle_tracemalloc_signal)
+    return True
@@ -0,0 +1,129 @@
+# semantic_cache.py
+# Semantic answer cache: near-duplicate questions reuse an earlier answer
+
+import threading
+import time
+from collections import OrderedDict
+
+import faiss
+import numpy as np
+
+from .vectors import as_unit_vectors
+
+
+class SemanticCache:
+    """
+    In-memory answer cache keyed on query embeddings.
+    A lookup returns a cached answer when an earlier query is at least
+    `similarity_threshold` cosine-similar to the new one. Entries expire after
+    `ttl_seconds` and the least recently used entry is evicted once
+    `max_entries` is reached.
+    Entries may also carry an exact text key, so queries answered without an
+    embedding (the lexical fast path) can be cached too.
+    """
+
+    def __init__(self, embedding_dim, similarity_threshold=0.92, ttl_seconds=3600, max_entries=1000):
+        self.embedding_dim = embedding_dim
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+
+        # IDMap lets us remove single entries on eviction/expiry
+        self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(embedding_dim))
+        self.entries = OrderedDict()  # entry_id -> (answer, created_at, key), oldest use first
+        self.keys = {}  # exact text key -> entry_id
+        self.next_id = 0
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _to_vector(self, embedding):
+        return as_unit_vectors(embedding)
+
+    def _is_expired(self, created_at, now):
+        return self.ttl_seconds is not None and now - created_at > self.ttl_seconds
+
+    def _remove(self, entry_ids):
+        for entry_id in entry_ids:
+            entry = self.entries.pop(entry_id, None)
+            if entry is not None and entry[2] is not None and self.keys.get(entry[2]) == entry_id:
+                del self.keys[entry[2]]
+        if entry_ids:
+            self.index.remove_ids(np.array(entry_ids, dtype='int64'))
+
+    def _purge_expired(self, now):
+        expired = [entry_id for entry_id, (_, created_at, _) in self.entries.items()
+                   if self._is_expired(created_at, now)]
+        self._remove(expired)
+
+    def _find(self, query_embedding, key):
+        if key is not None and key in self.keys:
+            return self.keys[key]
+        if query_embedding is None or self.index.ntotal == 0:
+            return None
+
+        scores, ids = self.index.search(self._to_vector(query_embedding), 1)
+        entry_id = int(ids[0][0])
+        if entry_id == -1 or float(scores[0][0]) < self.similarity_threshold:
+            return None
+        return entry_id
+
+    def lookup(self, query_embedding=None, key=None):
+        """Return the cached answer for the same text key or a similar earlier query, or None"""
+        with self.lock:
+            entry_id = self._find(query_embedding, key)
+            if entry_id is None or entry_id not in self.entries:
+                self.misses += 1
+                return None
+
+            answer, created_at, _ = self.entries[entry_id]
+            if self._is_expired(created_at, time.monotonic()):
+                self._remove([entry_id])
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(entry_id)
+            self.hits += 1
+            return answer
+
+    def store(self, query_embedding, answer, key=None):
+        """Cache an answer for a query embedding and/or an exact text key"""
+        if self.max_entries <= 0:
+            # Caching disabled
+            return
+        with self.lock:
+            now = time.monotonic()
+            self._purge_expired(now)
+
+            while len(self.entries) >= self.max_entries:
+                oldest_id = next(iter(self.entries))
+                self._remove([oldest_id])
+                self.evictions += 1
+
+            entry_id = self.next_id
+            self.next_id += 1
+            if query_embedding is not None:
+                self.index.add_with_ids(self._to_vector(query_embedding), np.array([entry_id], dtype='int64'))
+            if key is not None:
+                self.keys[key] = entry_id
+            self.entries[entry_id] = (answer, now, key)
+
+    def invalidate(self):
+        """Drop every cached answer, e.g. after the vector store was rebuilt"""
+        with self.lock:
+            self.index.reset()
+            self.entries.clear()
+            self.keys.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
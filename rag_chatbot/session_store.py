@@ -0,0 +1,145 @@
+# session_store.py
+# Server-side conversation sessions: the last few turns of each conversation
+# and the chunk ids they were answered from, so follow-up questions can reuse
+# the previous retrieval and the LLM sees a short history
+
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# Rough per-turn bookkeeping cost on top of the stored text and ids
+TURN_OVERHEAD_BYTES = 200
+
+
+class Turn:
+    """One answered question; the answer is truncated, chunk_ids are the FAISS ids retrieved for it"""
+
+    __slots__ = ('question', 'answer', 'chunk_ids')
+
+    def __init__(self, question, answer, chunk_ids):
+        self.question = question
+        self.answer = answer
+        self.chunk_ids = chunk_ids
+
+    def size(self):
+        return len(self.question) + len(self.answer) + self.chunk_ids.nbytes + TURN_OVERHEAD_BYTES
+
+
+class SessionStore:
+    """
+    In-memory session store. Each session keeps at most `max_turns` turns
+    (answers cut to `answer_chars`). Sessions expire `ttl_seconds` after their
+    last use, and the least recently used ones are evicted once there are
+    `max_sessions` of them or their estimated size exceeds `max_bytes`.
+    Session ids are always issued here; unknown ids start a new session.
+    """
+
+    def __init__(self, ttl_seconds=1800, max_sessions=10000, max_turns=6, answer_chars=600,
+                 max_bytes=64 * 1024 * 1024):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.max_turns = max_turns
+        self.answer_chars = answer_chars
+        self.max_bytes = max_bytes
+
+        self.sessions = OrderedDict()  # session_id -> (turns, updated_at, size), oldest use first
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+        self.created = 0
+        self.expired = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return self.max_sessions > 0
+
+    def _is_expired(self, updated_at, now):
+        return self.ttl_seconds is not None and now - updated_at > self.ttl_seconds
+
+    def _remove(self, session_id):
+        _, _, size = self.sessions.pop(session_id)
+        self.total_bytes -= size
+
+    def _purge_expired(self, now):
+        # Oldest use first, so expired sessions are at the front
+        while self.sessions:
+            session_id, (_, updated_at, _) = next(iter(self.sessions.items()))
+            if not self._is_expired(updated_at, now):
+                break
+            self._remove(session_id)
+            self.expired += 1
+
+    def _evict(self):
+        while self.sessions and (len(self.sessions) > self.max_sessions or self.total_bytes > self.max_bytes):
+            self._remove(next(iter(self.sessions)))
+            self.evictions += 1
+
+    def open(self, session_id=None):
+        """
+        (session_id, turns) for a known, live session, or a new empty session.
+        Returns (None, []) when sessions are disabled.
+        """
+        if not self.enabled:
+            return None, []
+        with self.lock:
+            now = time.monotonic()
+            self._purge_expired(now)
+            if session_id is not None and session_id in self.sessions:
+                turns, _, size = self.sessions[session_id]
+                self.sessions[session_id] = (turns, now, size)
+                self.sessions.move_to_end(session_id)
+                return session_id, list(turns)
+
+            session_id = secrets.token_urlsafe(16)
+            self.sessions[session_id] = ([], now, 0)
+            self.created += 1
+            self._evict()
+            return session_id, []
+
+    def append(self, session_id, question, answer, chunk_ids=None):
+        """Record a turn; the oldest turns are dropped beyond max_turns"""
+        if session_id is None:
+            return
+        chunk_ids = np.asarray(chunk_ids if chunk_ids is not None else [], dtype='<i8')
+        turn = Turn(question, answer[:self.answer_chars], chunk_ids)
+        with self.lock:
+            if session_id not in self.sessions:
+                # Expired or evicted while the answer was generated
+                return
+            turns, _, size = self.sessions[session_id]
+            turns = (turns + [turn])[-self.max_turns:]
+            new_size = sum(t.size() for t in turns)
+            self.total_bytes += new_size - size
+            self.sessions[session_id] = (turns, time.monotonic(), new_size)
+            self.sessions.move_to_end(session_id)
+            self._evict()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "sessions": len(self.sessions),
+                "bytes": self.total_bytes,
+                "created": self.created,
+                "expired": self.expired,
+                "evictions": self.evictions,
+            }
+
+
+def format_history(turns, count_tokens, max_tokens):
+    """
+    The most recent turns that fit in `max_tokens`, oldest first, as
+    "User: ... / Assistant: ..." lines for the prompt
+    """
+    blocks, used = [], 0
+    for turn in reversed(turns):
+        block = f"User: {turn.question}\nAssistant: {turn.answer}"
+        tokens = count_tokens(block)
+        if used + tokens > max_tokens:
+            break
+        blocks.append(block)
+        used += tokens
+    return "\n\n".join(reversed(blocks))
@@ -0,0 +1,63 @@
+# single_flight.py
+# Request coalescing: concurrent calls with the same key share one execution
+
+import asyncio
+
+
+class _Call:
+    __slots__ = ('task', 'waiters')
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    The first caller for a key starts the work; callers arriving while it
+    runs await the same task and get the same result or exception. A caller
+    that is cancelled (client gone) only stops waiting: the work is cancelled
+    once nobody waits for it any more. Nothing is kept after completion, so
+    this coalesces in-flight work only and never serves stale results.
+    """
+
+    def __init__(self):
+        self.calls = {}  # key -> _Call
+        self.executions = 0
+        self.coalesced = 0
+
+    def _forget(self, key, call, task):
+        if self.calls.get(key) is call:
+            del self.calls[key]
+        if task.done() and not task.cancelled():
+            # Mark the exception as retrieved even if every waiter was gone
+            task.exception()
+
+    async def run(self, key, fn, *args):
+        """Await fn(*args), or the identical call already in flight for key"""
+        call = self.calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn(*args)))
+            call.task.add_done_callback(lambda task: self._forget(key, call, task))
+            self.calls[key] = call
+            self.executions += 1
+        else:
+            self.coalesced += 1
+
+        call.waiters += 1
+        try:
+            # shield: cancelling one waiter must not cancel the shared task
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                call.task.cancel()
+                # Later callers start fresh instead of joining a cancelled task
+                self._forget(key, call, call.task)
+
+    def stats(self):
+        return {
+            "in_flight": len(self.calls),
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+        }
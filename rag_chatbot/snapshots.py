@@ -0,0 +1,272 @@
+# snapshots.py
+# Versioned index snapshots for zero-downtime re-indexing
+#
+# Every build writes a complete index (FAISS index, chunk store, BM25 index,
+# manifest) into a fresh directory under INDEX_SNAPSHOT_DIR, which is then
+# published with an atomic rename to v<NNNNNN> and an atomic replace of the
+# CURRENT pointer file. Published snapshots are never modified, so serving
+# processes can keep memory-mapping an old one while a new one is built.
+# ReloadableVectorStore watches CURRENT from a background thread and swaps the
+# store reference: searches that already hold the old store finish on it, new
+# ones use the new.
+# A rollback also writes a PINNED marker: builds leave CURRENT alone until
+# the pin is removed explicitly, so a restart doesn't undo the rollback.
+
+import fcntl
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_DIR = os.getenv('INDEX_SNAPSHOT_DIR', 'index_snapshots')
+SNAPSHOT_KEEP = int(os.getenv('INDEX_SNAPSHOT_KEEP', '3'))  # Published versions kept for rollback
+SNAPSHOT_CHECK_INTERVAL = float(os.getenv('INDEX_SNAPSHOT_CHECK_INTERVAL', '5'))  # Seconds between CURRENT checks
+
+CURRENT_FILE = 'CURRENT'
+PIN_FILE = 'PINNED'
+LOCK_FILE = '.build.lock'
+BUILD_PREFIX = '.building-'
+VERSION_PREFIX = 'v'
+
+
+class SnapshotBuildInProgress(Exception):
+    """Another process holds the build lock"""
+
+
+class SnapshotDirectory:
+    """Published versions, the CURRENT pointer, and building/publishing new versions"""
+
+    def __init__(self, root=SNAPSHOT_DIR, keep=SNAPSHOT_KEEP):
+        self.root = root
+        self.keep = keep
+
+    def path(self, version):
+        return os.path.join(self.root, version)
+
+    def versions(self):
+        """Published versions, oldest first"""
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root)
+                      if name.startswith(VERSION_PREFIX) and name[1:].isdigit())
+
+    def current_version(self):
+        try:
+            with open(os.path.join(self.root, CURRENT_FILE), 'r', encoding='ascii') as f:
+                version = f.read().strip()
+        except OSError:
+            return None
+        return version if os.path.isdir(self.path(version)) else None
+
+    def _fsync_root(self):
+        fd = os.open(self.root, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _write_pointer(self, name, version):
+        tmp_path = os.path.join(self.root, name + '.tmp')
+        with open(tmp_path, 'w', encoding='ascii') as f:
+            f.write(version + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, os.path.join(self.root, name))
+        self._fsync_root()
+
+    def set_current(self, version):
+        """Point CURRENT at a published version (atomic replace)"""
+        if version not in self.versions():
+            raise ValueError(f"Unknown index snapshot version: {version}")
+        self._write_pointer(CURRENT_FILE, version)
+
+    def pinned_version(self):
+        """The version a rollback pinned, or None"""
+        try:
+            with open(os.path.join(self.root, PIN_FILE), 'r', encoding='ascii') as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def unpin(self):
+        """Let builds publish again; returns the version that was pinned"""
+        version = self.pinned_version()
+        if version is not None:
+            os.remove(os.path.join(self.root, PIN_FILE))
+            self._fsync_root()
+            logger.info("Unpinned index snapshot %s", version)
+        return version
+
+    @contextmanager
+    def build_lock(self):
+        """Exclusive build lock; released by the OS if the builder dies"""
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, LOCK_FILE), 'w') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise SnapshotBuildInProgress("An index snapshot is already being built.")
+            try:
+                self._remove_abandoned_builds()
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def wait_for_build(self):
+        """Block until no process holds the build lock"""
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, LOCK_FILE), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _remove_abandoned_builds(self):
+        # Only called with the build lock held, so these belong to dead builders
+        for name in os.listdir(self.root):
+            if name.startswith(BUILD_PREFIX):
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+
+    def new_build_dir(self):
+        return tempfile.mkdtemp(prefix=BUILD_PREFIX, dir=self.root)
+
+    def publish(self, build_dir):
+        """Rename a finished build directory to the next version and make it current"""
+        versions = self.versions()
+        number = int(versions[-1][1:]) + 1 if versions else 1
+        version = f"{VERSION_PREFIX}{number:06d}"
+        os.rename(build_dir, self.path(version))
+        self._fsync_root()
+        self.set_current(version)
+        self.prune()
+        logger.info("Published index snapshot %s", version)
+        return version
+
+    def previous_version(self, version=None):
+        """The published version before `version` (default: the current one)"""
+        version = version or self.current_version()
+        older = [v for v in self.versions() if version is None or v < version]
+        return older[-1] if older else None
+
+    def rollback(self, version=None):
+        """
+        Point CURRENT at `version`, or at the version before the current one,
+        and pin it: builds publish nothing until unpin()
+        """
+        target = version or self.previous_version()
+        if target is None:
+            raise ValueError("No earlier index snapshot to roll back to.")
+        self.set_current(target)
+        self._write_pointer(PIN_FILE, target)
+        logger.info("Rolled index snapshot back to %s (pinned until unpinned)", target)
+        return target
+
+    def prune(self):
+        """Delete old versions beyond `keep`; the current one is always kept"""
+        current = self.current_version()
+        versions = self.versions()
+        for version in versions[:max(0, len(versions) - self.keep)]:
+            if version != current:
+                # Processes still serving from it keep their memory maps
+                shutil.rmtree(self.path(version), ignore_errors=True)
+
+    def stats(self):
+        return {
+            "root": self.root,
+            "current": self.current_version(),
+            "pinned": self.pinned_version(),
+            "versions": self.versions(),
+        }
+
+
+class ReloadableVectorStore:
+    """
+    Serves the vector store of the current snapshot. A background thread
+    checks the CURRENT pointer every `check_interval` seconds and loads a new
+    version off the request path, then swaps it in with one assignment;
+    current() only returns the reference, so requests never touch the disk.
+    `load_fn(directory)` returns a loaded store and `on_swap(version)` runs
+    after each swap.
+    """
+
+    def __init__(self, snapshots, load_fn, check_interval=SNAPSHOT_CHECK_INTERVAL, on_swap=None):
+        self.snapshots = snapshots
+        self.load_fn = load_fn
+        self.check_interval = check_interval
+        self.on_swap = on_swap
+        self.lock = threading.Lock()  # Held while loading
+        self.watcher_lock = threading.Lock()
+        self.watcher = None
+        self.loading = False
+        self.store = None
+        self.version = None
+        self.swaps = 0
+        # Threads don't survive fork (serve.py workers): each process starts its own watcher
+        os.register_at_fork(after_in_child=self._forget_watcher)
+
+    def set(self, store, version):
+        self.store = store
+        self.version = version
+
+    def reload(self):
+        """Load the current snapshot if it isn't the one being served; returns the served version"""
+        with self.lock:
+            return self._reload()
+
+    def _reload(self):
+        version = self.snapshots.current_version()
+        if version is None or version == self.version:
+            return self.version
+        started = time.perf_counter()
+        self.loading = True
+        try:
+            store = self.load_fn(self.snapshots.path(version))
+        except Exception:
+            logger.exception("Could not load index snapshot %s; still serving %s", version, self.version)
+            return self.version
+        finally:
+            self.loading = False
+        previous = self.version
+        self.set(store, version)
+        self.swaps += 1
+        logger.info("Swapped index snapshot %s -> %s (loaded in %.2fs)",
+                    previous, version, time.perf_counter() - started)
+        if self.on_swap is not None:
+            self.on_swap(version)
+        return version
+
+    def _forget_watcher(self):
+        # The parent's threads (and any lock they held) are gone in the child
+        self.lock = threading.Lock()
+        self.watcher_lock = threading.Lock()
+        self.watcher = None
+        self.loading = False
+
+    def _watch(self):
+        while True:
+            time.sleep(self.check_interval)
+            try:
+                self.reload()
+            except Exception:
+                logger.exception("Index snapshot check failed")
+
+    def _start_watcher(self):
+        with self.watcher_lock:
+            if self.watcher is None:
+                self.watcher = threading.Thread(target=self._watch, name='snapshot-watch', daemon=True)
+                self.watcher.start()
+
+    def current(self):
+        if self.watcher is None:
+            self._start_watcher()
+        return self.store
+
+    def stats(self):
+        return {
+            "version": self.version,
+            "swaps": self.swaps,
+            "loading": self.loading,
+        }
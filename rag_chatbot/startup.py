@@ -0,0 +1,57 @@
+# startup.py
+# Background warmup and readiness
+#
+# Importing the app loads nothing heavy: the server accepts connections (and
+# answers /health) right away while the embedding model, index snapshot and
+# LLM client are loaded in a thread. /ready reports ready only after a dummy
+# query has been encoded and searched, so a load balancer or autoscaler sends
+# traffic to a pod once its first real request will be fast.
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Warmup:
+    """
+    Runs named startup steps once, in order, and records how long each took.
+    A failed step leaves the process not ready; run() can be called again.
+    """
+
+    def __init__(self, steps):
+        self.steps = steps  # [(name, fn)]
+        self.lock = threading.Lock()
+        self.ready = False
+        self.error = None
+        self.timings = {}
+
+    def run(self):
+        """Run the steps unless already done; returns True once ready"""
+        with self.lock:
+            if self.ready:
+                return True
+            started = time.perf_counter()
+            for name, step in self.steps:
+                if name in self.timings:
+                    continue
+                step_started = time.perf_counter()
+                try:
+                    step()
+                except Exception as e:
+                    logger.exception("Warmup step '%s' failed", name)
+                    self.error = f"{name}: {e}"
+                    return False
+                self.timings[name] = round(time.perf_counter() - step_started, 3)
+            self.error = None
+            self.ready = True
+        logger.info("Warmup done in %.2fs %s", time.perf_counter() - started, self.timings)
+        return True
+
+    def status(self):
+        return {
+            "ready": self.ready,
+            "error": self.error,
+            "steps": dict(self.timings),
+        }
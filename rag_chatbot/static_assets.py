@@ -0,0 +1,251 @@
+# static_assets.py
+# Precompressed, content-hashed static assets and cached pages
+#
+# The build step (`python -m rag_chatbot.static_assets`) copies every file in
+# static/ to STATIC_BUILD_DIR under a content-hashed name (widget.3f9c1e2a7b4d.css)
+# next to .gz and .br (brotli, if installed) versions and a manifest. The app
+# holds those bytes in memory and serves them by the client's
+# Accept-Encoding with a strong ETag:
+#   /static/css/widget.3f9c1e2a7b4d.css  cached for a year, immutable
+#   /static/css/widget.css               short max-age, revalidated with If-None-Match
+# The pages reference the hashed names through static_url(), are rendered
+# once and are served the same way (revalidated on every load, so a deploy
+# is picked up at once). Without a build (or with sources newer than it) the
+# same files are built in memory at startup.
+
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import shutil
+
+from starlette.responses import Response
+
+from .compression import negotiate_encoding
+
+try:
+    import brotli
+except ImportError:  # Optional: gzip only
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+STATIC_DIR = 'static'
+STATIC_BUILD_DIR = os.getenv('STATIC_BUILD_DIR', 'static_build')
+STATIC_MAX_AGE = int(os.getenv('STATIC_MAX_AGE', '300'))  # Seconds, for unhashed asset names
+MANIFEST_FILE = 'manifest.json'
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+PAGE_CACHE_CONTROL = 'no-cache'  # Always revalidated (cheap: 304 on a matching ETag)
+
+COMPRESSIBLE_TYPES = ('image/svg+xml', 'application/javascript', 'application/json')
+ENCODING_SUFFIXES = {'gzip': '.gz', 'br': '.br'}
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:12]
+
+
+def hashed_name(path, digest):
+    root, extension = os.path.splitext(path)
+    return f"{root}.{digest}{extension}"
+
+
+def media_type(path):
+    return mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+
+def compress(data, media):
+    """{encoding: bytes} of the encodings that make the file smaller"""
+    if not (media.startswith('text/') or media in COMPRESSIBLE_TYPES):
+        return {}
+    encoded = {'gzip': gzip.compress(data, 9, mtime=0)}
+    if brotli is not None:
+        encoded['br'] = brotli.compress(data, quality=11)
+    return {encoding: body for encoding, body in encoded.items() if len(body) < len(data)}
+
+
+def source_files(source_dir):
+    """Paths relative to source_dir, skipping hidden files (.DS_Store)"""
+    for root, dirs, files in os.walk(source_dir):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+        for name in sorted(files):
+            if not name.startswith('.'):
+                yield os.path.relpath(os.path.join(root, name), source_dir).replace(os.sep, '/')
+
+
+class Asset:
+    """One file (or rendered page) with its encoded bodies and ETag"""
+
+    __slots__ = ('path', 'hashed_path', 'media_type', 'digest', 'bodies')
+
+    def __init__(self, path, data, media=None, digest=None, encoded=None):
+        self.path = path
+        self.media_type = media or media_type(path)
+        self.digest = digest or content_hash(data)
+        self.hashed_path = hashed_name(path, self.digest)
+        self.bodies = {None: data}
+        self.bodies.update(compress(data, self.media_type) if encoded is None else encoded)
+
+    def etag(self, encoding):
+        # Strong ETags differ per representation
+        return f'"{self.digest}"' if encoding is None else f'"{self.digest}-{encoding}"'
+
+    def response(self, request_headers, cache_control):
+        """200 with the best encoding for the client, or 304 if its cached copy is current"""
+        encoding = negotiate_encoding(request_headers.get('accept-encoding'), self.bodies)
+        etag = self.etag(encoding)
+        headers = {'ETag': etag, 'Cache-Control': cache_control, 'Vary': 'Accept-Encoding'}
+        if etag_matches(request_headers.get('if-none-match'), etag):
+            return Response(status_code=304, headers=headers)
+        if encoding is not None:
+            headers['Content-Encoding'] = encoding
+        return Response(self.bodies[encoding], media_type=self.media_type, headers=headers)
+
+
+def etag_matches(if_none_match, etag):
+    """If-None-Match uses the weak comparison: W/ prefixes are ignored"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    return any(tag.strip().removeprefix('W/') == etag for tag in if_none_match.split(','))
+
+
+def build_assets(source_dir=STATIC_DIR, build_dir=STATIC_BUILD_DIR):
+    """Write hashed, precompressed copies of the static files and the manifest; returns the manifest"""
+    tmp_dir = build_dir.rstrip('/') + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    manifest = {}
+    for path in source_files(source_dir):
+        with open(os.path.join(source_dir, path), 'rb') as f:
+            asset = Asset(path, f.read())
+        target = os.path.join(tmp_dir, asset.hashed_path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        for encoding, body in asset.bodies.items():
+            with open(target + ENCODING_SUFFIXES.get(encoding, ''), 'wb') as f:
+                f.write(body)
+        manifest[path] = {
+            'hashed': asset.hashed_path,
+            'digest': asset.digest,
+            'encodings': sorted(encoding for encoding in asset.bodies if encoding is not None),
+        }
+    with open(os.path.join(tmp_dir, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+
+    shutil.rmtree(build_dir, ignore_errors=True)
+    os.rename(tmp_dir, build_dir)
+    return manifest
+
+
+class StaticAssets:
+    """In-memory table of the built assets, by original and by hashed path"""
+
+    def __init__(self, source_dir=STATIC_DIR, build_dir=STATIC_BUILD_DIR, max_age=STATIC_MAX_AGE):
+        self.source_dir = source_dir
+        self.build_dir = build_dir
+        self.cache_control = f'public, max-age={max_age}'
+        self.assets = {}  # original path -> Asset
+        self.hashed = {}  # hashed path -> Asset
+
+    def _build_is_current(self):
+        manifest_path = os.path.join(self.build_dir, MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            return False
+        built = os.path.getmtime(manifest_path)
+        return all(os.path.getmtime(os.path.join(self.source_dir, path)) <= built
+                   for path in source_files(self.source_dir))
+
+    def _read_build(self):
+        with open(os.path.join(self.build_dir, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        for path, entry in manifest.items():
+            target = os.path.join(self.build_dir, entry['hashed'])
+            with open(target, 'rb') as f:
+                data = f.read()
+            encoded = {}
+            for encoding in entry['encodings']:
+                with open(target + ENCODING_SUFFIXES[encoding], 'rb') as f:
+                    encoded[encoding] = f.read()
+            yield Asset(path, data, digest=entry['digest'], encoded=encoded)
+
+    def _compile(self):
+        for path in source_files(self.source_dir):
+            with open(os.path.join(self.source_dir, path), 'rb') as f:
+                yield Asset(path, f.read())
+
+    def load(self):
+        if self._build_is_current():
+            assets = list(self._read_build())
+        else:
+            if os.path.isdir(self.source_dir):
+                logger.info("No current static build in %s; compressing %s at startup "
+                            "(run `python -m rag_chatbot.static_assets` at build time)", self.build_dir, self.source_dir)
+            assets = list(self._compile())
+        self.assets = {asset.path: asset for asset in assets}
+        self.hashed = {asset.hashed_path: asset for asset in assets}
+        return self
+
+    def url(self, path):
+        """URL of a static file under its content-hashed name (for templates)"""
+        asset = self.assets.get(path)
+        return f"/static/{asset.hashed_path if asset is not None else path}"
+
+    def response(self, path, request_headers):
+        """Response for /static/<path>, or None if there is no such asset"""
+        asset = self.hashed.get(path)
+        if asset is not None:
+            return asset.response(request_headers, IMMUTABLE_CACHE_CONTROL)
+        asset = self.assets.get(path)
+        if asset is not None:
+            return asset.response(request_headers, self.cache_control)
+        return None
+
+
+class CachedPages:
+    """
+    Pages rendered once from templates without per-request data, kept
+    compressed in memory. cache=False renders on every request (development).
+    """
+
+    def __init__(self, environment, cache=True):
+        self.environment = environment
+        self.cache = cache
+        self.pages = {}
+
+    def page(self, name):
+        page = self.pages.get(name)
+        if page is None:
+            html = self.environment.get_template(name).render().encode('utf-8')
+            page = Asset(name, html, media='text/html')
+            if self.cache:
+                self.pages[name] = page
+        return page
+
+    def response(self, name, request_headers):
+        return self.page(name).response(request_headers, PAGE_CACHE_CONTROL)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+    parser = argparse.ArgumentParser(description="Build content-hashed, precompressed static assets")
+    parser.add_argument('--source', default=STATIC_DIR)
+    parser.add_argument('--output', default=STATIC_BUILD_DIR)
+    args = parser.parse_args()
+
+    manifest = build_assets(args.source, args.output)
+    for path, entry in manifest.items():
+        sizes = ", ".join(
+            f"{encoding} {os.path.getsize(os.path.join(args.output, entry['hashed']) + ENCODING_SUFFIXES[encoding])} B"
+            for encoding in entry['encodings'])
+        size = os.path.getsize(os.path.join(args.output, entry['hashed']))
+        logger.info("%s -> %s (%d B%s)", path, entry['hashed'], size, f"; {sizes}" if sizes else "")
+    if brotli is None:
+        logger.info("brotli is not installed; only gzip versions were written")
+
+
+if __name__ == '__main__':
+    main()
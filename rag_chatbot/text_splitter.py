@@ -0,0 +1,109 @@
+# text_splitter.py
+# Recursive character splitting into (start, end) offsets
+#
+# Same algorithm and output as LangChain's RecursiveCharacterTextSplitter with
+# literal separators, keep_separator=True (the separator starts the next
+# piece), strip_whitespace=True and len as the length function, so chunk
+# texts (and the content-derived chunk ids) are unchanged. Pieces are never
+# copied out of the text: the splitter works on offsets only, and callers
+# slice the text when (and if) they need a chunk's string.
+
+from array import array
+
+DEFAULT_SEPARATORS = ("\n\n", "\n", " ", "")
+
+
+class SpanSplitter:
+    """
+    Splits text into chunks of at most `chunk_size` characters (unless a
+    piece can't be split further) overlapping by up to `chunk_overlap`,
+    trying `separators` in order. split_spans() returns a flat array of
+    start, end offsets; split_text() the chunk strings.
+    """
+
+    __slots__ = ('chunk_size', 'chunk_overlap', 'separators')
+
+    def __init__(self, chunk_size=4000, chunk_overlap=200, separators=DEFAULT_SEPARATORS):
+        if chunk_overlap > chunk_size:
+            raise ValueError(f"chunk_overlap ({chunk_overlap}) is larger than chunk_size ({chunk_size})")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.separators = tuple(separators)
+
+    def split_spans(self, text):
+        spans = array('i')
+        self._split(text, 0, len(text), self.separators, spans)
+        return spans
+
+    def split_text(self, text):
+        spans = self.split_spans(text)
+        return [text[spans[i]:spans[i + 1]] for i in range(0, len(spans), 2)]
+
+    def _pieces(self, text, start, end, separator):
+        """(start, end) of the pieces between separators; each separator starts the next piece"""
+        pieces = []
+        if separator == "":
+            pieces.extend((i, i + 1) for i in range(start, end))
+            return pieces
+        piece_start = start
+        position = text.find(separator, start, end)
+        while position != -1:
+            if position > piece_start:
+                pieces.append((piece_start, position))
+            piece_start = position
+            position = text.find(separator, position + len(separator), end)
+        if end > piece_start:
+            pieces.append((piece_start, end))
+        return pieces
+
+    def _split(self, text, start, end, separators, spans):
+        separator, remaining = separators[-1], ()
+        for i, candidate in enumerate(separators):
+            if candidate == "":
+                separator = candidate
+                break
+            if text.find(candidate, start, end) != -1:
+                separator, remaining = candidate, separators[i + 1:]
+                break
+
+        good = []
+        for piece in self._pieces(text, start, end, separator):
+            if piece[1] - piece[0] < self.chunk_size:
+                good.append(piece)
+                continue
+            if good:
+                self._merge(text, good, spans)
+                good = []
+            if remaining:
+                self._split(text, piece[0], piece[1], remaining, spans)
+            else:
+                # Too long but nothing left to split on: kept as is (not stripped, like LangChain)
+                spans.extend(piece)
+        if good:
+            self._merge(text, good, spans)
+
+    def _merge(self, text, pieces, spans):
+        """Greedily join consecutive pieces into chunks, carrying up to chunk_overlap into the next one"""
+        first = 0  # First piece of the current chunk
+        total = 0
+        for i, (piece_start, piece_end) in enumerate(pieces):
+            length = piece_end - piece_start
+            if total + length > self.chunk_size and i > first:
+                self._append(text, pieces[first][0], pieces[i - 1][1], spans)
+                while total > self.chunk_overlap or (total + length > self.chunk_size and total > 0):
+                    total -= pieces[first][1] - pieces[first][0]
+                    first += 1
+            total += length
+        if first < len(pieces):
+            self._append(text, pieces[first][0], pieces[-1][1], spans)
+
+    @staticmethod
+    def _append(text, start, end, spans):
+        # Pieces are contiguous, so a chunk is one span; strip it like str.strip()
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        if end > start:
+            spans.append(start)
+            spans.append(end)
@@ -0,0 +1,57 @@
+# timing.py
+# Per-request stage timing spans (embedding, search, context, llm, media, ...).
+# Every span feeds the rag_stage_seconds histogram; the spans of a request are
+# also returned to clients in a Server-Timing header and logged as one
+# structured line when the request ends.
+
+import contextvars
+import logging
+import time
+from contextlib import contextmanager
+
+from .metrics import observe_stage
+
+logger = logging.getLogger(__name__)
+
+_request_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+def start_request():
+    """Start collecting stage timings for the current request; returns the (live) dict"""
+    timings = {}
+    _request_timings.set(timings)
+    return timings
+
+
+def record(stage, seconds):
+    observe_stage(stage, seconds)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def stage_timer(stage):
+    """Time a block of the current request under a stage name"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - started)
+
+
+def timings_ms(timings):
+    return {stage: round(seconds * 1000, 2) for stage, seconds in timings.items()}
+
+
+def server_timing_header(timings):
+    """Format timings as an HTTP Server-Timing header value"""
+    return ", ".join(f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in timings.items())
+
+
+def log_request(endpoint, timings, total_seconds, outcome="ok"):
+    """One structured line per request: endpoint, outcome, total and per-stage milliseconds"""
+    if logger.isEnabledFor(logging.INFO):
+        stages = " ".join(f"{stage}_ms={seconds * 1000:.1f}" for stage, seconds in timings.items())
+        logger.info("request endpoint=%s outcome=%s total_ms=%.1f %s",
+                    endpoint, outcome, total_seconds * 1000, stages)
@@ -1,100 +1,413 @@
 # vector_store.py
 
 import faiss
+import logging
+import math
 import numpy as np
 import os
-import pickle
+
+from .chunk_store import ChunkStore, convert_pickles, id_to_int64
+from .context_packer import ContextPacker
+from .lexical_index import LexicalIndex, match_entity_query, reciprocal_rank_fusion
+from .metrics import CONTEXT_TOKENS_SAVED
+from .vectors import as_unit_vectors
+
+logger = logging.getLogger(__name__)
 
 VECTOR_STORE_PATH = 'faiss_index.bin'
+CHUNK_STORE_PATH = 'faiss_chunk_store.bin'
+LEXICAL_INDEX_PATH = 'faiss_lexical_index.npz'
+# Legacy pickle files, only read to convert them to the chunk store
 METADATA_PATH = 'faiss_child_metadata.pkl'
 DOCSTORE_PATH = 'faiss_parent_docstore.pkl'
 
+# Index type: flat (exact), hnsw, ivf_flat, ivf_pq, sq8 or fp16
+INDEX_TYPE = os.getenv('FAISS_INDEX_TYPE', 'flat')
+INDEX_TYPES = ('flat', 'hnsw', 'ivf_flat', 'ivf_pq', 'sq8', 'fp16')
+# Build-time parameters
+HNSW_M = int(os.getenv('FAISS_HNSW_M', '32'))
+IVF_NLIST = int(os.getenv('FAISS_IVF_NLIST', '1024'))  # Upper bound, shrunk for small corpora
+PQ_M = int(os.getenv('FAISS_PQ_M', '48'))  # Sub-quantizers; must divide the embedding dim
+PQ_NBITS = int(os.getenv('FAISS_PQ_NBITS', '8'))
+TRAIN_SIZE = int(os.getenv('FAISS_TRAIN_SIZE', '50000'))  # Vectors buffered before training
+# Search-time parameters (defaults, can be overridden per search call)
+HNSW_EF_SEARCH = int(os.getenv('FAISS_HNSW_EF_SEARCH', '64'))
+IVF_NPROBE = int(os.getenv('FAISS_IVF_NPROBE', '16'))
+# Used when nothing clears the requested score threshold
+FALLBACK_SCORE_THRESHOLD = 0.2
+# Lexical (BM25) retrieval
+LEXICAL_TOP_K = int(os.getenv('LEXICAL_TOP_K', '5'))  # BM25 hits fused with the dense results
+LEXICAL_MIN_HITS = int(os.getenv('LEXICAL_MIN_HITS', '2'))  # Entity hits needed to skip the embedding
+# Chunks of an earlier turn carried into a follow-up's context
+FOLLOWUP_MAX_PREVIOUS = int(os.getenv('SESSION_FOLLOWUP_MAX_PREVIOUS', '8'))
+
+
+def index_factory_string(index_type, n_train=None):
+    """FAISS index_factory description for an index type, always wrapped in IDMap2"""
+    if index_type == 'flat':
+        return "IDMap2,Flat"
+    if index_type == 'hnsw':
+        return f"IDMap2,HNSW{HNSW_M}"
+    if index_type == 'sq8':
+        return "IDMap2,SQ8"
+    if index_type == 'fp16':
+        return "IDMap2,SQfp16"
+
+    # IVF: ~4*sqrt(n) lists, and never more lists than training points
+    nlist = IVF_NLIST
+    if n_train:
+        nlist = max(1, min(IVF_NLIST, int(4 * math.sqrt(n_train)), n_train))
+    if index_type == 'ivf_flat':
+        return f"IDMap2,IVF{nlist},Flat"
+    if index_type == 'ivf_pq':
+        # k-means needs at least 2**nbits points per sub-quantizer
+        nbits = PQ_NBITS
+        if n_train:
+            nbits = max(1, min(PQ_NBITS, int(math.log2(n_train))))
+        return f"IDMap2,IVF{nlist},PQ{PQ_M}x{nbits}"
+    raise ValueError(f"Unknown FAISS index type '{index_type}', expected one of {INDEX_TYPES}")
+
+def build_index(index_type, embedding_dim, n_train=None):
+    return faiss.index_factory(embedding_dim, index_factory_string(index_type, n_train), faiss.METRIC_INNER_PRODUCT)
+
+def detect_index_type(index):
+    """Recover the index type of a loaded index (FAISS stores the structure in the file)"""
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        index = faiss.downcast_index(index.index)
+    if isinstance(index, faiss.IndexHNSW):
+        return 'hnsw'
+    if isinstance(index, faiss.IndexIVFPQ):
+        return 'ivf_pq'
+    if isinstance(index, faiss.IndexIVFFlat):
+        return 'ivf_flat'
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        return 'fp16' if index.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else 'sq8'
+    return 'flat'
+
+def supports_removal(index_type):
+    # HNSW graphs can't drop vectors; those indexes are rebuilt instead
+    return index_type != 'hnsw'
+
 class FaissVectorStore:
-    def __init__(self, embedding_dim):
+    def __init__(self, embedding_dim, index_type=INDEX_TYPE, directory=''):
         self.embedding_dim = embedding_dim
-        self.index = faiss.IndexFlatIP(embedding_dim)
-        self.docstore = {} 
-        self.metadata = [] 
+        self.index_type = index_type
+        # Where the index files live: '' for the working directory, or an index snapshot
+        self.directory = directory
+        # ID-mapped so single documents' vectors can be removed and re-added
+        self.index = build_index(index_type, embedding_dim)
+        # Child chunk texts and parent documents, addressed by FAISS row id
+        self.chunks = ChunkStore.empty()
+        # Vectors waiting for IVF/PQ/SQ training
+        self.pending_ids = []
+        self.pending_vectors = []
+        # BM25 index over the same chunk store rows
+        self.lexical = None
+        # Merges, dedups and token-budgets the selected chunks
+        self.context_packer = ContextPacker()
+
+    def reset(self, index_type=None):
+        """Drop all vectors and chunks (before a full rebuild)"""
+        self.index_type = index_type or self.index_type
+        self.index = build_index(self.index_type, self.embedding_dim)
+        self.chunks = ChunkStore.empty()
+        self.pending_ids = []
+        self.pending_vectors = []
+        self.lexical = None
 
     # 'embedding_fn' ARTIK BİR PARAMETRE
     def add(self, parent_docs, child_docs, embedding_fn):
         """
         Parent ve Child dokümanları alır, child'ları vektörleştirir ve depolar.
         """
-        self.docstore = {doc.metadata['doc_id']: doc.page_content for doc in parent_docs}
-        
         texts_for_embedding = [doc.page_content for doc in child_docs]
         
         # PARAMETRE OLARAK GELEN embedding_fn'i KULLANIYORUZ
-        np_embeddings = np.array(embedding_fn.embed_documents(texts_for_embedding)).astype('float32')
+        np_embeddings = embedding_fn.embed_documents(texts_for_embedding)
         
         if np_embeddings.shape[0] > 0:
-            faiss.normalize_L2(np_embeddings)
-            self.index.add(np_embeddings)
-            self.metadata.extend(child_docs)
+            child_ids = [id_to_int64(doc.metadata['chunk_id']) for doc in child_docs]
+            self.add_embeddings(child_ids, np_embeddings)
+            self.train_pending()
+            self.chunks = ChunkStore.from_documents(parent_docs, child_docs, child_ids)
+            self.rebuild_lexical()
+
+    def add_embeddings(self, ids, embeddings):
+        """Add already computed embeddings under the given int64 ids (unit float32 rows are used without a copy)"""
+        embeddings = as_unit_vectors(embeddings)
+        if embeddings.shape[0] == 0:
+            return
+        ids = np.asarray(ids, dtype='int64')
+
+        if self.index.is_trained:
+            self.index.add_with_ids(embeddings, ids)
+            return
+
+        # IVF/PQ/SQ indexes must be trained first; collect a training sample
+        self.pending_ids.append(ids)
+        self.pending_vectors.append(embeddings)
+        if sum(len(v) for v in self.pending_vectors) >= TRAIN_SIZE:
+            self.train_pending()
+
+    def train_pending(self):
+        """Train the index on the buffered vectors (if it needs training) and add them"""
+        if not self.pending_vectors:
+            return
+        vectors = np.vstack(self.pending_vectors)
+        ids = np.concatenate(self.pending_ids)
+        self.pending_ids = []
+        self.pending_vectors = []
+
+        if not self.index.is_trained:
+            # Size IVF lists / PQ codebooks for the amount of training data we have
+            self.index = build_index(self.index_type, self.embedding_dim, n_train=len(vectors))
+            logger.info("Training %s index on %d vectors...", self.index_type, len(vectors))
+            self.index.train(vectors)
+        self.index.add_with_ids(vectors, ids)
+
+    def remove_ids(self, ids):
+        if len(ids):
+            self.index.remove_ids(np.asarray(ids, dtype='int64'))
+
+    def rebuild_lexical(self):
+        """Rebuild the BM25 index from the current chunk store"""
+        self.lexical = LexicalIndex.build(self.chunks) if len(self.chunks) else None
+
+    def path(self, filename):
+        return os.path.join(self.directory, filename)
 
     def save(self):
-        faiss.write_index(self.index, VECTOR_STORE_PATH)
-        with open(METADATA_PATH, 'wb') as f:
-            pickle.dump(self.metadata, f)
-        with open(DOCSTORE_PATH, 'wb') as f:
-            pickle.dump(self.docstore, f)
+        self.save_index()
+        self.chunks.save(self.path(CHUNK_STORE_PATH))
+        self.save_lexical()
+
+    def save_lexical(self):
+        if self.lexical is not None:
+            self.lexical.save(self.path(LEXICAL_INDEX_PATH))
+
+    def save_index(self):
+        self.train_pending()
+        tmp_path = self.path(VECTOR_STORE_PATH) + '.tmp'
+        faiss.write_index(self.index, tmp_path)
+        os.replace(tmp_path, self.path(VECTOR_STORE_PATH))
 
     # load METODUNUN ARTIK embedding_fn PARAMETRESİNE İHTİYACI YOK
-    def load(self):
-        if os.path.exists(VECTOR_STORE_PATH):
-            self.index = faiss.read_index(VECTOR_STORE_PATH)
-        if os.path.exists(METADATA_PATH):
-            with open(METADATA_PATH, 'rb') as f:
-                self.metadata = pickle.load(f)
-        if os.path.exists(DOCSTORE_PATH):
-            with open(DOCSTORE_PATH, 'rb') as f:
-                self.docstore = pickle.load(f)
-
-    def search(self, query_embedding, top_k=8, score_threshold=0.35, max_context_length=25000):
+    def load(self, convert_legacy_to=None):
+        """
+        Load the index files from self.directory. Legacy pickle metadata (and
+        a missing lexical index) are only converted and written when
+        convert_legacy_to names a directory for the results (an index
+        build), never as a side effect of serving.
+        """
+        index_path = self.path(VECTOR_STORE_PATH)
+        chunk_store_path = self.path(CHUNK_STORE_PATH)
+        lexical_path = self.path(LEXICAL_INDEX_PATH)
+        metadata_path, docstore_path = self.path(METADATA_PATH), self.path(DOCSTORE_PATH)
+
+        if os.path.exists(index_path):
+            self.index = read_index_mmap(index_path)
+            self.index_type = detect_index_type(self.index)
+        if not os.path.exists(chunk_store_path) and os.path.exists(metadata_path) and os.path.exists(docstore_path):
+            if convert_legacy_to is None:
+                logger.warning("Legacy pickle metadata in %s is not loaded; convert it with "
+                               "`python -m rag_chatbot.chunk_store` or build an index snapshot.",
+                               self.directory or "the working directory")
+            else:
+                logger.info("Converting legacy pickle metadata to the chunk store format...")
+                chunk_store_path = os.path.join(convert_legacy_to, CHUNK_STORE_PATH)
+                convert_pickles(metadata_path, docstore_path, chunk_store_path)
+        if os.path.exists(chunk_store_path):
+            self.chunks = ChunkStore.open(chunk_store_path)
+
+        if os.path.exists(lexical_path):
+            self.lexical = LexicalIndex.load(lexical_path)
+        if len(self.chunks) and (self.lexical is None or self.lexical.n_docs != len(self.chunks)):
+            # Stores built before the lexical index existed
+            logger.info("Building the lexical index from the chunk store...")
+            self.rebuild_lexical()
+            if convert_legacy_to is not None:
+                self.lexical.save(os.path.join(convert_legacy_to, LEXICAL_INDEX_PATH))
+
+    def lexical_fast_path(self, query_text, entity_tables, top_k=8, max_context_length=25000):
+        """
+        Chunks for a query that is only a brand or product name (plus filler
+        words like "case study"), found through the BM25 index without an
+        embedding. Returns (chunks, chunk_ids), or None when the query can't
+        be resolved confidently.
+        """
+        rows, entities = self.lexical_rows(query_text, entity_tables, top_k)
+        if rows is None:
+            return None
+
+        relevant_chunks, chunk_ids = self.pack_rows_with_ids(rows, max_context_length)
+        logger.debug("lexical entity query entities=%s chunks=%d", [' '.join(p) for p in entities], len(relevant_chunks))
+        return relevant_chunks, chunk_ids
+
+    def lexical_rows(self, query_text, entity_tables, top_k=8):
+        """
+        The fast path's ranked rows and the entities they match, or
+        (None, entities) when the query can't be resolved confidently
+        """
+        if self.lexical is None:
+            return None, []
+        entities = match_entity_query(query_text, entity_tables)
+        if not entities:
+            return None, entities
+
+        rows, _ = self.lexical.search(query_text, max(top_k, LEXICAL_TOP_K) * 4)
+        entity_rows = np.concatenate([self.lexical.rows_with_phrase_terms(phrase) for phrase in entities])
+        rows = rows[np.isin(rows, entity_rows)][:top_k]
+        if len(rows) < LEXICAL_MIN_HITS:
+            return None, entities
+        return rows, entities
+
+    def search_params(self, ef_search=None, nprobe=None):
+        """Per-call search parameters (thread-safe, unlike setting them on the index)"""
+        if self.index_type == 'hnsw':
+            return faiss.SearchParametersHNSW(efSearch=ef_search or HNSW_EF_SEARCH)
+        if self.index_type in ('ivf_flat', 'ivf_pq'):
+            return faiss.SearchParametersIVF(nprobe=nprobe or IVF_NPROBE)
+        return None
+
+    def search(self, query_embedding, top_k=8, score_threshold=0.35, max_context_length=25000,
+               ef_search=None, nprobe=None, query_text=None):
         """
         OPTIMIZED VERSION: Returns only relevant child chunks instead of full parent documents
         - Higher similarity threshold (0.4) for better quality
         - More results (top_k=8) for detailed responses
         - Context length limit (25000) for comprehensive answers
+        - ef_search / nprobe trade recall for speed on HNSW / IVF indexes
+        - query_text adds BM25 hits, fused with the dense ranking
         """
-        if self.index.ntotal == 0:
-            return []
+        query_texts = [query_text] if query_text is not None else None
+        return self.search_batch(query_embedding, top_k, score_threshold, max_context_length, ef_search, nprobe,
+                                 query_texts)[0]
 
-        query_vector = np.array([query_embedding]).astype('float32')
-        faiss.normalize_L2(query_vector)
+    def search_batch(self, query_embeddings, top_k=8, score_threshold=0.35, max_context_length=25000,
+                     ef_search=None, nprobe=None, query_texts=None):
+        """
+        Search a matrix of query embeddings with a single FAISS call.
+        Thresholds and the context budget are applied per row; returns one
+        list of chunks per query. With query_texts, each row's dense results
+        are fused with its BM25 hits by reciprocal rank fusion.
+        """
+        results = []
+        for rows in self.ranked_rows(query_embeddings, top_k, score_threshold, ef_search, nprobe, query_texts):
+            relevant_chunks = self.pack_rows(rows, max_context_length)
+            logger.debug("vector search children=%d returned=%d", len(self.chunks), len(relevant_chunks))
+            results.append(relevant_chunks)
+        return results
 
-        scores, indices = self.index.search(query_vector, top_k)
-        
-        relevant_chunks = []
-        total_context_length = 0
-        
-        for i, idx in enumerate(indices[0]):
-            if idx == -1: 
+    def search_with_ids(self, query_embedding, top_k=8, score_threshold=0.35, max_context_length=25000,
+                        query_text=None, previous_ids=None, max_previous=FOLLOWUP_MAX_PREVIOUS):
+        """
+        Like search, but returns (chunks, chunk_ids) so a conversation can
+        reuse them; chunk_ids are the chunks that made it into the context.
+        The best max_previous of previous_ids (chunks of an earlier turn,
+        best first) are interleaved with the new hits by reciprocal rank
+        fusion, so a follow-up extends the previous context without its own
+        hits being the ones cut by the token budget.
+        """
+        query_texts = [query_text] if query_text is not None else None
+        rows = self.ranked_rows(query_embedding, top_k, score_threshold, query_texts=query_texts)[0]
+        if previous_ids is not None and len(previous_ids):
+            previous_rows = [int(row) for row in self.chunks.rows_for_ids(previous_ids) if row != -1][:max_previous]
+            rows = reciprocal_rank_fusion([previous_rows, rows])
+        return self.pack_rows_with_ids(rows, max_context_length)
+
+    def similarity_to_ids(self, query_embedding, ids):
+        """Highest similarity between a query and the given chunks (-1.0 if none of them is indexed)"""
+        ids = np.asarray(ids, dtype='int64')
+        if self.index.ntotal == 0 or len(ids) == 0:
+            return -1.0
+        selector = faiss.IDSelectorBatch(ids)
+        params = self.search_params() or faiss.SearchParameters()
+        params.sel = selector
+        scores, indices = self.index.search(as_unit_vectors(query_embedding), 1, params=params)
+        return float(scores[0, 0]) if indices[0, 0] != -1 else -1.0
+
+    def ids_for_rows(self, rows):
+        """Stable chunk (FAISS) ids of chunk store rows"""
+        return np.array([self.chunks.child_id(row) for row in rows], dtype='<i8')
+
+    def ranked_rows(self, query_embeddings, top_k=8, score_threshold=0.35, ef_search=None, nprobe=None,
+                    query_texts=None, fallback_threshold=None):
+        """
+        Ranked chunk store rows per query, from one FAISS call (fused with
+        BM25 given query_texts). query_embeddings is one vector or a matrix;
+        the embedding model's output is searched as is, without a copy.
+        fallback_threshold defaults to FALLBACK_SCORE_THRESHOLD.
+        """
+        query_vectors = as_unit_vectors(query_embeddings)
+        if self.index.ntotal == 0 or len(query_vectors) == 0:
+            return [[] for _ in range(len(query_vectors))]
+
+        params = self.search_params(ef_search, nprobe)
+        if params is not None:
+            scores, indices = self.index.search(query_vectors, top_k, params=params)
+        else:
+            scores, indices = self.index.search(query_vectors, top_k)
+
+        results = []
+        for i, (row_scores, row_ids) in enumerate(zip(scores, indices)):
+            lexical_rows = None
+            if query_texts is not None and self.lexical is not None:
+                lexical_rows, _ = self.lexical.search(query_texts[i], LEXICAL_TOP_K)
+
+            results.append(self.select_rows(row_scores, row_ids, score_threshold, lexical_rows, fallback_threshold))
+
+        return results
+
+    def select_rows(self, row_scores, row_ids, score_threshold, lexical_rows=None, fallback_threshold=None):
+        """
+        Chunk store rows of one result row, best first. Rows above the
+        threshold are used; if there are none, rows above the fallback
+        threshold are (both collected in the same pass over the candidates).
+        """
+        # FAISS returns child ids; map them to chunk store rows
+        rows = self.chunks.rows_for_ids(row_ids)
+        if fallback_threshold is None:
+            fallback_threshold = FALLBACK_SCORE_THRESHOLD
+        fallback_threshold = min(score_threshold, fallback_threshold)
+        dense_rows, fallback_rows = [], []
+        for idx, score in zip(rows, row_scores):
+            if idx == -1:
                 continue
-            
-            score = scores[0][i]
             if score >= score_threshold:
-                child_doc = self.metadata[idx]
-                chunk_content = child_doc.page_content
-                chunk_length = len(chunk_content)
-                
-                # Check if adding this chunk would exceed context limit
-                if total_context_length + chunk_length > max_context_length:
-                    print(f"--- [CONTEXT LIMIT] Stopping at {len(relevant_chunks)} chunks")
-                    break
-                
-                relevant_chunks.append(chunk_content)
-                total_context_length += chunk_length
-        
-        # If no results above threshold, try with lower threshold as fallback
-        if not relevant_chunks and score_threshold > 0.2:
-            print(f"--- [FALLBACK] No results with threshold {score_threshold}, trying 0.2")
-            return self.search(query_embedding, top_k, 0.2, max_context_length)
-        
-        print(f"--- [VECTOR_STORE] Found {len(self.metadata)} child docs. "
-              f"Returned {len(relevant_chunks)} relevant chunks ({total_context_length} chars total).")
-              
-        return relevant_chunks
+                dense_rows.append(idx)
+            elif score >= fallback_threshold:
+                fallback_rows.append(idx)
+
+        if not dense_rows and fallback_rows:
+            logger.debug("no results with threshold %s, using fallback %s", score_threshold, fallback_threshold)
+            dense_rows = fallback_rows
+
+        if lexical_rows is not None and len(lexical_rows):
+            # Chunks found by both retrievers rise to the top
+            dense_rows = reciprocal_rank_fusion([dense_rows, lexical_rows])
+        return dense_rows
+
+    def pack_rows(self, rows, max_context_length=None):
+        """Context segments for ranked rows: merged, deduplicated and within the token budget"""
+        return self.pack_rows_with_ids(rows, max_context_length)[0]
+
+    def pack_rows_with_ids(self, rows, max_context_length=None):
+        """(context segments, chunk ids of the rows packed into them) for ranked rows"""
+        relevant_chunks, packed_rows, stats = self.context_packer.pack(self.chunks, rows, max_context_length)
+        CONTEXT_TOKENS_SAVED.inc(max(0, stats["tokens_saved"]))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("context packed candidates=%d segments=%d merged=%d duplicates=%d skipped=%d "
+                         "tokens=%d tokens_saved=%d", stats['candidates'], stats['segments'], stats['merged'],
+                         stats['duplicates'], stats['skipped'], stats['tokens'], stats['tokens_saved'])
+        return relevant_chunks, self.ids_for_rows(packed_rows)
+
+def read_index_mmap(path):
+    """Load a FAISS index memory-mapped (read-only) where the index type supports it"""
+    flags = faiss.IO_FLAG_MMAP | getattr(faiss, 'IO_FLAG_READ_ONLY', 0)
+    try:
+        return faiss.read_index(path, flags)
+    except RuntimeError:
+        # Older FAISS builds can't mmap every index type
+        return faiss.read_index(path)
 
 # Global değişkene artık ihtiyacımız yok, siliyoruz.
\ No newline at end of file
@@ -0,0 +1,39 @@
+# vectors.py
+# Embedding matrices as FAISS wants them: C-contiguous float32 rows of unit length.
+# The embedding model already produces exactly that, so on the hot path these
+# helpers only look at the data; a copy is made only for foreign input.
+
+import faiss
+import numpy as np
+
+# Squared norms further than this from 1 are (re)normalized
+UNIT_NORM_TOLERANCE = 1e-4
+
+
+def as_matrix(embeddings):
+    """(n, d) C-contiguous float32 view of embeddings; copies only if dtype/layout differ"""
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    return np.ascontiguousarray(vectors)
+
+
+def is_unit(vectors):
+    squared_norms = np.einsum('ij,ij->i', vectors, vectors)
+    return bool(np.all(np.abs(squared_norms - 1.0) <= UNIT_NORM_TOLERANCE))
+
+
+def as_unit_vectors(embeddings):
+    """
+    (n, d) float32 matrix of L2-normalized rows for FAISS inner-product
+    search. Already normalized contiguous float32 input is returned as is (a
+    view, never written to); anything else is copied and normalized.
+    """
+    vectors = as_matrix(embeddings)
+    if len(vectors) == 0 or is_unit(vectors):
+        return vectors
+    if isinstance(embeddings, np.ndarray) and np.may_share_memory(vectors, embeddings):
+        # Don't normalize the caller's array in place
+        vectors = vectors.copy()
+    faiss.normalize_L2(vectors)
+    return vectors
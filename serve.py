@@ -0,0 +1,181 @@
+# Production serving mode: preforking multi-worker server
+#
+# The parent process imports the app and runs its warmup once (embedding model,
+# FAISS index snapshot, chunk store and LLM client), then forks N uvicorn
+# workers that share those pages copy-on-write. The workers' own lifespan
+# warmup then finds everything loaded and they are ready immediately.
+#
+# Usage: python serve.py --workers 4 --port 5001
+
+import argparse
+import gc
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+
+# Fewer malloc arenas means less allocator churn and fragmentation in the
+# workers, so more of the shared pages stay shared. glibc reads this at
+# startup, so re-exec once with it set.
+if os.getenv("MALLOC_ARENA_MAX") is None and os.getenv("SEM_SERVE_REEXEC") is None:
+    env = dict(os.environ, MALLOC_ARENA_MAX="2", SEM_SERVE_REEXEC="1")
+    os.execve(sys.executable, [sys.executable] + sys.argv, env)
+
+logger = logging.getLogger("serve")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="SEM Chatbot preforking server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5001)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--threads", "--torch-threads", dest="threads", type=int, default=1,
+                        help="Intra-op threads per worker for the embedding model (torch or onnx)")
+    parser.add_argument("--report-interval", type=int, default=60,
+                        help="Seconds between per-worker memory reports (0 disables)")
+    parser.add_argument("--log-level", default="info")
+    return parser.parse_args()
+
+
+def read_memory(pid):
+    """Return RSS/PSS/shared/private memory of a process in KB (Linux /proc)"""
+    memory = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].endswith(":"):
+                    memory[parts[0][:-1]] = int(parts[1])
+    except (FileNotFoundError, PermissionError):
+        return {}
+
+    return {
+        "rss_kb": memory.get("Rss", 0),
+        "pss_kb": memory.get("Pss", 0),
+        "shared_kb": memory.get("Shared_Clean", 0) + memory.get("Shared_Dirty", 0),
+        "private_kb": memory.get("Private_Clean", 0) + memory.get("Private_Dirty", 0),
+    }
+
+
+def report_memory(workers):
+    parent = read_memory(os.getpid())
+    if parent:
+        logger.info("memory parent pid=%d rss=%dMB", os.getpid(), parent['rss_kb'] // 1024)
+    total_pss = parent.get("pss_kb", 0)
+    for slot, pid in sorted(workers.items()):
+        usage = read_memory(pid)
+        if not usage:
+            continue
+        total_pss += usage["pss_kb"]
+        logger.info("memory worker %d pid=%d rss=%dMB shared=%dMB private=%dMB", slot, pid,
+                    usage['rss_kb'] // 1024, usage['shared_kb'] // 1024, usage['private_kb'] // 1024)
+    if total_pss:
+        logger.info("memory total pss=%dMB", total_pss // 1024)
+
+
+def create_socket(host, port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app, sock, args):
+    import uvicorn
+
+    # Each worker gets its own small thread budget instead of all of them
+    # fighting over every core. This also rebuilds the ONNX Runtime session,
+    # whose thread pool does not survive the fork.
+    from rag_chatbot.chatbot import embedding_fn
+    embedding_fn.set_threads(args.threads)
+
+    config = uvicorn.Config(app, log_level=args.log_level, access_log=False)
+    server = uvicorn.Server(config)
+    server.run(sockets=[sock])
+
+
+def spawn_worker(app, sock, args):
+    pid = os.fork()
+    if pid == 0:
+        # Child: restore default signal handling, uvicorn installs its own
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        try:
+            run_worker(app, sock, args)
+        finally:
+            os._exit(0)
+    return pid
+
+
+def main():
+    args = parse_args()
+    # Before importing app, so its basicConfig keeps this level
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(levelname)s %(name)s %(message)s")
+
+    logger.info("Loading model and vector store in the parent process...")
+    started = time.time()
+    from app import app
+    from rag_chatbot.chatbot import warmup
+    if not warmup.run():
+        sys.exit(f"ERROR: Warmup failed: {warmup.error}")
+    logger.info("Loaded in %.1fs %s", time.time() - started, warmup.timings)
+
+    # Move everything loaded so far into the permanent generation: the garbage
+    # collector then never touches these objects, so their pages are not
+    # written to (and copied) in the workers.
+    gc.collect()
+    gc.freeze()
+
+    sock = create_socket(args.host, args.port)
+    logger.info("Serving on http://%s:%d with %d workers", args.host, args.port, args.workers)
+
+    workers = {}  # slot -> pid
+    for slot in range(args.workers):
+        workers[slot] = spawn_worker(app, sock, args)
+
+    shutting_down = False
+
+    def handle_shutdown(signum, frame):
+        nonlocal shutting_down
+        shutting_down = True
+        for pid in workers.values():
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, handle_shutdown)
+    signal.signal(signal.SIGINT, handle_shutdown)
+
+    last_report = time.time()
+    while workers:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+
+        if pid:
+            slot = next((s for s, p in workers.items() if p == pid), None)
+            if slot is not None:
+                del workers[slot]
+                if not shutting_down:
+                    logger.warning("worker %d (pid=%d) exited with status %d, restarting", slot, pid, status)
+                    workers[slot] = spawn_worker(app, sock, args)
+            continue
+
+        if args.report_interval and time.time() - last_report >= args.report_interval:
+            report_memory(workers)
+            last_report = time.time()
+
+        time.sleep(0.5)
+
+    sock.close()
+    logger.info("All workers stopped.")
+
+
+if __name__ == "__main__":
+    main()